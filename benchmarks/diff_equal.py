@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Benchmark for Diff.equal
+
+Compares pairs of equal files, files with different sizes, files differing
+in their last byte and hard links.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from quilt.patch import Diff
+from quilt.utils import TmpDirectory
+
+PAIRS = 10000
+CONTENT = b"x" * 4000 + b"\n"
+
+
+def make_pairs(dirname, kind):
+    pairs = []
+    for i in range(PAIRS):
+        left = os.path.join(dirname, "%s-%d-left" % (kind, i))
+        right = os.path.join(dirname, "%s-%d-right" % (kind, i))
+        with open(left, "wb") as f:
+            f.write(CONTENT)
+        if kind == "link":
+            os.link(left, right)
+        else:
+            with open(right, "wb") as f:
+                if kind == "equal":
+                    f.write(CONTENT)
+                elif kind == "size":
+                    f.write(CONTENT + b"\n")
+                else:
+                    f.write(CONTENT[:-1] + b"-")
+        pairs.append(Diff(left, right))
+    return pairs
+
+
+def main():
+    print("%-8s %8s %10s" % ("pairs", "count", "msec"))
+    for kind in ("equal", "size", "last", "link"):
+        with TmpDirectory(prefix="pquilt-bench-") as tmpdir:
+            pairs = make_pairs(tmpdir.get_name(), kind)
+            start = time.time()
+            for diff in pairs:
+                diff.equal(tmpdir.get_name())
+            msec = (time.time() - start) * 1000
+            print("%-8s %8d %10.1f" % (kind, PAIRS, msec))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Benchmark for the file set operations of a synthetic 20k file patch
+
+Backs up all files of the patch with Backup.backup_file and restores them
+with RollbackPatch.rollback using different numbers of worker threads.
+Pass a directory on the file system to test e.g. a NFS mount.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from quilt.backup import Backup
+from quilt.patch import RollbackPatch
+from quilt.pool import FilePool
+from quilt.utils import TmpDirectory
+
+FILES = 20000
+DIRS = 200
+CONTENT = b"int main(void) { return 0; }\n" * 100
+
+
+def make_tree(dirname):
+    filenames = []
+    for i in range(FILES):
+        filename = os.path.join("dir%d" % (i % DIRS), "file%d.c" % i)
+        path = os.path.join(dirname, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(CONTENT)
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    dir = sys.argv[1] if len(sys.argv) > 1 else None
+    print("%-8s %10s %10s %10s" % ("workers", "backup", "rollback", "move"))
+    for workers in (1, 4, 16):
+        FilePool.workers = workers
+        with TmpDirectory(prefix="pquilt-bench-", dir=dir) as tmpdir:
+            work_dir = os.path.join(tmpdir.get_name(), "work")
+            pc_dir = os.path.join(tmpdir.get_name(), "pc")
+            filenames = make_tree(work_dir)
+            msecs = []
+
+            def backup(filename):
+                Backup().backup_file(os.path.join(work_dir, filename),
+                                     os.path.join(pc_dir,
+                                                  os.path.dirname(filename)))
+
+            start = time.time()
+            FilePool().map(backup, filenames)
+            msecs.append((time.time() - start) * 1000)
+
+            for move in (False, True):
+                start = time.time()
+                RollbackPatch(work_dir, pc_dir).rollback(move=move)
+                msecs.append((time.time() - start) * 1000)
+
+            print("%-8d %10.1f %10.1f %10.1f" % ((workers,) + tuple(msecs)))
+
+
+if __name__ == "__main__":
+    main()
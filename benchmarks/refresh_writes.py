@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Benchmark for the writes of Refresh
+
+Refreshes a synthetic patch changing 10k files with and without buffering
+the writes and prints the number of write calls and bytes written.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from quilt.db import Db
+from quilt.patch import Patch
+from quilt.refresh import Refresh
+from quilt.utils import BufferedWriter, TmpDirectory
+
+FILES = 10000
+CONTENT = b"".join(b"line %d\n" % i for i in range(20))
+
+
+def make_tree():
+    db = Db(".pc")
+    db.create()
+    os.makedirs(os.path.join(".pc", "patch"))
+    db.add_patch(Patch("patch"))
+    db.save()
+    for i in range(FILES):
+        name = "file%d" % i
+        with open(os.path.join(".pc", "patch", name), "wb") as f:
+            f.write(CONTENT)
+        with open(name, "wb") as f:
+            f.write(CONTENT.replace(b"line 10\n", b"changed\n"))
+
+
+def main():
+    print("%-10s %10s %12s %10s" % ("buffer", "syscalls", "bytes", "msec"))
+    cwd = os.getcwd()
+    for buffer_size in (0, BufferedWriter.buffer_size):
+        with TmpDirectory(prefix="pquilt-bench-") as tmpdir:
+            os.chdir(tmpdir.get_name())
+            try:
+                make_tree()
+                BufferedWriter.buffer_size = buffer_size
+                cmd = Refresh(tmpdir.get_name(), ".pc", ".")
+                start = time.time()
+                cmd.refresh()
+                msec = (time.time() - start) * 1000
+            finally:
+                os.chdir(cwd)
+            print("%-10d %10d %12d %10.1f" % (buffer_size,
+                                              cmd.writer.syscalls,
+                                              cmd.writer.bytes_written, msec))
+
+
+if __name__ == "__main__":
+    main()
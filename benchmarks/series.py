@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Benchmark for neighbour and range queries of a PatchSeries
+
+The latency of top_patch, patch_after, patch_before and patches_until should
+stay flat with a growing number of patches in the series.
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from quilt.db import PatchSeries
+from quilt.patch import Patch
+from quilt.utils import TmpDirectory
+
+SIZES = [100, 1000, 10000, 100000]
+NUMBER = 1000
+
+
+def make_series(dirname, size):
+    with open(os.path.join(dirname, "series"), "w") as f:
+        for i in range(size):
+            f.write("patch-%06d.patch\n" % i)
+    return PatchSeries(dirname, "series")
+
+
+def bench(series, size):
+    first = Patch("patch-%06d.patch" % 0)
+    middle = Patch("patch-%06d.patch" % (size // 2))
+    last = Patch("patch-%06d.patch" % (size - 1))
+    series.top_patch()  # build the index once
+
+    results = []
+    for name, func in [
+            ("top_patch", lambda: series.top_patch()),
+            ("patch_after", lambda: series.patch_after(middle)),
+            ("patch_before", lambda: series.patch_before(middle)),
+            ("patches_until(first)", lambda: series.patches_until(first)),
+            ("patch_after(last)", lambda: series.patch_after(last)),
+            ]:
+        t = timeit.timeit(func, number=NUMBER)
+        results.append((name, t / NUMBER * 1e6))
+    return results
+
+
+def main():
+    print("%-22s %10s %12s" % ("query", "patches", "usec/call"))
+    for size in SIZES:
+        with TmpDirectory(prefix="pquilt-bench-") as tmpdir:
+            series = make_series(tmpdir.get_name(), size)
+            for name, usec in bench(series, size):
+                print("%-22s %10d %12.2f" % (name, size, usec))
+
+
+if __name__ == "__main__":
+    main()
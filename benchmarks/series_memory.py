@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Benchmark for the memory usage and load time of a large series file
+
+Requires Python >= 3.4 for tracemalloc.
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from quilt.db import PatchSeries
+from quilt.utils import TmpDirectory
+
+SIZE = 100000
+
+
+def make_series_file(dirname, size):
+    with open(os.path.join(dirname, "series"), "w") as f:
+        for i in range(size):
+            if i % 10 == 0:
+                f.write("# comment %d\n" % i)
+            if i % 3 == 0:
+                f.write("patch-%06d.patch -p0 -R\n" % i)
+            else:
+                f.write("patch-%06d.patch\n" % i)
+
+
+def main():
+    with TmpDirectory(prefix="pquilt-bench-") as tmpdir:
+        make_series_file(tmpdir.get_name(), SIZE)
+
+        start = time.time()
+        PatchSeries(tmpdir.get_name(), "series")
+        load_time = time.time() - start
+
+        tracemalloc.start()
+        series = PatchSeries(tmpdir.get_name(), "series")
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print("lines:     %d" % len(series.patchlines))
+        print("load time: %.1f ms" % (load_time * 1000))
+        print("memory:    %.1f MB (peak %.1f MB)" % (current / 1e6,
+                                                      peak / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,10 @@ import stat
 
 from quilt.backup import Backup
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import QuiltError, NoAppliedPatch
+from quilt.patch import Patch
 from quilt.signals import Signal
-from quilt.utils import Directory, File
+from quilt.utils import File
 
 
 class Add(Command):
@@ -24,12 +24,8 @@ class Add(Command):
 
     file_added = Signal()
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Add, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Add, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
     def _file_in_patch(self, filename, patch, ignore):
         """ Checks if a backup file of the filename in the current patch
@@ -43,22 +39,6 @@ class Add(Command):
                                  patch.get_name()))
         return False
 
-    def _file_in_next_patches(self, filename, patch):
-        """ Checks if a backup file of the filename in the applied patches after
-        patch exists """
-
-        if not self.db.is_patch(patch):
-            # no patches applied
-            return
-
-        patches = self.db.patches_after(patch)
-        for patch in patches:
-            file = self.quilt_pc + File(os.path.join(patch.get_name(),
-                                                     filename))
-            if file.exists():
-                raise QuiltError("File %s is already modified by patch %s" %
-                                 (filename, patch.get_name()))
-
     def _backup_file(self, file, patch):
         """ Creates a backup of file """
         dest_dir = self.quilt_pc + patch.get_name()
@@ -66,29 +46,22 @@ class Add(Command):
         if file_dir:
             #TODO get relative path
             dest_dir = dest_dir + file_dir
-        backup = Backup()
+        # the file may be changed in place afterwards, so the backup must
+        # never be a hard link to it
+        backup = Backup(link=False)
         backup.backup_file(file, dest_dir, copy_empty=True)
 
-    def add_file(self, filename, patch_name=None, ignore=False):
-        """ Add file to the patch with patch_name.
-        If patch_name is None or empty the topmost patch will be used.
-        Adding an already added patch will raise an QuiltError if ignore is
-        False.
-        """
+    def _add_file(self, filename, patch, ignore, index):
         file = File(filename)
 
-        if patch_name:
-            patch = Patch(patch_name)
-        else:
-            patch = self.db.top_patch()
-            if not patch:
-                raise NoAppliedPatch(self.db)
-
         exists = self._file_in_patch(filename, patch, ignore)
         if exists:
             return
 
-        self._file_in_next_patches(filename, patch)
+        next_patch = self.db.file_in_next_patches(filename, patch, index)
+        if next_patch:
+            raise QuiltError("File %s is already modified by patch %s" %
+                             (filename, next_patch.get_name()))
 
         if file.is_link():
             raise QuiltError("Cannot add symbolic link %s" % filename)
@@ -101,6 +74,27 @@ class Add(Command):
 
         self.file_added(file, patch)
 
+    def add_file(self, filename, patch_name=None, ignore=False):
+        """ Add file to the patch with patch_name.
+        If patch_name is None or empty the topmost patch will be used.
+        Adding an already added patch will raise an QuiltError if ignore is
+        False.
+        """
+        self.add_files([filename], patch_name, ignore)
+
     def add_files(self, filenames, patch_name=None, ignore=False):
+        """ Add files to the patch with patch_name like add_file.
+        For many files the backups of the applied patches after the patch are
+        looked up once for all files.
+        """
+        if patch_name:
+            patch = Patch(patch_name)
+        else:
+            patch = self.db.top_patch()
+            if not patch:
+                raise NoAppliedPatch(self.db)
+
+        filenames = list(filenames)
+        index = self.db.next_patches_index(patch, len(filenames))
         for filename in filenames:
-            self.add_file(filename, patch_name, ignore)
+            self._add_file(filename, patch, ignore, index)
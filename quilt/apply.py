@@ -0,0 +1,559 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" In-process application of unified diffs
+
+This module implements the subset of GNU patch used by python-quilt. It
+supports the strip level, reversed patches, offsets and fuzz, backups with a
+prefix, dry runs, removing empty files and rejects. Patches containing other
+constructs raise an UnsupportedPatch error before any file is changed, so the
+caller can fall back to GNU patch.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import stat
+
+from quilt.patchfile import DEV_NULL, UnsupportedPatch, parse_patch
+from quilt.utils import AtomicFile, File, default_file_mode, split_lines
+
+MAX_FUZZ = 2
+
+if hasattr(os, "fsdecode"):
+    _fsdecode = os.fsdecode
+else:  # Python < 3.2
+    def _fsdecode(name):
+        return name
+
+
+def strip_name(name, strip):
+    """ Strips strip leading components from the file name like GNU patch
+    does. Returns None for /dev/null. Raises UnsupportedPatch if the name has
+    less components or if the stripped name would point outside of the
+    working directory.
+    """
+    if name == DEV_NULL:
+        return None
+    strip = int(strip)
+    parts = re.split(b"/+", name)
+    if strip:
+        if len(parts) <= strip:
+            raise UnsupportedPatch("can't strip %d components from %s" %
+                                   (strip, _fsdecode(name)))
+        parts = parts[strip:]
+        name = b"/".join(parts)
+    if name.startswith(b"/") or b".." in parts:
+        raise UnsupportedPatch("dangerous file name %s" % _fsdecode(name))
+    return _fsdecode(name)
+
+
+def _pluralize(count, word):
+    if count == 1:
+        return "%d %s" % (count, word)
+    return "%d %ss" % (count, word)
+
+
+class FileResult(object):
+
+    """ Result of applying the hunks of a FilePatch to the content of a file
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.failed = []
+        self.mismatch = False  # some hunks needed an offset or fuzz
+        self.messages = []
+
+
+def _match(lines, old, where, prefix_fuzz, suffix_fuzz):
+    """ Returns True if old without prefix_fuzz leading and suffix_fuzz
+    trailing lines matches lines if old starts at where """
+    begin = where + prefix_fuzz
+    end = where + len(old) - suffix_fuzz
+    if begin < 0 or end > len(lines):
+        return False
+    if begin < end and lines[begin] != old[prefix_fuzz]:
+        return False
+    return lines[begin:end] == old[prefix_fuzz:len(old) - suffix_fuzz]
+
+
+def locate_hunk(lines, hunk, first_guess, fuzz, frozen):
+    """ Returns the position of the start of hunk in lines nearest to
+    first_guess or None if the hunk can't be found with fuzz. The lines
+    before frozen have already been written.
+
+    This is a port of locate_hunk of GNU patch. fuzz lines of context are
+    ignored, starting with the side having more context. If a hunk has less
+    leading than trailing context it must match at the start of the file if
+    it starts at the first line and vice versa at the end of the file.
+    """
+    pat_lines = len(hunk.old)
+    prefix_context = hunk.leading
+    suffix_context = hunk.trailing
+    context = max(prefix_context, suffix_context)
+    prefix_fuzz = fuzz + prefix_context - context
+    suffix_fuzz = fuzz + suffix_context - context
+    max_where = len(lines) - pat_lines + suffix_fuzz
+    max_pos_offset = max_where - first_guess
+    max_neg_offset = first_guess - frozen
+    max_offset = max(max_pos_offset, max_neg_offset)
+
+    if not pat_lines:
+        # an empty range matches always
+        return min(max(first_guess, frozen), len(lines))
+
+    # don't try positions before the start of the file
+    max_neg_offset = min(max_neg_offset, first_guess)
+
+    if prefix_fuzz < 0 and hunk.old_start <= 1:
+        # can only match the start of the file
+        if suffix_fuzz < 0 and (pat_lines != len(lines) or
+                                prefix_context < frozen):
+            # can only match the entire file
+            return None
+        if frozen <= prefix_context and -first_guess <= max_pos_offset \
+                and _match(lines, hunk.old, 0, 0, max(suffix_fuzz, 0)):
+            return 0
+        return None
+    prefix_fuzz = max(prefix_fuzz, 0)
+
+    if suffix_fuzz < 0:
+        # can only match the end of the file
+        offset = first_guess - (len(lines) - pat_lines)
+        if offset <= max_neg_offset and \
+                _match(lines, hunk.old, first_guess - offset, prefix_fuzz, 0):
+            return first_guess - offset
+        return None
+
+    for offset in range(max_offset + 1):
+        if offset <= max_pos_offset and _match(
+                lines, hunk.old, first_guess + offset, prefix_fuzz,
+                suffix_fuzz):
+            return first_guess + offset
+        if 0 < offset <= max_neg_offset and _match(
+                lines, hunk.old, first_guess - offset, prefix_fuzz,
+                suffix_fuzz):
+            return first_guess - offset
+    return None
+
+
+def apply_hunks(lines, hunks, max_fuzz=MAX_FUZZ):
+    """ Applies hunks to lines like GNU patch and returns a FileResult """
+    result = FileResult([])
+    out = result.lines
+    frozen = 0  # number of lines of lines already written to out
+    in_offset = 0  # offset of the last hunk found
+
+    for number, hunk in enumerate(hunks, 1):
+        if hunk.old_len:
+            expected = hunk.old_start - 1
+        else:
+            expected = hunk.old_start
+
+        max_hunk_fuzz = min(max_fuzz, max(hunk.leading, hunk.trailing))
+        for fuzz in range(max_hunk_fuzz + 1):
+            where = locate_hunk(lines, hunk, expected + in_offset, fuzz,
+                                frozen)
+            if where is not None:
+                break
+
+        if where is None:
+            result.failed.append(hunk)
+            result.mismatch = True
+            result.messages.append("Hunk #%d FAILED at %d." %
+                                   (number, expected + 1))
+            continue
+
+        in_offset = where - expected
+        # the context lines are kept from lines, even if they differ with
+        # fuzz
+        start = where + hunk.leading
+        out.extend(lines[frozen:start])
+        if in_offset or fuzz:
+            result.mismatch = True
+            msg = "Hunk #%d succeeded at %d" % (number,
+                                                len(out) + 1 - hunk.leading)
+            if fuzz:
+                msg += " with fuzz %d" % fuzz
+            if in_offset:
+                msg += " (offset %s)" % _pluralize(in_offset, "line")
+            result.messages.append(msg + ".")
+        out.extend(hunk.new[hunk.leading:len(hunk.new) - hunk.trailing])
+        frozen = where + len(hunk.old) - hunk.trailing
+
+    out.extend(lines[frozen:])
+    return result
+
+
+def remove_file(work_dir, name):
+    """ Removes the file name in work_dir and its parent directories if they
+    are empty like GNU patch does """
+    path = os.path.join(work_dir, name)
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(name)
+    while directory:
+        try:
+            os.rmdir(os.path.join(work_dir, directory))
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def write_file(path, lines, mode=None):
+    """ Replaces the file path atomically with lines. Missing parent
+    directories are created. If mode is None the mode of the current file is
+    kept. """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with AtomicFile(path, mode=mode) as f:
+        f.write(b"".join(lines))
+
+
+class PatchApplier(object):
+
+    """ Applies a patch file in the directory work_dir
+
+    The arguments correspond to the options of GNU patch. If backup_prefix is
+    set the original file is copied to backup_prefix + file name before it is
+    changed. A missing original file results in an empty backup file.
+    mismatch is set if a hunk needed an offset or fuzz to apply.
+    """
+
+    def __init__(self, patch_file, work_dir, strip=1, reverse=False,
+                 backup_prefix=None, force=False, dry_run=False,
+                 no_backup_if_mismatch=False, remove_empty_files=False,
+                 quiet=False, suppress_output=False):
+        self.patch_file = patch_file
+        self.work_dir = work_dir
+        self.strip = strip
+        self.reverse = reverse
+        self.backup_prefix = backup_prefix
+        self.force = force
+        self.dry_run = dry_run
+        self.no_backup_if_mismatch = no_backup_if_mismatch
+        self.remove_empty_files = remove_empty_files
+        self.quiet = quiet
+        self.suppress_output = suppress_output
+        self.backed_up = set()
+        self.mismatch = False
+
+    def _print(self, msg, error=False):
+        if self.suppress_output or (self.quiet and not error):
+            return
+        print(msg)
+
+    def _path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def _exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def _lexists(self, name):
+        return os.path.lexists(self._path(name))
+
+    def _choose_target(self, file_patch):
+        """ Returns the file name to patch. The name is relative to work_dir
+        """
+        old_name = strip_name(file_patch.old_name, self.strip)
+        new_name = strip_name(file_patch.new_name, self.strip)
+        if file_patch.is_new():
+            return new_name
+
+        names = [old_name, new_name]
+        if file_patch.index_name:
+            names.append(strip_name(file_patch.index_name, self.strip))
+        names = [name for name in names if name]
+        existing = [name for name in names if self._lexists(name)]
+        if not existing:
+            return old_name or new_name
+
+        def key(name):
+            return (name.count("/"), len(os.path.basename(name)), len(name))
+        return min(existing, key=key)
+
+    def _check_target(self, file_patch, name):
+        path = self._path(name)
+        if os.path.islink(path) or \
+                (os.path.lexists(path) and not os.path.isfile(path)):
+            raise UnsupportedPatch("%s is not a regular file" % name)
+        if file_patch.is_new() and os.path.exists(path) and \
+                os.path.getsize(path):
+            raise UnsupportedPatch("new file %s already exists" % name)
+
+    def read_patch(self):
+        """ Parses the patch file and returns a list of (file name,
+        FilePatch) tuples. Raises UnsupportedPatch if the patch can't be
+        applied by this class.
+        """
+        path = self._path(self.patch_file)
+        with open(path, "rb") as f:
+            file_patches = parse_patch(f)
+        if not file_patches and os.path.getsize(path):
+            raise UnsupportedPatch("no unified diff found")
+
+        targets = []
+        for file_patch in file_patches:
+            if self.reverse:
+                file_patch = file_patch.reversed()
+            name = self._choose_target(file_patch)
+            self._check_target(file_patch, name)
+            targets.append((name, file_patch))
+        return targets
+
+    def _backup(self, name):
+        if not self.backup_prefix or name in self.backed_up:
+            return
+        self.backed_up.add(name)
+        orig = File(self._path(name))
+        backup = File(self._path(self.backup_prefix + name))
+        if orig.exists():
+            # the original file is replaced and not changed in place
+            orig.link_or_copy(backup)
+        else:
+            directory = backup.get_directory()
+            if directory:
+                directory.create()
+            backup.touch()
+
+    def _remove(self, name):
+        remove_file(self.work_dir, name)
+
+    def _write(self, name, lines):
+        write_file(self._path(name), lines)
+
+    def _write_rejects(self, name, hunks):
+        encoded = name.encode("utf-8") if not isinstance(name, bytes) \
+            else name
+        with open(self._path(name + ".rej"), "wb") as f:
+            f.write(b"--- " + encoded + b"\n+++ " + encoded + b"\n")
+            for hunk in hunks:
+                f.write(b"".join(hunk.text))
+
+    def _read_lines(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            return split_lines(f.read())
+
+    def patch_file_content(self, name, file_patch):
+        """ Applies file_patch to the file name and writes the result unless
+        this is a dry run. Returns False if hunks failed.
+        """
+        if self.dry_run:
+            self._print("checking file %s" % name)
+        else:
+            self._print("patching file %s" % name)
+
+        if not file_patch.is_new() and not self._exists(name):
+            self._print("can't find file to patch at input line %d" %
+                        (file_patch.lineno or 0), error=True)
+            self._print("No file to patch.  Skipping patch.", error=True)
+            self._print("%s ignored" % _pluralize(len(file_patch.hunks),
+                                                  "hunk"), error=True)
+            return False
+
+        result = apply_hunks(self._read_lines(name), file_patch.hunks)
+        if result.mismatch:
+            self.mismatch = True
+        for msg in result.messages:
+            self._print(msg, error=bool(result.failed))
+
+        if not self.dry_run:
+            self._backup(name)
+            if result.mismatch and not self.backup_prefix and \
+                    not self.no_backup_if_mismatch and self._exists(name):
+                File(self._path(name)).link_or_copy(
+                    File(self._path(name + ".orig")))
+
+            if not result.lines and (self.remove_empty_files or
+                                     file_patch.is_deleted()):
+                self._remove(name)
+            else:
+                self._write(name, result.lines)
+
+        if result.failed:
+            msg = "%d out of %s FAILED" % (len(result.failed), _pluralize(
+                len(file_patch.hunks), "hunk"))
+            if not self.dry_run:
+                self._write_rejects(name, result.failed)
+                msg += " -- saving rejects to file %s.rej" % name
+            self._print(msg, error=True)
+            return False
+        return True
+
+    def apply(self):
+        """ Applies the patch. Returns False if hunks failed. """
+        targets = self.read_patch()
+        success = True
+        for name, file_patch in targets:
+            if not self.patch_file_content(name, file_patch):
+                success = False
+        return success
+
+
+def _file_mode(path):
+    """ Returns the permission bits of the file path or None if it doesn't
+    exist """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return None
+
+
+# state of a file which hasn't been changed by the patches of a StackApplier
+_ON_DISK = object()
+
+
+class _StackPatchApplier(PatchApplier):
+
+    """ Applies a patch on top of the in-memory contents of a StackApplier
+    """
+
+    def __init__(self, stack, patch_file, **kwargs):
+        super(_StackPatchApplier, self).__init__(patch_file, stack.work_dir,
+                                                 **kwargs)
+        self.stack = stack
+        self.changes = dict()
+        # contents of the files before the patch
+        self.backups = dict()
+
+    def _state(self, name):
+        if name in self.changes:
+            return self.changes[name]
+        return self.stack.contents.get(name, _ON_DISK)
+
+    def _exists(self, name):
+        state = self._state(name)
+        if state is _ON_DISK:
+            return super(_StackPatchApplier, self)._exists(name)
+        return state is not None
+
+    def _lexists(self, name):
+        state = self._state(name)
+        if state is _ON_DISK:
+            return super(_StackPatchApplier, self)._lexists(name)
+        return state is not None
+
+    def _check_target(self, file_patch, name):
+        state = self._state(name)
+        if state is _ON_DISK:
+            super(_StackPatchApplier, self)._check_target(file_patch, name)
+        elif file_patch.is_new() and state:
+            raise UnsupportedPatch("new file %s already exists" % name)
+
+    def _read_lines(self, name):
+        state = self._state(name)
+        if state is _ON_DISK:
+            return super(_StackPatchApplier, self)._read_lines(name)
+        return list(state or [])
+
+    def _backup(self, name):
+        if not self.backup_prefix or name in self.backed_up:
+            return
+        self.backed_up.add(name)
+        self.backups[name] = self.stack.contents.get(name, _ON_DISK)
+
+    def _remove(self, name):
+        self.changes[name] = None
+
+    def _write(self, name, lines):
+        self.changes[name] = lines
+
+
+class StackApplier(object):
+
+    """ Applies a stack of patches to the files in work_dir in memory
+
+    The contents of the changed files are kept in memory until flush writes
+    each of them once. The backups of a patch are created from the contents
+    before the patch, so changed files are never read back from work_dir.
+    """
+
+    def __init__(self, work_dir, quiet=False, suppress_output=False):
+        self.work_dir = work_dir
+        self.quiet = quiet
+        self.suppress_output = suppress_output
+        # file name -> list of lines or None if the file has been removed
+        self.contents = dict()
+        # file name -> mode of the file in contents or None if unknown
+        self.modes = dict()
+        self._pending = None
+        self.mismatch = False
+
+    def apply(self, patch_file, backup_prefix, strip=1, reverse=False):
+        """ Applies patch_file on top of the previously applied patches and
+        returns False if hunks failed. The changes have to be committed or
+        discarded before the next patch is applied. Raises UnsupportedPatch
+        before anything is changed. mismatch is set if a hunk of patch_file
+        needed an offset or fuzz.
+        """
+        applier = _StackPatchApplier(self, patch_file, strip=strip,
+                                     reverse=reverse,
+                                     backup_prefix=backup_prefix,
+                                     quiet=self.quiet,
+                                     suppress_output=self.suppress_output)
+        self._pending = applier
+        success = applier.apply()
+        self.mismatch = applier.mismatch
+        return success
+
+    def commit(self):
+        """ Writes the backups of the last applied patch and keeps its
+        changes """
+        applier = self._pending
+        self._pending = None
+        for name, state in applier.backups.items():
+            backup = File(os.path.join(self.work_dir,
+                                       applier.backup_prefix + name))
+            path = os.path.join(self.work_dir, name)
+            if state is _ON_DISK:
+                if os.path.exists(path):
+                    # the file is replaced by flush
+                    File(path).link_or_copy(backup)
+                    continue
+                state = None
+            if state:
+                write_file(backup.get_name(), state, self.modes[name])
+            else:
+                directory = backup.get_directory()
+                if directory:
+                    directory.create()
+                backup.touch()
+
+        for name, lines in applier.changes.items():
+            if name not in self.contents:
+                path = os.path.join(self.work_dir, name)
+                self.modes[name] = _file_mode(path)
+            if lines is None:
+                # a file created again gets the default mode
+                self.modes[name] = default_file_mode()
+        self.contents.update(applier.changes)
+
+    def discard(self):
+        """ Drops the changes of the last applied patch """
+        self._pending = None
+
+    def flush(self):
+        """ Writes all changed files to work_dir """
+        contents = self.contents
+        modes = self.modes
+        self.contents = dict()
+        self.modes = dict()
+        for name in sorted(contents):
+            lines = contents[name]
+            if lines is None:
+                remove_file(self.work_dir, name)
+            else:
+                write_file(os.path.join(self.work_dir, name), lines,
+                           modes[name])
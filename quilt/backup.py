@@ -6,6 +6,7 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
+from quilt.pool import FilePool
 from quilt.utils import File, DirectoryParam, FileParam
 
 
@@ -15,8 +16,18 @@ class Backup(object):
 
     This class should be exented in future to support all functions of quilts
     backup-files script.
+
+    If link is True the backups are hard links to the original files where
+    possible. This is only safe if the original files are replaced instead
+    of being changed in place later on, like patch does.
     """
 
+    link = False
+
+    def __init__(self, link=None):
+        if link is not None:
+            self.link = link
+
     @DirectoryParam(["dest_dir"])
     @FileParam(["file"])
     def backup_file(self, file, dest_dir, copy_empty=False):
@@ -35,7 +46,10 @@ class Backup(object):
             if not copy_empty and file.is_empty():
                 return None
             dest_dir.create()
-            file.copy(dest_dir)
+            if self.link:
+                file.link_or_copy(dest_dir)
+            else:
+                file.copy(dest_dir)
             return dest_dir + file.get_basefile()
         elif copy_empty:
             # create new file in dest_dir
@@ -49,18 +63,20 @@ class Backup(object):
 
     @DirectoryParam(["src_dir", "dest_dir"])
     def backup_files(self, src_dir, dest_dir, filenames, copy_empty=False):
-        for filename in filenames:
+        def backup(filename):
             src_file = src_dir + File(filename)
 
             if not src_file.exists():
-                continue
+                return
             if src_file.is_empty() and not copy_empty:
-                continue
+                return
             self.backup_file(src_file, dest_dir)
 
+        FilePool().map(backup, filenames)
+
     @DirectoryParam(["src_dir", "dest_dir"])
     def backup_dir(self, src_dir, dest_dir, copy_empty=False):
-        for file_name in src_dir.files():
+        def backup(file_name):
             file = File(file_name)
             file_dir = file.get_directory()
             if file_dir:
@@ -68,3 +84,5 @@ class Backup(object):
             else:
                 dest = dest_dir
             self.backup_file(file, dest, copy_empty)
+
+        FilePool().map(backup, src_dir.files())
@@ -0,0 +1,107 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Persistent cache for parsed series and patch files """
+
+import hashlib
+import marshal
+import os
+import os.path
+import time
+
+from quilt.utils import AtomicFile
+
+CACHE_VERSION = 2
+
+# Files modified less than RACY_TIME seconds before they are read are not
+# cached. A later modification within the resolution of the file system
+# timestamps could not be detected otherwise.
+RACY_TIME = 1
+
+
+def _file_key(st):
+    """ Returns the key to validate a cache entry from a stat result """
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:  # Python < 3.3
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return (st.st_size, mtime_ns, st.st_ino)
+
+
+class SeriesCache(object):
+
+    """ Stores the parsed content of series files and the indexes of patch
+    files in cache_dir
+
+    A cache entry is only used if the size, the modification time and the
+    inode of the series file are unchanged since the entry has been stored.
+    The entries are written with marshal and only contain builtin types.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_file(self, filename):
+        path = os.path.abspath(filename)
+        digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, ".pquilt-cache",
+                            "%s-%s" % (os.path.basename(path), digest))
+
+    def load(self, filename, st):
+        """ Returns the cached data of filename or None if the cache entry is
+        missing or outdated. st must be the stat result of the opened
+        filename.
+        """
+        try:
+            with open(self._cache_file(filename), "rb") as f:
+                version, key, data = marshal.loads(f.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            version = key = data = None
+
+        if version != CACHE_VERSION or key != _file_key(st):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def store(self, filename, st, data):
+        """ Stores data for filename. st must be the stat result of the
+        opened filename before its content has been read.
+        """
+        if st.st_mtime > time.time() - RACY_TIME:
+            return
+        if not os.path.isdir(self.cache_dir):
+            # don't create the cache_dir e.g. .pc
+            return
+        cache_file = self._cache_file(filename)
+        try:
+            dirname = os.path.dirname(cache_file)
+            if not os.path.isdir(dirname):
+                os.mkdir(dirname)
+            with AtomicFile(cache_file) as f:
+                data = (CACHE_VERSION, _file_key(st), data)
+                f.write(marshal.dumps(data, 2))
+        except (IOError, OSError):
+            pass
+
+    def hit_rate(self):
+        """ Returns the fraction of successful lookups or None if the cache
+        hasn't been used yet
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return float(self.hits) / lookups
+
+    def __str__(self):
+        rate = self.hit_rate()
+        return "series cache %s: %d hits, %d misses (%s)" % (
+            self.cache_dir, self.hits, self.misses,
+            "n/a" if rate is None else "%d%%" % (rate * 100))
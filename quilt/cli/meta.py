@@ -14,7 +14,15 @@ import sys
 
 import quilt
 
-from quilt.db import Db, Series
+from quilt.cache import SeriesCache
+from quilt.db import Db, PatchSeries, Series
+from quilt.patch import Diff, Patch, ENGINES
+from quilt.patchfile import PatchIndex
+from quilt.pool import FilePool
+from quilt.pop import Pop
+from quilt.push import Push
+from quilt.refresh import Refresh
+from quilt.utils import FSYNC_POLICIES
 
 from quilt.cli.parser import Parser, SubParser, ArgumentsCollectorMetaClass, \
                              Argument
@@ -111,7 +119,41 @@ class QuiltCli(Parser):
 
     def run(self):
         args = self.parse_args()
-        if args.command:
-            args.run(args)
-        else:
-            self.print_usage()
+        fsync = os.environ.get("QUILT_FSYNC")
+        if fsync:
+            if fsync not in FSYNC_POLICIES:
+                self.parser.error("invalid QUILT_FSYNC value %s (choose from "
+                                  "%s)" % (fsync, ", ".join(FSYNC_POLICIES)))
+            PatchSeries.fsync = fsync
+        for name, cls in (("QUILT_PATCH_ENGINE", Patch),
+                          ("QUILT_DIFF_ENGINE", Diff)):
+            engine = os.environ.get(name)
+            if engine:
+                if engine not in ENGINES:
+                    self.parser.error("invalid %s value %s (choose from %s)" %
+                                      (name, engine, ", ".join(ENGINES)))
+                cls.engine = engine
+        for name, cls, attr in (("QUILT_WORKERS", FilePool, "workers"),
+                                ("QUILT_DIFF_WORKERS", Refresh,
+                                 "diff_workers")):
+            workers = os.environ.get(name)
+            if workers:
+                if not workers.isdigit() or int(workers) < 1:
+                    self.parser.error("invalid %s value %s (must be a "
+                                      "positive number)" % (name, workers))
+                setattr(cls, attr, int(workers))
+        if os.environ.get("QUILT_COLLAPSE"):
+            Pop.collapse = Push.collapse = True
+        if os.environ.get("QUILT_INCREMENTAL_REFRESH"):
+            Refresh.incremental = True
+        if os.environ.get("QUILT_SERIES_CACHE"):
+            pc_dir = os.environ.get("QUILT_PC") or ".pc"
+            PatchSeries.cache = PatchIndex.cache = SeriesCache(pc_dir)
+        try:
+            if args.command:
+                args.run(args)
+            else:
+                self.print_usage()
+        finally:
+            if os.environ.get("QUILT_DEBUG") and PatchSeries.cache:
+                print(PatchSeries.cache, file=sys.stderr)
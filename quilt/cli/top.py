@@ -17,8 +17,7 @@ class TopCommand(Command):
            "applied patches."
 
     def run(self, args):
-        db = Db(self.get_pc_dir())
-        top = db.top_patch()
+        top = Db.read_top_patch(self.get_pc_dir())
         if not top:
             self.exit_error("No patches applied.")
 
@@ -6,11 +6,31 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
+from quilt.session import Session
+
 
 class Command(object):
 
-    def __init__(self, cwd):
+    def __init__(self, cwd, quilt_pc=None, quilt_patches=None, session=None):
+        """ Commands working on the quilt meta data share the applied patches
+        and the series of session. If session is None a new session for
+        quilt_pc and quilt_patches is created.
+        """
         self.cwd = cwd
+        if session is None and quilt_pc is not None:
+            session = Session(quilt_pc, quilt_patches)
+        self.session = session
+        if session is not None:
+            self.quilt_pc = session.quilt_pc
+            self.quilt_patches = session.quilt_patches
+
+    @property
+    def db(self):
+        return self.session.db
+
+    @property
+    def series(self):
+        return self.session.series
 
     def run(self):
         pass
@@ -6,19 +6,21 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
-from __future__ import print_function
-
-import getopt
 import os.path
 import six
-import sys
+
+from array import array
 
 from quilt.error import QuiltError, UnknownPatch
 from quilt.patch import Patch
-from quilt.utils import _encode_str
+from quilt.utils import AtomicFile, File, FSYNC_ALWAYS, FSYNC_COMMAND, \
+                        _encode_str, _decode_str
 
 DB_VERSION = 2
 
+# block size for reading files backwards
+TAIL_BLOCK_SIZE = 4096
+
 
 class DBError(QuiltError):
     pass
@@ -28,6 +30,8 @@ class PatchLine(object):
 
     """ Represents a line in a series files """
 
+    __slots__ = ("comment", "patch", "line")
+
     def __init__(self, patch):
         """ patch can be either a string or a Patch object """
         self.comment = ""
@@ -43,46 +47,51 @@ class PatchLine(object):
         line = line.rstrip("\r\n")
         self.line = line
 
-        if line.rstrip().startswith("#"):
-            self.comment = line
-            return
-
-        if not line.strip():
-            # empty line
-            return
-
         if "#" in line:
+            if line.startswith("#"):
+                self.comment = line
+                return
             patchline, self.comment = line.split("#", 1)
         else:
             patchline = line
 
         patchline = patchline.strip()
         if not patchline:
+            # empty line
             return
 
-        patch_args = None
-        strip = 1
-        reverse = False
-
         if " " in patchline:
             patch_name, patch_args = patchline.split(" ", 1)
+            # the patch options are parsed on demand
+            self.patch = Patch.from_args(patch_name, patch_args)
+        else:
+            self.patch = Patch(patchline)
+
+    @classmethod
+    def _from_cache(cls, entry):
+        """ Creates a PatchLine from an entry returned by _cache_entry """
+        line, comment, patch_name, patch_args = entry
+        patchline = cls.__new__(cls)
+        patchline.line = line
+        patchline.comment = comment
+        if patch_name is None:
+            patchline.patch = None
+        elif patch_args is None:
+            patchline.patch = Patch(patch_name)
         else:
-            patch_name = patchline
-
-        if patch_args:
-            patch_args = patch_args.split()
-            try:
-                opts, args = getopt.getopt(patch_args, "p:R", ["strip=",
-                                                               "reverse"])
-                for o, a in opts:
-                    if o in ["-p", "--strip"]:
-                        strip = a
-                    elif o in ["-R", "--reverse"]:
-                        reverse = True
-            except getopt.GetoptError as err:
-                print(err, file=sys.stderr)
-
-        self.patch = Patch(patch_name, strip, reverse)
+            patchline.patch = Patch.from_args(patch_name, patch_args)
+        return patchline
+
+    def _cache_entry(self):
+        """ Returns the parsed line as a tuple of builtin types """
+        patch = self.patch
+        if patch is None:
+            return (self.line, self.comment, None, None)
+        args = patch._args
+        if args is None and (patch.strip != 1 or patch.reverse):
+            # options have been parsed already
+            args = "-p%s%s" % (patch.strip, " -R" if patch.reverse else "")
+        return (self.line, self.comment, patch.get_name(), args)
 
     def get_patch(self):
         return self.patch
@@ -99,16 +108,66 @@ class PatchLine(object):
 
 class PatchSeries(object):
 
+    # when to fsync the series file. See FSYNC_POLICIES in quilt.utils
+    fsync = FSYNC_COMMAND
+
+    # optional quilt.cache.SeriesCache to load the parsed series from
+    cache = None
+
     def __init__(self, dirname, filename):
         self.dirname = dirname
         self.filename = filename
         self.series_file = os.path.join(dirname, filename)
+        self._needs_sync = False
         self.read()
 
     def _check_patch(self, patch):
         if not self.is_patch(patch):
             raise UnknownPatch(self, patch)
 
+    def _mark_dirty(self, index):
+        """ Marks the patchlines from index on as differing from the content
+        of the series file
+        """
+        self._dirty_from = min(self._dirty_from, index)
+
+    def _invalidate_index(self):
+        """ Drops the position index. It is rebuilt on the next lookup. """
+        self._patches = None
+        self._patch_index = None
+        self._line_index = None
+
+    def _build_index(self):
+        """ Builds the list of patches and the mappings of each patch to its
+        position in the patches list and in the patchlines list
+        """
+        if self._patches is not None:
+            return
+        patches = []
+        patch_index = dict()
+        line_index = dict()
+        for index, patchline in enumerate(self.patchlines):
+            patch = patchline.get_patch()
+            if patch:
+                patch_index[patch] = len(patches)
+                line_index[patch] = index
+                patches.append(patch)
+        self._patches = patches
+        self._patch_index = patch_index
+        self._line_index = line_index
+
+    def _patch_pos(self, patch):
+        """ Returns the position of patch in the list of patches """
+        self._check_patch(patch)
+        self._build_index()
+        return self._patch_index[patch]
+
+    def _line_pos(self, patch):
+        """ Returns the position of the line of patch in the patchlines """
+        self._check_patch(patch)
+        self._build_index()
+        return self._line_index[patch]
+
     def exists(self):
         """ Returns True if series file exists """
         return os.path.exists(self.series_file)
@@ -117,32 +176,120 @@ class PatchSeries(object):
         """ Reads all patches from the series file """
         self.patchlines = []
         self.patch2line = dict()
-        if self.exists():
-            with open(self.series_file, "r") as f:
-                for line in f:
-                    self.add_patch(line)
+        # byte offsets of the line endings in the series file
+        self._line_ends = array("L")
+        self._dirty_from = 0
+        self._invalidate_index()
+        if not self.exists():
+            return
+
+        with open(self.series_file, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = None
+            if self.cache is not None:
+                data = self.cache.load(self.series_file, st)
+
+            if data is not None:
+                self._read_cached(data)
+            else:
+                self._parse(f)
+                if self.cache is not None:
+                    self.cache.store(self.series_file, st,
+                                     self._cache_data())
+
+    def _parse(self, f):
+        offset = 0
+        line = b""
+        for line in f:
+            offset += len(line)
+            self._line_ends.append(offset)
+            self.add_patch(_decode_str(line))
+        self._dirty_from = len(self.patchlines)
+        if line and not line.endswith(b"\n"):
+            # rewrite an unterminated last line on the next save
+            self._dirty_from -= 1
+
+    def _cache_data(self):
+        entries = [patchline._cache_entry() for patchline in self.patchlines]
+        return (entries, self._line_ends.tolist(), self._dirty_from)
+
+    def _read_cached(self, data):
+        entries, line_ends, self._dirty_from = data
+        self._line_ends = array("L", line_ends)
+        for entry in entries:
+            patchline = PatchLine._from_cache(entry)
+            patch = patchline.get_patch()
+            if patch:
+                self.patch2line[patch] = patchline
+            self.patchlines.append(patchline)
+
+    def is_dirty(self):
+        """ Returns True if the patches list has been changed since it has
+        been read or saved
+        """
+        return not (self._dirty_from == len(self._line_ends) ==
+                    len(self.patchlines))
+
+    def _write(self, f, start=0):
+        """ Writes the patchlines from start on at the current position of the
+        file object f. The patchlines before start must already be in the
+        file.
+        """
+        if start:
+            offset = self._line_ends[start - 1]
+        else:
+            offset = 0
+        del self._line_ends[start:]
+        data = []
+        for patchline in self.patchlines[start:]:
+            line = _encode_str(str(patchline)) + b"\n"
+            offset += len(line)
+            self._line_ends.append(offset)
+            data.append(line)
+        f.write(b"".join(data))
+        self._dirty_from = len(self.patchlines)
 
     def save(self):
-        """ Saves current patches list in the series file """
-        with open(self.series_file, "wb") as f:
-            for patchline in self.patchlines:
-                f.write(_encode_str(str(patchline)))
-                f.write(b"\n")
+        """ Saves current patches list in the series file
+
+        The file is replaced atomically. Depending on the fsync policy the
+        file is flushed to disk immediately or on the next call of sync.
+        """
+        with AtomicFile(self.series_file,
+                        sync=self.fsync == FSYNC_ALWAYS) as f:
+            self._write(f)
+        if self.fsync == FSYNC_COMMAND:
+            self._needs_sync = True
+
+    def sync(self):
+        """ Flushes the series file to disk if it has been saved since the
+        last sync. Commands call this method once at their end.
+        """
+        if self._needs_sync:
+            File(self.series_file).sync()
+            self._needs_sync = False
 
     def add_patch(self, patch):
         """ Add a patch to the patches list """
         patchline = PatchLine(patch)
-        patch = patchline.get_patch()
+        patch = patchline.patch
         if patch:
+            count = len(self.patch2line)
             self.patch2line[patch] = patchline
+            if count == len(self.patch2line):
+                # duplicate entry
+                self._invalidate_index()
+            elif self._patches is not None:
+                self._patch_index[patch] = len(self._patches)
+                self._line_index[patch] = len(self.patchlines)
+                self._patches.append(patch)
         self.patchlines.append(patchline)
 
     def _add_patches(self, patches):
         for patch_name in patches:
             self.add_patch(patch_name)
 
-    def insert_patches(self, patches):
-        """ Insert list of patches at the front of the curent patches list """
+    def _new_patchlines(self, patches):
         patchlines = []
         for patch_name in patches:
             patchline = PatchLine(patch_name)
@@ -150,106 +297,102 @@ class PatchSeries(object):
             if patch:
                 self.patch2line[patch] = patchline
             patchlines.append(patchline)
-        patchlines.extend(self.patchlines)
-        self.patchlines = patchlines
+        return patchlines
+
+    def insert_patches(self, patches):
+        """ Insert list of patches at the front of the curent patches list """
+        self.patchlines[0:0] = self._new_patchlines(patches)
+        self._mark_dirty(0)
+        self._invalidate_index()
 
     def add_patches(self, patches, after=None):
         """ Add a list of patches to the patches list """
         if after is None:
             self.insert_patches(patches)
         else:
-            self._check_patch(after)
-            patchlines = self._patchlines_before(after)
-            patchlines.append(self.patch2line[after])
-            for patch in patches:
-                patchline = PatchLine(patch)
-                patchlines.append(patchline)
-                self.patch2line[patchline.get_patch()] = patchline
-            patchlines.extend(self._patchlines_after(after))
-            self.patchlines = patchlines
+            index = self._line_pos(after) + 1
+            self.patchlines[index:index] = self._new_patchlines(patches)
+            self._mark_dirty(index)
+            self._invalidate_index()
 
     def remove_patch(self, patch):
         """ Remove a patch from the patches list """
-        self._check_patch(patch)
-        patchline = self.patch2line[patch]
+        index = self._line_pos(patch)
         del self.patch2line[patch]
-        self.patchlines.remove(patchline)
+        del self.patchlines[index]
+        self._mark_dirty(index)
+        if index == len(self.patchlines) and self._patches[-1] == patch:
+            # removing the last line (e.g. pop) keeps the index valid
+            self._patches.pop()
+            del self._patch_index[patch]
+            del self._line_index[patch]
+        else:
+            self._invalidate_index()
 
     def top_patch(self):
         """ Returns the last patch from the patches list or None if the list
             is empty """
-        patches = self.patches()
-        if not patches:
+        self._build_index()
+        if not self._patches:
             return None
-        return patches[-1]
+        return self._patches[-1]
 
     def first_patch(self):
         """ Returns the first patch from the patches list or None if the list
             is empty """
-        patches = self.patches()
-        if not patches:
+        self._build_index()
+        if not self._patches:
             return None
-        return patches[0]
+        return self._patches[0]
 
     def patches(self):
         """ Returns the list of patches """
-        return [line.get_patch() for line in self.patchlines if
-                line.get_patch()]
+        self._build_index()
+        return self._patches[:]
 
     def _patchlines_after(self, patch):
-        self._check_patch(patch)
-        patchline = self.patch2line[patch]
-        index = self.patchlines.index(patchline) + 1
-        if index >= len(self.patchlines):
-            return []
-        return self.patchlines[index:]
+        return self.patchlines[self._line_pos(patch) + 1:]
 
     def _patchlines_before(self, patch):
-        self._check_patch(patch)
-        patchline = self.patch2line[patch]
-        index = self.patchlines.index(patchline)
-        return self.patchlines[:index]
+        return self.patchlines[:self._line_pos(patch)]
 
     def _patchlines_until(self, patch):
-        self._check_patch(patch)
-        patchline = self.patch2line[patch]
-        index = self.patchlines.index(patchline) + 1
-        return self.patchlines[:index]
+        return self.patchlines[:self._line_pos(patch) + 1]
 
     def patches_after(self, patch):
         """ Returns a list of patches after patch from the patches list """
-        return [line.get_patch() for line in self._patchlines_after(patch) if
-                line.get_patch()]
+        index = self._patch_pos(patch) + 1
+        return self._patches[index:]
 
     def patch_after(self, patch):
         """ Returns the patch followed by patch from the patches list or None if
         no patch after can be found.
         """
-        patches = self.patches_after(patch)
-        if patches:
-            return patches[0]
+        index = self._patch_pos(patch) + 1
+        if index < len(self._patches):
+            return self._patches[index]
         return None
 
     def patches_before(self, patch):
         """ Returns a list of patches before patch from the patches list """
-        return [line.get_patch() for line in self._patchlines_before(patch)
-                if line.get_patch()]
+        index = self._patch_pos(patch)
+        return self._patches[:index]
 
     def patch_before(self, patch):
         """ Returns the patch before patch from the patches list or None if no
         patch before can be found.
         """
-        patches = self.patches_before(patch)
-        if patches:
-            return patches[-1]
+        index = self._patch_pos(patch)
+        if index > 0:
+            return self._patches[index - 1]
         return None
 
     def patches_until(self, patch):
         """ Returns a list of patches before patch from the patches list
         including the provided patch
         """
-        return [line.get_patch() for line in self._patchlines_until(patch) if
-                line.get_patch()]
+        index = self._patch_pos(patch) + 1
+        return self._patches[:index]
 
     def is_patch(self, patch):
         """ Returns True if patch is in the list of patches. Otherwise it
@@ -262,19 +405,158 @@ class PatchSeries(object):
         """
         return len(self.patch2line) == 0
 
+    def _replaced_line(self, old_patchline, new_patch):
+        """ Returns a new PatchLine for new_patch with the comment of
+        old_patchline
+        """
+        new_patchline = PatchLine(new_patch)
+        comment = old_patchline.get_comment()
+        if comment:
+            new_patchline.line = "%s #%s" % (new_patchline.line, comment)
+            new_patchline.set_comment(comment)
+        return new_patchline
+
+    def edit(self):
+        """ Returns a SeriesEdit to change many patches at once
+
+        Usage:
+            with series.edit() as edit:
+                edit.remove([patch1, patch2])
+                edit.insert([patch3], after=patch4)
+        """
+        return SeriesEdit(self)
+
     def replace(self, old_patch, new_patch):
         """ Replace old_patch with new_patch
         The method only replaces the patch and doesn't change any comments.
         """
-        self._check_patch(old_patch)
-        old_patchline = self.patch2line[old_patch]
-        index = self.patchlines.index(old_patchline)
-        self.patchlines.pop(index)
-        new_patchline = PatchLine(new_patch)
-        new_patchline.set_comment(old_patchline.get_comment())
-        self.patchlines.insert(index, new_patchline)
+        index = self._line_pos(old_patch)
+        pos = self._patch_index[old_patch]
+        new_patchline = self._replaced_line(self.patch2line[old_patch],
+                                            new_patch)
+        self.patchlines[index] = new_patchline
+        self._mark_dirty(index)
         del self.patch2line[old_patch]
         self.patch2line[new_patch] = new_patchline
+        if new_patch in self._patch_index:
+            # new_patch is already listed elsewhere
+            self._invalidate_index()
+        else:
+            del self._patch_index[old_patch]
+            del self._line_index[old_patch]
+            self._patches[pos] = new_patch
+            self._patch_index[new_patch] = pos
+            self._line_index[new_patch] = index
+
+
+class SeriesEdit(object):
+
+    """ Collects changes of a PatchSeries and applies them in a single pass
+
+    All patches passed as positions (after, first and last) refer to the
+    series before the changes are applied. Lines with comments only are
+    kept in place and replaced patches keep their comments.
+    Use PatchSeries.edit to create a SeriesEdit. If used as a context manager
+    the changes are applied at the end of the with statement.
+    """
+
+    def __init__(self, series):
+        self.series = series
+        self._removed = set()  # positions of removed or moved lines
+        self._inserts = dict()  # position -> list of lines to insert after
+        self._replaced = dict()  # old patch -> new patch
+
+    def _insert_lines(self, patchlines, after):
+        if after is None:
+            pos = -1
+        else:
+            pos = self.series._line_pos(after)
+        self._inserts.setdefault(pos, []).extend(patchlines)
+
+    def insert(self, patches, after=None):
+        """ Insert patches after the patch after. If after is None the patches
+        are inserted at the front of the series.
+        """
+        self._insert_lines([PatchLine(patch) for patch in patches], after)
+
+    def remove(self, patches):
+        """ Remove patches from the series """
+        for patch in patches:
+            self._removed.add(self.series._line_pos(patch))
+
+    def move(self, first, last=None, after=None):
+        """ Move the lines from patch first to patch last (including the
+        comment lines in between) after the patch after. If last is None only
+        first is moved. If after is None the lines are moved to the front of
+        the series.
+        """
+        start = self.series._line_pos(first)
+        end = start if last is None else self.series._line_pos(last)
+        if end < start:
+            raise QuiltError("Patch %s is before patch %s" %
+                             (last.get_name(), first.get_name()))
+        if after is not None and \
+                start <= self.series._line_pos(after) <= end:
+            raise QuiltError("Can't move patches after patch %s" %
+                             after.get_name())
+        self._removed.update(range(start, end + 1))
+        self._insert_lines(self.series.patchlines[start:end + 1], after)
+
+    def replace(self, old_patch, new_patch):
+        """ Replace old_patch with new_patch keeping its comment """
+        self.series._check_patch(old_patch)
+        self._replaced[old_patch] = new_patch
+
+    def apply(self):
+        """ Applies all collected changes to the series """
+        series = self.series
+        old_patchlines = series.patchlines
+        inserts = self._inserts
+        removed = self._removed
+        replaced = self._replaced
+
+        def emit(patchline):
+            if patchline.patch in replaced:
+                patchline = series._replaced_line(patchline,
+                                                  replaced[patchline.patch])
+            patchlines.append(patchline)
+
+        patchlines = []
+        for patchline in inserts.get(-1, []):
+            emit(patchline)
+        for pos, patchline in enumerate(old_patchlines):
+            if pos not in removed:
+                emit(patchline)
+            if pos in inserts:
+                for inserted in inserts[pos]:
+                    emit(inserted)
+
+        first_change = 0
+        for old, new in zip(old_patchlines, patchlines):
+            if old is not new:
+                break
+            first_change += 1
+
+        patch2line = dict()
+        for patchline in patchlines:
+            if patchline.patch:
+                patch2line[patchline.patch] = patchline
+
+        series.patchlines = patchlines
+        series.patch2line = patch2line
+        series._invalidate_index()
+        series._mark_dirty(first_change)
+
+        self._removed = set()
+        self._inserts = dict()
+        self._replaced = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
 
 
 class Db(PatchSeries):
@@ -283,12 +565,49 @@ class Db(PatchSeries):
         applied patches
     """
 
+    # number of backups to check from which the backups of the next patches
+    # are indexed instead of being checked one by one
+    index_min_checks = 16384
+
     def __init__(self, dirname):
         self.version_file = os.path.join(dirname, ".version")
         if os.path.exists(self.version_file):
             self.check_version(self.version_file)
         super(Db, self).__init__(dirname, "applied-patches")
 
+    @classmethod
+    def read_top_patch(cls, dirname):
+        """ Returns the topmost applied patch in dirname or None if no patch
+        is applied.
+        Only the end of the applied-patches file is read. Therefore the time
+        doesn't depend on the number of applied patches.
+        """
+        version_file = os.path.join(dirname, ".version")
+        if os.path.exists(version_file):
+            cls.check_version(version_file)
+
+        try:
+            f = open(os.path.join(dirname, "applied-patches"), "rb")
+        except IOError:
+            return None
+
+        with f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            rest = b""
+            while pos > 0:
+                size = min(TAIL_BLOCK_SIZE, pos)
+                pos -= size
+                f.seek(pos)
+                lines = (f.read(size) + rest).split(b"\n")
+                # the first line may be incomplete if pos > 0
+                rest = lines.pop(0) if pos else b""
+                for line in reversed(lines):
+                    patch = PatchLine(_decode_str(line)).get_patch()
+                    if patch:
+                        return patch
+        return None
+
     def _create_version(self, version_file):
         with open(version_file, "w") as f:
             f.write(str(DB_VERSION))
@@ -300,15 +619,107 @@ class Db(PatchSeries):
         self._create_version(self.version_file)
 
     def save(self):
-        """ Create version file and save applied patches """
-        self.create()
-        super(Db, self).save()
+        """ Create version file if missing and save applied patches
+
+        Only the changes since the last read or save are written. Pushed
+        patches are appended to the applied-patches file and popped patches
+        are removed by truncating the file. In all other cases and if the file
+        has been changed by someone else in the meantime it is replaced
+        atomically.
+        """
+        if not os.path.exists(self.dirname):
+            os.makedirs(self.dirname)
+        if not os.path.exists(self.version_file):
+            self._create_version(self.version_file)
+
+        if not self.exists() or not self._save_inplace():
+            super(Db, self).save()
+
+    def _save_inplace(self):
+        """ Appends new lines to or truncates the applied-patches file.
+        Returns False if the file must be rewritten instead.
+        """
+        if not self.is_dirty():
+            return True
+        start = self._dirty_from
+        appending = start == len(self._line_ends)
+        truncating = start == len(self.patchlines)
+        if not appending and not truncating:
+            return False
+
+        with open(self.series_file, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size != (self._line_ends[-1] if self._line_ends else 0):
+                return False
+            if appending:
+                f.seek(size)
+            else:
+                f.truncate(self._line_ends[start - 1] if start else 0)
+            self._write(f, start)
+
+            if self.fsync == FSYNC_ALWAYS:
+                f.flush()
+                os.fsync(f.fileno())
+        if self.fsync == FSYNC_COMMAND:
+            self._needs_sync = True
+        return True
 
     def applied_patches(self):
         """ Lists all applied patches """
         return self.patches()
 
-    def check_version(self, version_file):
+    def file_patches(self, patches):
+        """ Returns a dict which maps the names of the files backed up in the
+            directories of patches to the lists of these patches in the given
+            order. The directories are read once, instead of checking each
+            file in each patch.
+        """
+        index = {}
+        for patch in patches:
+            pc_dir = os.path.join(self.dirname, patch.get_name())
+            for dirpath, dirnames, filenames in os.walk(pc_dir):
+                for name in filenames:
+                    filename = os.path.relpath(os.path.join(dirpath, name),
+                                               pc_dir)
+                    index.setdefault(filename, []).append(patch)
+        return index
+
+    def next_patches_index(self, patch, count=1):
+        """ Returns the index of the backups in the applied patches after
+            patch for looking up count files with file_in_next_patches.
+            If less than index_min_checks backups would have to be checked
+            None is returned, because checking the backups of a few files
+            directly is cheaper than reading the directories of all next
+            patches.
+        """
+        if not self.is_patch(patch):
+            return None
+        patches = self.patches_after(patch)
+        if count * len(patches) < self.index_min_checks:
+            return None
+        return self.file_patches(patches)
+
+    def file_in_next_patches(self, filename, patch, index=None):
+        """ Returns the first applied patch after patch which contains a
+            backup of filename or None. index is the result of
+            next_patches_index. If it is None each backup is checked
+            directly.
+        """
+        if index is not None:
+            patches = index.get(os.path.normpath(filename))
+            return patches[0] if patches else None
+
+        if not self.is_patch(patch):
+            # no patches applied
+            return None
+        for next_patch in self.patches_after(patch):
+            if os.path.exists(os.path.join(self.dirname,
+                                           next_patch.get_name(), filename)):
+                return next_patch
+        return None
+
+    @staticmethod
+    def check_version(version_file):
         """ Checks if the .version file in dirname has the correct supported
             version number """
         # The file contains a version number as a decimal integer, optionally
@@ -7,13 +7,12 @@
 # See LICENSE comming with the source of python-quilt for details.
 
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import NoPatchesInSeries, NoAppliedPatch, UnknownPatch, \
                         QuiltError
 from quilt.patch import Patch
 from quilt.pop import Pop
 from quilt.signals import Signal
-from quilt.utils import Directory, File
+from quilt.utils import File
 
 
 class Delete(Command):
@@ -24,13 +23,9 @@ class Delete(Command):
     deleting_patch = Signal()
     deleted_patch = Signal()
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Delete, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
-        self.pop = Pop(cwd, quilt_pc)
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Delete, self).__init__(cwd, quilt_pc, quilt_patches, session)
+        self.pop = Pop(cwd, quilt_pc, session=self.session)
 
     def _delete_patch(self, patch, remove=False, backup=False):
         if self.series.is_empty():
@@ -43,11 +38,9 @@ class Delete(Command):
 
         if applied:
             self.pop._unapply_patch(patch)
-            self.db = self.pop.db
-            self.db.save()
 
         self.series.remove_patch(patch)
-        self.series.save()
+        self.session.save()
 
         patch_file = self.quilt_patches + File(patch.get_name())
 
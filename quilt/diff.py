@@ -0,0 +1,621 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" In-process generation of unified diffs
+
+The output is compatible with ``diff -u --label OLD --label NEW`` of GNU
+diffutils. To produce the same hunks as GNU diff the algorithm follows
+diffutils closely: identical lines at the start and end of the files are
+trimmed (keeping some horizon lines), lines without a match in the other
+file are discarded, the edit script is computed with the linear space
+variant of Myers' algorithm and finally the boundaries of the changes are
+shifted to merge adjacent changes.
+"""
+
+
+from quilt.error import QuiltError
+from quilt.utils import split_lines
+
+CONTEXT = 3
+
+# diffutils never gives up searching for a minimal diff below this cost
+MIN_TOO_EXPENSIVE = 4096
+
+# number of diagonals to search before leaving the comparison to GNU diff
+MAX_WORK = 1000000
+
+NO_NEWLINE = b"\n\\ No newline at end of file\n"
+
+
+class UnsupportedDiff(QuiltError):
+
+    """ Raised if the files should be compared by GNU diff e.g. because they
+    are binary files
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __str__(self):
+        return "Unsupported diff: %s" % self.reason
+
+
+def is_binary(data):
+    """ Returns True if data should not be diffed line by line """
+    return b"\0" in data
+
+
+def _common_prefix_len(a, b, block=8192):
+    n = min(len(a), len(b))
+    lo = 0
+    while lo + block <= n and a[lo:lo + block] == b[lo:lo + block]:
+        lo += block
+    hi = min(lo + block, n)
+    # a[:lo] == b[:lo] and the first difference is before hi if any
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_len(a, b, limit, block=8192):
+    la = len(a)
+    lb = len(b)
+    n = limit
+    lo = 0
+    while lo + block <= n and \
+            a[la - lo - block:la - lo] == b[lb - lo - block:lb - lo]:
+        lo += block
+    hi = min(lo + block, n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _identical_ends(a, b, horizon):
+    """ Returns the number of lines at the start of both files and the
+    offsets of the lines at the end of a and b which don't need to be
+    compared. Like diffutils a horizon of lines is kept at both ends.
+    """
+    miss0 = bool(a) and not a.endswith(b"\n")
+    miss1 = bool(b) and not b.endswith(b"\n")
+    # diffutils completes the last line internally
+    if miss0:
+        a += b"\n"
+    if miss1:
+        b += b"\n"
+    n0 = len(a)
+    n1 = len(b)
+
+    p = _common_prefix_len(a, b)
+    # don't count a missing newline as part of the prefix
+    if (n0 - miss0 < p) != (n1 - miss1 < p):
+        p -= 1
+    # skip back to the start of the line and then horizon lines more
+    p = a.rfind(b"\n", 0, p) + 1
+    for i in range(horizon):
+        if not p:
+            break
+        p = a.rfind(b"\n", 0, p - 1) + 1
+    prefix_lines = a.count(b"\n", 0, p)
+
+    if miss0 != miss1:
+        return prefix_lines, a.count(b"\n"), b.count(b"\n")
+
+    limit = min(n0, n1) - p
+    k = _common_suffix_len(a, b, limit)
+    p0 = n0 - k
+    p1 = n1 - k
+    at_start = (p0 == 0 or a[p0 - 1:p0] == b"\n") and \
+        (p1 == 0 or b[p1 - 1:p1] == b"\n")
+    start = p0
+    for i in range(horizon + (not at_start)):
+        if p0 == n0:
+            break
+        p0 = a.index(b"\n", p0) + 1
+    p1 += p0 - start
+    return prefix_lines, a.count(b"\n", 0, p0), b.count(b"\n", 0, p1)
+
+
+def _discard_confusing_lines(equivs, counts):
+    """ Returns a list marking lines of a file which don't take part in the
+    comparison. 1 marks lines which don't occur in the other file. counts
+    maps equivalence classes to the number of lines in the other file.
+    """
+    end = len(equivs)
+    many = 5
+    tem = end // 64
+    while True:
+        tem >>= 2
+        if tem <= 0:
+            break
+        many *= 2
+
+    discards = [0] * end
+    for i, equiv in enumerate(equivs):
+        nmatch = counts.get(equiv, 0)
+        if nmatch == 0:
+            discards[i] = 1
+        elif nmatch > many:
+            discards[i] = 2
+
+    # Don't really discard the provisional lines except when they occur
+    # in a run of discardables, with nonprovisionals at the beginning and end
+    i = 0
+    while i < end:
+        if discards[i] == 2:
+            discards[i] = 0
+        elif discards[i] != 0:
+            provisional = 0
+            j = i
+            while j < end:
+                if discards[j] == 0:
+                    break
+                if discards[j] == 2:
+                    provisional += 1
+                j += 1
+
+            while j > i and discards[j - 1] == 2:
+                j -= 1
+                discards[j] = 0
+                provisional -= 1
+
+            length = j - i
+
+            if provisional * 4 > length:
+                while j > i:
+                    j -= 1
+                    if discards[j] == 2:
+                        discards[j] = 0
+            else:
+                minimum = 1
+                tem = length >> 2
+                while True:
+                    tem >>= 2
+                    if tem <= 0:
+                        break
+                    minimum <<= 1
+                minimum += 1
+
+                # cancel any subrun of minimum or more provisionals
+                j = 0
+                consec = 0
+                while j < length:
+                    if discards[i + j] != 2:
+                        consec = 0
+                    else:
+                        consec += 1
+                        if minimum == consec:
+                            j -= consec
+                        elif minimum < consec:
+                            discards[i + j] = 0
+                    j += 1
+
+                _cancel_provisionals(discards, i, length, 1)
+                i += length - 1
+                _cancel_provisionals(discards, i, length, -1)
+        i += 1
+    return discards
+
+
+def _cancel_provisionals(discards, i, length, step):
+    """ Scans from the start (step 1) or end (step -1) of a run until 3 or
+    more nonprovisionals in a row or the first nonprovisional at least 8
+    lines in are found and cancels all provisionals up to this point.
+    """
+    consec = 0
+    for j in range(length):
+        k = i + j * step
+        if j >= 8 and discards[k] == 1:
+            break
+        if discards[k] == 2:
+            consec = 0
+            discards[k] = 0
+        elif discards[k] == 0:
+            consec = 0
+        else:
+            consec += 1
+        if consec == 3:
+            break
+
+
+def _shift_boundaries(changed, equivs, other_changed):
+    """ Moves runs of changes to merge them with adjacent changes and
+    aligns them with changes in the other file if possible. changed and
+    other_changed have a sentinel at both ends.
+    """
+    i = 0
+    j = 0
+    i_end = len(equivs)
+
+    while True:
+        # find the beginning of the next run of changes and the
+        # corresponding point in the other file
+        while i < i_end and not changed[i + 1]:
+            while other_changed[j + 1]:
+                j += 1
+            j += 1
+            i += 1
+
+        if i == i_end:
+            break
+
+        start = i
+        i += 1
+        while changed[i + 1]:
+            i += 1
+        while other_changed[j + 1]:
+            j += 1
+
+        while True:
+            runlength = i - start
+
+            # move the changed region back as long as the previous unchanged
+            # line matches the last changed one
+            while start and equivs[start - 1] == equivs[i - 1]:
+                start -= 1
+                changed[start + 1] = 1
+                i -= 1
+                changed[i + 1] = 0
+                while changed[start]:
+                    start -= 1
+                j -= 1
+                while other_changed[j + 1]:
+                    j -= 1
+
+            if other_changed[j]:
+                corresponding = i
+            else:
+                corresponding = i_end
+
+            # move the changed region forward as long as the first changed
+            # line matches the following unchanged one
+            while i != i_end and equivs[start] == equivs[i]:
+                changed[start + 1] = 0
+                start += 1
+                changed[i + 1] = 1
+                i += 1
+                while changed[i + 1]:
+                    i += 1
+                j += 1
+                while other_changed[j + 1]:
+                    corresponding = i
+                    j += 1
+
+            if runlength == i - start:
+                break
+
+        # move the fully merged run back to a corresponding run in the
+        # other file
+        while corresponding < i:
+            start -= 1
+            changed[start + 1] = 1
+            i -= 1
+            changed[i + 1] = 0
+            j -= 1
+            while other_changed[j + 1]:
+                j -= 1
+
+
+class _Comparison(object):
+
+    """ Computes the lines changed between the sequences xv and yv using
+    Myers' O(ND) algorithm with the heuristic of diffutils for very
+    expensive comparisons
+    """
+
+    def __init__(self, xv, yv, max_work=MAX_WORK):
+        self.xv = xv
+        self.yv = yv
+        self.work = max_work
+        size = len(xv) + len(yv) + 3
+        self.fd = [0] * size
+        self.bd = [0] * size
+        self.off = len(yv) + 1
+        too_expensive = 1
+        while size:
+            too_expensive <<= 1
+            size >>= 2
+        self.too_expensive = max(MIN_TOO_EXPENSIVE, too_expensive)
+
+    def _diag(self, xoff, xlim, yoff, ylim, find_minimal):
+        """ Finds the midpoint of the shortest edit script. Returns a tuple
+        (xmid, ymid, lo_minimal, hi_minimal).
+        """
+        xv = self.xv
+        yv = self.yv
+        fd = self.fd
+        bd = self.bd
+        off = self.off
+        dmin = xoff - ylim
+        dmax = xlim - yoff
+        fmid = xoff - yoff
+        bmid = xlim - ylim
+        fmin = fmax = fmid
+        bmin = bmax = bmid
+        odd = (fmid - bmid) & 1
+        big = xlim + ylim + 1
+
+        fd[fmid + off] = xoff
+        bd[bmid + off] = xlim
+
+        c = 0
+        while True:
+            c += 1
+
+            # extend the top-down search by an edit step in each diagonal
+            if fmin > dmin:
+                fmin -= 1
+                fd[fmin - 1 + off] = -1
+            else:
+                fmin += 1
+            if fmax < dmax:
+                fmax += 1
+                fd[fmax + 1 + off] = -1
+            else:
+                fmax -= 1
+            for d in range(fmax, fmin - 1, -2):
+                tlo = fd[d - 1 + off]
+                thi = fd[d + 1 + off]
+                x = thi if tlo < thi else tlo + 1
+                y = x - d
+                while x < xlim and y < ylim and xv[x] == yv[y]:
+                    x += 1
+                    y += 1
+                fd[d + off] = x
+                if odd and bmin <= d <= bmax and bd[d + off] <= x:
+                    return x, y, True, True
+
+            # similarly extend the bottom-up search
+            if bmin > dmin:
+                bmin -= 1
+                bd[bmin - 1 + off] = big
+            else:
+                bmin += 1
+            if bmax < dmax:
+                bmax += 1
+                bd[bmax + 1 + off] = big
+            else:
+                bmax -= 1
+            for d in range(bmax, bmin - 1, -2):
+                tlo = bd[d - 1 + off]
+                thi = bd[d + 1 + off]
+                x = tlo if tlo < thi else thi - 1
+                y = x - d
+                while xoff < x and yoff < y and xv[x - 1] == yv[y - 1]:
+                    x -= 1
+                    y -= 1
+                bd[d + off] = x
+                if not odd and fmin <= d <= fmax and x <= fd[d + off]:
+                    return x, y, True, True
+
+            self.work -= fmax - fmin + bmax - bmin + 2
+            if self.work < 0:
+                raise UnsupportedDiff("comparison too expensive")
+
+            if find_minimal or c < self.too_expensive:
+                continue
+
+            # give up and report halfway between the best results so far
+            fxybest = -1
+            fxbest = 0
+            for d in range(fmax, fmin - 1, -2):
+                x = min(fd[d + off], xlim)
+                y = x - d
+                if ylim < y:
+                    x = ylim + d
+                    y = ylim
+                if fxybest < x + y:
+                    fxybest = x + y
+                    fxbest = x
+
+            bxybest = big * 2
+            bxbest = 0
+            for d in range(bmax, bmin - 1, -2):
+                x = max(xoff, bd[d + off])
+                y = x - d
+                if y < yoff:
+                    x = yoff + d
+                    y = yoff
+                if x + y < bxybest:
+                    bxybest = x + y
+                    bxbest = x
+
+            if (xlim + ylim) - bxybest < fxybest - (xoff + yoff):
+                return fxbest, fxybest - fxbest, True, False
+            return bxbest, bxybest - bxbest, False, True
+
+    def compare(self, note_delete, note_insert):
+        """ Calls note_delete and note_insert with the indexes of the lines
+        deleted from xv and inserted from yv
+        """
+        xv = self.xv
+        yv = self.yv
+        stack = [(0, len(xv), 0, len(yv), False)]
+        while stack:
+            xoff, xlim, yoff, ylim, find_minimal = stack.pop()
+
+            while xoff < xlim and yoff < ylim and xv[xoff] == yv[yoff]:
+                xoff += 1
+                yoff += 1
+            while xoff < xlim and yoff < ylim and \
+                    xv[xlim - 1] == yv[ylim - 1]:
+                xlim -= 1
+                ylim -= 1
+
+            if xoff == xlim:
+                for y in range(yoff, ylim):
+                    note_insert(y)
+            elif yoff == ylim:
+                for x in range(xoff, xlim):
+                    note_delete(x)
+            else:
+                xmid, ymid, lo_minimal, hi_minimal = self._diag(
+                    xoff, xlim, yoff, ylim, find_minimal)
+                stack.append((xmid, xlim, ymid, ylim, hi_minimal))
+                stack.append((xoff, xmid, yoff, ymid, lo_minimal))
+
+
+def diff_lines(a, b, a_lines, b_lines, context=CONTEXT):
+    """ Compares the lines of the contents a and b and returns a list of
+    changes. A change is a tuple (line0, line1, deleted, inserted) of the
+    first changed line in a and b and the number of deleted and inserted
+    lines.
+    """
+    prefix, end0, end1 = _identical_ends(a, b, context)
+
+    classes = {}
+    equivs0 = [classes.setdefault(line, len(classes) + 1) for line in
+               a_lines[prefix:end0]]
+    equivs1 = [classes.setdefault(line, len(classes) + 1) for line in
+               b_lines[prefix:end1]]
+
+    counts0 = {}
+    for equiv in equivs0:
+        counts0[equiv] = counts0.get(equiv, 0) + 1
+    counts1 = {}
+    for equiv in equivs1:
+        counts1[equiv] = counts1.get(equiv, 0) + 1
+
+    discards0 = _discard_confusing_lines(equivs0, counts1)
+    discards1 = _discard_confusing_lines(equivs1, counts0)
+
+    # the changed arrays contain a sentinel at both ends
+    changed0 = bytearray(len(equivs0) + 2)
+    changed1 = bytearray(len(equivs1) + 2)
+    real0 = []
+    real1 = []
+    for i, discard in enumerate(discards0):
+        if discard:
+            changed0[i + 1] = 1
+        else:
+            real0.append(i)
+    for i, discard in enumerate(discards1):
+        if discard:
+            changed1[i + 1] = 1
+        else:
+            real1.append(i)
+
+    def note_delete(x):
+        changed0[real0[x] + 1] = 1
+
+    def note_insert(y):
+        changed1[real1[y] + 1] = 1
+
+    comparison = _Comparison([equivs0[i] for i in real0],
+                             [equivs1[i] for i in real1])
+    comparison.compare(note_delete, note_insert)
+
+    _shift_boundaries(changed0, equivs0, changed1)
+    _shift_boundaries(changed1, equivs1, changed0)
+
+    changes = []
+    i0 = i1 = 0
+    n0 = len(equivs0)
+    n1 = len(equivs1)
+    while i0 < n0 or i1 < n1:
+        if changed0[i0 + 1] or changed1[i1 + 1]:
+            start0 = i0
+            start1 = i1
+            while changed0[i0 + 1]:
+                i0 += 1
+            while changed1[i1 + 1]:
+                i1 += 1
+            changes.append((start0 + prefix, start1 + prefix, i0 - start0,
+                            i1 - start1))
+        i0 += 1
+        i1 += 1
+    return changes
+
+
+def _hunks(changes, context):
+    """ Groups changes which are close to each other into hunks """
+    threshold = 2 * context + 1
+    hunk = []
+    top0 = None
+    for change in changes:
+        if hunk and change[0] - top0 >= threshold:
+            yield hunk
+            hunk = []
+        hunk.append(change)
+        top0 = change[0] + change[2]
+    if hunk:
+        yield hunk
+
+
+def _range(first, last):
+    """ Returns the range of a hunk header like diffutils """
+    a = first + 1
+    b = last + 1
+    if b < a:
+        return ("%d,0" % b).encode("ascii")
+    if b == a:
+        return ("%d" % b).encode("ascii")
+    return ("%d,%d" % (a, b - a + 1)).encode("ascii")
+
+
+def _line(out, mark, line):
+    out.append(mark)
+    out.append(line)
+    if not line.endswith(b"\n"):
+        out.append(NO_NEWLINE)
+
+
+def unified_diff(a, b, old_label, new_label, context=CONTEXT):
+    """ Returns the unified diff between the bytes a and b as bytes. The
+    result is empty if a and b are equal. The labels must be bytes.
+    Raises UnsupportedDiff for binary data and for very expensive
+    comparisons.
+    """
+    if a == b:
+        return b""
+    if is_binary(a) or is_binary(b):
+        raise UnsupportedDiff("binary data")
+
+    a_lines = split_lines(a)
+    b_lines = split_lines(b)
+    changes = diff_lines(a, b, a_lines, b_lines, context)
+    if not changes:
+        return b""
+
+    out = [b"--- ", old_label, b"\n+++ ", new_label, b"\n"]
+    for hunk in _hunks(changes, context):
+        first0 = max(hunk[0][0] - context, 0)
+        first1 = max(hunk[0][1] - context, 0)
+        last = hunk[-1]
+        last0 = min(last[0] + last[2] - 1 + context, len(a_lines) - 1)
+        last1 = min(last[1] + last[3] - 1 + context, len(b_lines) - 1)
+
+        out.append(b"@@ -" + _range(first0, last0) + b" +" +
+                   _range(first1, last1) + b" @@\n")
+
+        i = first0
+        changes = iter(hunk)
+        change = next(changes, None)
+        while i <= last0 or first1 <= last1:
+            if change is None or i < change[0]:
+                _line(out, b" ", a_lines[i])
+                i += 1
+                first1 += 1
+            else:
+                line0, line1, deleted, inserted = change
+                for line in a_lines[line0:line0 + deleted]:
+                    _line(out, b"-", line)
+                for line in b_lines[line1:line1 + inserted]:
+                    _line(out, b"+", line)
+                i += deleted
+                first1 += inserted
+                change = next(changes, None)
+    return b"".join(out)
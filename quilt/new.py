@@ -7,11 +7,10 @@
 # See LICENSE comming with the source of python-quilt for details.
 
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import PatchAlreadyExists
 from quilt.patch import Patch
 from quilt.signals import Signal
-from quilt.utils import Directory, File
+from quilt.utils import File
 
 
 class New(Command):
@@ -19,12 +18,8 @@ class New(Command):
     patch_created = Signal()
 
     """ Creates a new patch in the queue """
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(New, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(New, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
     def create(self, patchname):
         """ Adds a new patch with patchname to the queue
@@ -54,9 +49,7 @@ class New(Command):
         # "apply" patch
         self.db.add_patch(patch)
 
-        # create patches/series files
-        self.series.save()
-        # create .pc/.version and .pc/applied-patches files
-        self.db.save()
+        # create patches/series, .pc/.version and .pc/applied-patches files
+        self.session.save()
 
         self.patch_created(patch)
@@ -6,27 +6,100 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
+from __future__ import print_function
+
+import errno
+import getopt
 import os
 import os.path
+import sys
+
+from six.moves import intern
 
+from quilt.pool import FilePool
 from quilt.utils import Process, DirectoryParam, _EqBase, File, FileParam, \
-                        SubprocessError
+                        SubprocessError, _encode_str, files_equal
+
+ENGINE_GNU = "gnu"
+ENGINE_PYTHON = "python"
+ENGINES = (ENGINE_GNU, ENGINE_PYTHON)
 
 
 class Patch(_EqBase):
 
-    """ Wrapper around the patch util """
+    """ Wrapper around the patch util
+
+    The patch is applied by GNU patch by default. If engine is set to
+    ENGINE_PYTHON it is applied in-process by quilt.apply and GNU patch
+    is only used for patches containing unsupported constructs.
+    """
+
+    __slots__ = ("patch_name", "_strip", "_reverse", "_args")
+
+    engine = ENGINE_GNU
 
     def __init__(self, patch_name, strip=1, reverse=False):
-        self.patch_name = patch_name
-        self.strip = strip
-        self.reverse = reverse
+        self.patch_name = intern(patch_name)
+        self._strip = strip
+        self._reverse = reverse
+        self._args = None
+
+    @classmethod
+    def from_args(cls, patch_name, args):
+        """ Creates a Patch with the patch options string args of a series
+        file line e.g. "-p0 -R". The options are parsed when strip or reverse
+        are accessed for the first time.
+        """
+        patch = cls(patch_name)
+        patch._args = args
+        return patch
+
+    def _parse_args(self):
+        args = self._args
+        self._args = None
+        try:
+            opts, args = getopt.getopt(args.split(), "p:R", ["strip=",
+                                                             "reverse"])
+            for o, a in opts:
+                if o in ["-p", "--strip"]:
+                    self._strip = a
+                elif o in ["-R", "--reverse"]:
+                    self._reverse = True
+        except getopt.GetoptError as err:
+            print(err, file=sys.stderr)
+
+    def get_strip(self):
+        if self._args is not None:
+            self._parse_args()
+        return self._strip
+
+    def set_strip(self, strip):
+        if self._args is not None:
+            self._parse_args()
+        self._strip = strip
+
+    strip = property(get_strip, set_strip)
+
+    def get_reverse(self):
+        if self._args is not None:
+            self._parse_args()
+        return self._reverse
+
+    def set_reverse(self, reverse):
+        if self._args is not None:
+            self._parse_args()
+        self._reverse = reverse
+
+    reverse = property(get_reverse, set_reverse)
 
     @DirectoryParam(["patch_dir", "work_dir"])
     def run(self, cwd, patch_dir=None, backup=False, prefix=None,
             reverse=False, work_dir=None, force=False, dry_run=False,
             no_backup_if_mismatch=False, remove_empty_files=False,
-            quiet=False, suppress_output=False):
+            quiet=False, suppress_output=False, engine=None):
+        """ Applies the patch. Returns True if all hunks applied exactly,
+        False if a hunk needed an offset or fuzz and None if this is unknown
+        because GNU patch has been used. """
         cmd = ["patch"]
         cmd.append("-p" + str(self.strip))
 
@@ -70,11 +143,55 @@ class Patch(_EqBase):
         if dry_run:
             cmd.append("--dry-run")
 
+        if (engine or self.engine) == ENGINE_PYTHON:
+            # imported here to keep the startup time of the gnu engine low
+            from quilt.apply import PatchApplier
+            from quilt.patchfile import UnsupportedPatch
+
+            if work_dir:
+                base = os.path.join(cwd, work_dir.get_name())
+            else:
+                base = cwd
+            applier = PatchApplier(name, base, strip=self.strip,
+                                   reverse=reverse, backup_prefix=prefix,
+                                   force=force, dry_run=dry_run,
+                                   no_backup_if_mismatch=no_backup_if_mismatch,
+                                   remove_empty_files=remove_empty_files,
+                                   quiet=quiet,
+                                   suppress_output=suppress_output)
+            try:
+                if applier.apply():
+                    return not applier.mismatch
+                raise SubprocessError(cmd, 1)
+            except UnsupportedPatch:
+                pass
+            except EnvironmentError as e:
+                if not suppress_output:
+                    print("patch: %s" % e, file=sys.stderr)
+                raise SubprocessError(cmd, 2)
+
         Process(cmd).run(cwd=cwd, suppress_output=suppress_output)
+        return None
 
     def get_name(self):
         return self.patch_name
 
+    @DirectoryParam(["patch_dir"])
+    def get_index(self, patch_dir=None):
+        """ Returns the cached PatchIndex of the patch file """
+        from quilt.patchfile import PatchIndex
+
+        if patch_dir:
+            name = (patch_dir + File(self.get_name())).get_name()
+        else:
+            name = self.get_name()
+        return PatchIndex.load(name)
+
+    @DirectoryParam(["patch_dir"])
+    def get_files(self, patch_dir=None):
+        """ Returns the names of the files changed by the patch """
+        return self.get_index(patch_dir).files(self.strip)
+
     @DirectoryParam(["patch_dir"])
     def get_header(self, patch_dir=None):
         """ Returns bytes """
@@ -94,11 +211,11 @@ class Patch(_EqBase):
         return b"".join(lines)
 
     def __eq__(self, other):
-        return (isinstance(other, Patch) and self.get_name() ==
-                other.get_name())
+        return (isinstance(other, Patch) and self.patch_name ==
+                other.patch_name)
 
     def __hash__(self):
-        return hash(self.get_name())
+        return hash(self.patch_name)
 
     def __str__(self):
         return self.get_name()
@@ -115,32 +232,62 @@ class RollbackPatch(object):
         self.cwd = cwd
         self.backup_dir = backup_dir
 
-    def rollback(self, keep=False):
-        (dirs, files) = self.backup_dir.content()
+    def rollback(self, keep=False, move=False, files=None):
+        """ Restores the files from the backup dir
+
+        If move is True the backup files are renamed into place instead of
+        being copied. This consumes the backup and should only be used if
+        the backup is deleted afterwards.
+        If files is given only these files of the backup are restored.
+        """
+        if files is None:
+            (dirs, files) = self.backup_dir.content()
+        else:
+            dirs = sorted(set(os.path.dirname(name) for name in files) -
+                          set([""]))
 
         for dir in dirs:
             newdir = self.cwd + dir
             if not newdir.exists():
                 newdir.create()
 
-        for file in files:
+        def restore(file):
             file = File(file)
             backup_file = self.backup_dir + file
             rollback_file = self.cwd + file
 
-            if not keep:
-                rollback_file.delete_if_exists()
-            if not backup_file.is_empty():
+            if backup_file.is_empty():
+                if not keep:
+                    rollback_file.delete_if_exists()
+            elif move:
+                try:
+                    backup_file.move(rollback_file)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    rollback_file.delete_if_exists()
+                    backup_file.copy(rollback_file)
+            else:
+                if not keep:
+                    rollback_file.delete_if_exists()
                 backup_file.copy(rollback_file)
 
+        FilePool().map(restore, files)
+
     def delete_backup(self):
         self.backup_dir.delete()
 
 
 class Diff(object):
     """ Wrapper around the diff util
+
+    Unified diffs with labels are generated in-process by quilt.diff unless
+    engine is set to ENGINE_GNU. Binary files and other output formats are
+    always handled by GNU diff.
     """
 
+    engine = ENGINE_PYTHON
+
     @FileParam(["left", "right"])
     def __init__(self, left, right):
         """ left points to the first file and right to the second file
@@ -154,7 +301,37 @@ class Diff(object):
             self.right = File("/dev/null")
 
     def run(self, cwd, left_label=None, right_label=None, unified=True,
-            fd=None):
+            fd=None, engine=None):
+        if unified and left_label and right_label and \
+                (engine or self.engine) == ENGINE_PYTHON:
+            if self._run_python(cwd, left_label, right_label, fd):
+                return
+
+        try:
+            Process(self._command(left_label, right_label, unified)).run(
+                cwd=cwd, stdout=fd)
+        except SubprocessError as e:
+            if e.get_returncode() > 1:
+                raise e
+
+    def output(self, cwd, left_label=None, right_label=None, unified=True,
+               engine=None):
+        """ Returns the output of run as bytes """
+        if unified and left_label and right_label and \
+                (engine or self.engine) == ENGINE_PYTHON:
+            data = self._python_output(cwd, left_label, right_label)
+            if data is not None:
+                return data
+
+        try:
+            return Process(self._command(left_label, right_label,
+                                         unified)).output(cwd=cwd)
+        except SubprocessError as e:
+            if e.get_returncode() > 1:
+                raise e
+            return e.output
+
+    def _command(self, left_label, right_label, unified):
         cmd = ["diff"]
 
         if unified:
@@ -173,26 +350,53 @@ class Diff(object):
 
         cmd.append(self.left.get_name())
         cmd.append(self.right.get_name())
+        return cmd
+
+    def _python_output(self, cwd, left_label, right_label):
+        """ Returns the diff generated in-process or None if the files must
+        be compared by GNU diff.
+        """
+        from quilt.diff import UnsupportedDiff, unified_diff
 
+        with open(os.path.join(cwd, self.left.get_name()), "rb") as f:
+            left = f.read()
+        with open(os.path.join(cwd, self.right.get_name()), "rb") as f:
+            right = f.read()
         try:
-            Process(cmd).run(cwd=cwd, stdout=fd)
-        except SubprocessError as e:
-            if e.get_returncode() > 1:
-                raise e
+            return unified_diff(left, right, _encode_str(left_label),
+                                _encode_str(right_label))
+        except UnsupportedDiff:
+            return None
+
+    def _run_python(self, cwd, left_label, right_label, fd):
+        """ Writes the diff generated in-process to fd. Returns False if the
+        files must be compared by GNU diff.
+        """
+        data = self._python_output(cwd, left_label, right_label)
+        if data is None:
+            return False
+        if not data:
+            return True
+        if fd is None:
+            # like the diff process write to the standard output descriptor
+            sys.stdout.flush()
+            fd = 1
+        elif not isinstance(fd, int):
+            fd.flush()
+            fd = fd.fileno()
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+        return True
 
     def equal(self, cwd):
         """ Returns True if left and right are equal
         """
-        cmd = ["diff"]
-        cmd.append("-q")
-        cmd.append(self.left.get_name())
-        cmd.append(self.right.get_name())
-
+        left = os.path.join(cwd, self.left.get_name())
+        right = os.path.join(cwd, self.right.get_name())
         try:
-            Process(cmd).run(cwd=cwd, suppress_output=True)
-        except SubprocessError as e:
-            if e.get_returncode() == 1:
-                return False
-            else:
-                raise e
-        return True
+            return files_equal(left, right)
+        except EnvironmentError:
+            # diff reports errors with return code 2
+            raise SubprocessError(["diff", "-q", self.left.get_name(),
+                                   self.right.get_name()], 2)
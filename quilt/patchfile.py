@@ -0,0 +1,559 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Parser for patch files in the unified diff format """
+
+import io
+import os
+import os.path
+import re
+import time
+
+from collections import OrderedDict
+
+from quilt.cache import RACY_TIME, _file_key
+from quilt.error import QuiltError
+from quilt.utils import _decode_str
+
+DEV_NULL = b"/dev/null"
+
+HUNK_RE = re.compile(br"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+NORMAL_DIFF_RE = re.compile(br"^\d+(?:,\d+)?[acd]\d+(?:,\d+)?\r?$")
+
+# extended git headers that change more than the content of a file
+GIT_UNSUPPORTED = (b"old mode ", b"new mode ", b"deleted file mode ",
+                   b"new file mode ", b"rename from ", b"rename to ",
+                   b"copy from ", b"copy to ", b"GIT binary patch",
+                   b"Binary files ")
+
+
+class UnsupportedPatch(QuiltError):
+
+    """ Raised for patch files containing constructs the parser can't handle
+    e.g. context diffs, binary diffs or file mode changes
+    """
+
+    def __init__(self, reason, lineno=None):
+        self.reason = reason
+        self.lineno = lineno
+
+    def __str__(self):
+        if self.lineno is None:
+            return "Unsupported patch: %s" % self.reason
+        return "Unsupported patch at line %d: %s" % (self.lineno, self.reason)
+
+
+class Hunk(object):
+
+    """ A hunk of a unified diff
+
+    old and new contain the lines of the hunk before and after the change
+    including their line endings. text contains the lines of the hunk as they
+    are in the patch file.
+    """
+
+    __slots__ = ("old_start", "old_len", "new_start", "new_len", "old", "new",
+                 "leading", "trailing", "text")
+
+    def __init__(self, old_start, old_len, new_start, new_len):
+        self.old_start = old_start
+        self.old_len = old_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.old = []
+        self.new = []
+        self.leading = 0  # number of context lines at the start
+        self.trailing = 0  # number of context lines at the end
+        self.text = []
+
+    def reversed(self):
+        """ Returns a new Hunk which reverts this hunk """
+        hunk = Hunk(self.new_start, self.new_len, self.old_start,
+                    self.old_len)
+        hunk.old = self.new
+        hunk.new = self.old
+        hunk.leading = self.leading
+        hunk.trailing = self.trailing
+        hunk.text = self.text
+        return hunk
+
+
+class FilePatch(object):
+
+    """ The changes of a single file in a patch file """
+
+    __slots__ = ("old_name", "new_name", "index_name", "hunks", "lineno")
+
+    def __init__(self, old_name, new_name, index_name=None, lineno=None):
+        self.old_name = old_name
+        self.new_name = new_name
+        self.index_name = index_name
+        self.hunks = []
+        self.lineno = lineno
+
+    def is_new(self):
+        """ Returns True if the file is created by the patch """
+        return self.old_name == DEV_NULL
+
+    def is_deleted(self):
+        """ Returns True if the file is deleted by the patch """
+        return self.new_name == DEV_NULL
+
+    def reversed(self):
+        """ Returns a new FilePatch which reverts this one """
+        file_patch = FilePatch(self.new_name, self.old_name, self.index_name,
+                               self.lineno)
+        file_patch.hunks = [hunk.reversed() for hunk in self.hunks]
+        return file_patch
+
+
+def _parse_name(line, lineno=None, strict=True):
+    """ Returns the file name of a ---/+++ line without a timestamp. If strict
+    is True UnsupportedPatch is raised for names the python engine can't
+    handle, otherwise they are returned as they are.
+    """
+    name = line[4:].rstrip(b"\r\n")
+    if b"\t" in name:
+        name = name.split(b"\t", 1)[0]
+    if not strict:
+        return name
+    if name.startswith(b'"'):
+        raise UnsupportedPatch("quoted file name", lineno)
+    if b" " in name:
+        raise UnsupportedPatch("file name with spaces or without a tab "
+                               "before the timestamp", lineno)
+    return name
+
+
+def _parse_hunk_header(line):
+    """ Returns the old start, old length, new start and new length of a
+    "@@" line or None if the line isn't a valid hunk header """
+    match = HUNK_RE.match(line)
+    if not match:
+        return None
+    old_len = 1 if match.group(2) is None else int(match.group(2))
+    new_len = 1 if match.group(4) is None else int(match.group(4))
+    return int(match.group(1)), old_len, int(match.group(3)), new_len
+
+
+def _parse_hunk(header, lines, lineno):
+    """ Parses a hunk. lines must be an iterator returning the lines after
+    the hunk header.
+    """
+    ranges = _parse_hunk_header(header)
+    if ranges is None:
+        raise UnsupportedPatch("malformed hunk header", lineno)
+    hunk = Hunk(*ranges)
+    old_len = hunk.old_len
+    new_len = hunk.new_len
+    hunk.text.append(header)
+
+    old = hunk.old
+    new = hunk.new
+    last = None
+    context = 0
+    changed = False
+    while len(old) < old_len or len(new) < new_len:
+        try:
+            line = next(lines)
+        except StopIteration:
+            raise UnsupportedPatch("truncated hunk", lineno)
+        lineno += 1
+        hunk.text.append(line)
+        tag = line[:1]
+        if line in (b"\n", b"\r\n"):
+            # empty context line with stripped whitespace
+            tag = b" "
+            line = b" " + line
+        if tag == b" ":
+            old.append(line[1:])
+            new.append(line[1:])
+            last = (old, new)
+            context += 1
+            if not changed:
+                hunk.leading = context
+        elif tag == b"-":
+            old.append(line[1:])
+            last = (old,)
+            context = 0
+            changed = True
+        elif tag == b"+":
+            new.append(line[1:])
+            last = (new,)
+            context = 0
+            changed = True
+        elif tag == b"\\" and last:
+            _strip_newline(last)
+            last = None
+        else:
+            raise UnsupportedPatch("malformed hunk", lineno)
+    hunk.trailing = context
+
+    if len(old) != old_len or len(new) != new_len:
+        raise UnsupportedPatch("malformed hunk", lineno)
+    return hunk, lineno
+
+
+def _strip_newline(line_lists):
+    for lines in line_lists:
+        line = lines[-1]
+        if line.endswith(b"\n"):
+            lines[-1] = line[:-1]
+
+
+def parse_patch(lines):
+    """ Parses the lines of a unified diff. lines can be any iterable of
+    bytes e.g. a file opened in binary mode.
+    Returns a list of FilePatch objects. Raises UnsupportedPatch if the patch
+    contains other diff formats or git extensions like binary patches, file
+    mode changes or renames.
+    """
+    file_patches = []
+    current = None
+    index_name = None
+    lineno = 0
+    lines = iter(lines)
+    previous = b""
+    after_hunk = False
+
+    for line in lines:
+        lineno += 1
+
+        if line.startswith(b"@@ ") and current is not None:
+            hunk, lineno = _parse_hunk(line, lines, lineno)
+            current.hunks.append(hunk)
+            previous = line
+            after_hunk = True
+            continue
+
+        if after_hunk and line.startswith(b"\\"):
+            # "\ No newline at end of file" for the last line of the hunk
+            hunk = current.hunks[-1]
+            tag = hunk.text[-1][:1]
+            if tag == b"-":
+                _strip_newline((hunk.old,))
+            elif tag == b"+":
+                _strip_newline((hunk.new,))
+            else:
+                _strip_newline((hunk.old, hunk.new))
+            hunk.text.append(line)
+            after_hunk = False
+            continue
+        after_hunk = False
+
+        if line.startswith(b"+++ ") and previous.startswith(b"--- "):
+            old_name = _parse_name(previous, lineno - 1)
+            new_name = _parse_name(line, lineno)
+            current = FilePatch(old_name, new_name, index_name, lineno - 1)
+            file_patches.append(current)
+            index_name = None
+        elif line.startswith(b"Index: "):
+            index_name = line[7:].strip()
+            current = None
+        elif line.startswith(b"diff --git "):
+            current = None
+        elif line.startswith(GIT_UNSUPPORTED):
+            raise UnsupportedPatch("git extended header", lineno)
+        elif line.startswith(b"***************"):
+            raise UnsupportedPatch("context diff", lineno)
+        elif NORMAL_DIFF_RE.match(line):
+            raise UnsupportedPatch("normal diff", lineno)
+        previous = line
+
+    return file_patches
+
+
+# flags of a FileSection
+SECTION_NEW = 1
+SECTION_DELETED = 2
+SECTION_RENAME = 4
+SECTION_COPY = 8
+SECTION_BINARY = 16
+SECTION_MODE = 32
+
+_GIT_FLAGS = ((b"old mode ", SECTION_MODE),
+              (b"new mode ", SECTION_MODE),
+              (b"new file mode ", SECTION_NEW),
+              (b"deleted file mode ", SECTION_DELETED),
+              (b"rename from ", SECTION_RENAME),
+              (b"rename to ", SECTION_RENAME),
+              (b"copy from ", SECTION_COPY),
+              (b"copy to ", SECTION_COPY),
+              (b"GIT binary patch", SECTION_BINARY),
+              (b"Binary files ", SECTION_BINARY))
+
+
+def _strip_components(name, strip):
+    """ Removes strip leading components from name. The last component is
+    always kept.
+    """
+    parts = [part for part in name.split(b"/") if part]
+    return b"/".join(parts[min(int(strip), len(parts) - 1):])
+
+
+class FileSection(object):
+
+    """ The section of a single file in a patch file
+
+    start and end are the byte offsets of the section in the patch file
+    including its Index: or diff line. hunks contains tuples (old_start,
+    old_len, new_start, new_len, offset) with the byte offset of the hunk
+    header. The names are bytes as they occur in the patch file.
+    """
+
+    __slots__ = ("old_name", "new_name", "index_name", "start", "end",
+                 "flags", "hunks")
+
+    def __init__(self, start, old_name=None, new_name=None, index_name=None,
+                 end=None, flags=0, hunks=None):
+        self.old_name = old_name
+        self.new_name = new_name
+        self.index_name = index_name
+        self.start = start
+        self.end = end
+        self.flags = flags
+        self.hunks = [] if hunks is None else hunks
+
+    def is_new(self):
+        """ Returns True if the file is created by the patch """
+        return bool(self.flags & SECTION_NEW) or self.old_name == DEV_NULL
+
+    def is_deleted(self):
+        """ Returns True if the file is deleted by the patch """
+        return bool(self.flags & SECTION_DELETED) or \
+            self.new_name == DEV_NULL
+
+    def is_rename(self):
+        return bool(self.flags & SECTION_RENAME)
+
+    def is_copy(self):
+        return bool(self.flags & SECTION_COPY)
+
+    def is_binary(self):
+        return bool(self.flags & SECTION_BINARY)
+
+    def is_mode_change(self):
+        return bool(self.flags & SECTION_MODE)
+
+    def target(self, strip=1):
+        """ Returns the name of the file changed by this section with strip
+        leading components removed or None if the section has no name e.g.
+        "Binary files ... differ" after a plain diff line
+        """
+        name = self.new_name
+        if name is None or name == DEV_NULL:
+            name = self.old_name
+        if name is None or name == DEV_NULL:
+            if self.index_name is None:
+                return None
+            return _decode_str(self.index_name)
+        return _decode_str(_strip_components(name, strip))
+
+    def _data(self):
+        return (self.start, self.old_name, self.new_name, self.index_name,
+                self.end, self.flags, tuple(self.hunks))
+
+
+def _git_names(line):
+    """ Returns the names of a "diff --git a/x b/y" line if they are
+    unambiguous
+    """
+    parts = line.rstrip(b"\r\n").split(b" ")
+    if len(parts) != 4:
+        return None, None
+    return parts[2], parts[3]
+
+
+class PatchIndex(object):
+
+    """ Index of the file sections and hunks of a patch file
+
+    The index is created by reading the patch file once. It is cached in
+    memory and if cache is set in a persistent SeriesCache as long as size,
+    modification time and inode of the patch file are unchanged. At most
+    memory_size indexes are kept in memory, the least recently used ones are
+    dropped first.
+    """
+
+    cache = None
+    memory_size = 256
+    _memory = OrderedDict()
+
+    def __init__(self, size=0, header_end=0, sections=None):
+        self.size = size
+        self.header_end = header_end
+        self.sections = [] if sections is None else sections
+
+    @classmethod
+    def load(cls, filename):
+        """ Returns the PatchIndex of the patch file filename """
+        path = os.path.abspath(filename)
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            key = _file_key(st)
+            entry = cls._memory.pop(path, None)
+            if entry is not None and entry[0] == key:
+                cls._memory[path] = entry
+                return entry[1]
+
+            data = None
+            if cls.cache is not None:
+                data = cls.cache.load(path, st)
+            if data is not None:
+                index = cls._from_data(data)
+            else:
+                index = cls.parse(f)
+                if cls.cache is not None:
+                    cls.cache.store(path, st, index._data())
+
+        if st.st_mtime <= time.time() - RACY_TIME:
+            cls._memory[path] = (key, index)
+            while len(cls._memory) > cls.memory_size:
+                cls._memory.popitem(last=False)
+        return index
+
+    @classmethod
+    def parse(cls, f):
+        """ Creates a PatchIndex by reading the binary file object f """
+        index = cls()
+        sections = index.sections
+        current = None
+        offset = 0
+        header_end = None
+        previous = b""
+        previous_offset = 0
+        has_diff = False  # the current section has a diff line
+        has_names = False  # the current section has ---/+++ lines
+        lines = iter(f)
+
+        for line in lines:
+            start = offset
+            offset += len(line)
+
+            if header_end is None and (line.startswith(b"---") or
+                                       line.startswith(b"Index:")):
+                header_end = start
+
+            if line.startswith(b"@@ ") and has_names:
+                ranges = _parse_hunk_header(line)
+                if ranges is not None:
+                    current.hunks.append(ranges + (start,))
+                    offset += _skip_hunk(lines, ranges[1], ranges[3])
+                    previous = b""
+                    continue
+
+            if line.startswith(b"+++ ") and previous.startswith(b"--- "):
+                if current is None or has_names:
+                    current = FileSection(previous_offset)
+                    sections.append(current)
+                # the index is also used for patches applied by GNU patch
+                current.old_name = _parse_name(previous, strict=False)
+                current.new_name = _parse_name(line, strict=False)
+                has_names = True
+            elif line.startswith(b"Index: "):
+                current = FileSection(start, index_name=line[7:].strip())
+                sections.append(current)
+                has_diff = has_names = False
+            elif line.startswith(b"diff "):
+                if current is None or has_diff or has_names:
+                    current = FileSection(start)
+                    sections.append(current)
+                if line.startswith(b"diff --git "):
+                    current.old_name, current.new_name = _git_names(line)
+                has_diff = True
+                has_names = False
+            elif current is not None and line.startswith(_GIT_PREFIXES):
+                for prefix, flag in _GIT_FLAGS:
+                    if line.startswith(prefix):
+                        current.flags |= flag
+                        break
+                name = line.rstrip(b"\r\n").split(b" ", 2)[-1]
+                if line.startswith((b"rename from ", b"copy from ")) and \
+                        current.old_name is None:
+                    current.old_name = b"a/" + name
+                elif line.startswith((b"rename to ", b"copy to ")) and \
+                        current.new_name is None:
+                    current.new_name = b"b/" + name
+            previous = line
+            previous_offset = start
+
+        for section, following in zip(sections, sections[1:]):
+            section.end = following.start
+        if sections:
+            sections[-1].end = offset
+        index.size = offset
+        index.header_end = offset if header_end is None else header_end
+        return index
+
+    @classmethod
+    def _from_data(cls, data):
+        size, header_end, sections = data
+        return cls(size, header_end,
+                   [FileSection(*section[:6], hunks=list(section[6]))
+                    for section in sections])
+
+    def _data(self):
+        return (self.size, self.header_end,
+                tuple(section._data() for section in self.sections))
+
+    def files(self, strip=1):
+        """ Returns the names of the files changed by the patch. Sections
+        without a name are left out. """
+        names = [section.target(strip) for section in self.sections]
+        return [name for name in names if name is not None]
+
+    def find(self, filename, strip=1):
+        """ Returns the FileSection of filename or None """
+        for section in self.sections:
+            if section.target(strip) == filename:
+                return section
+        return None
+
+    def read_section(self, f, section, trim=False):
+        """ Returns the bytes of section from the binary file object f
+
+        If trim is True lines following the last hunk of the section e.g. a
+        signature at the end of the patch are left out.
+        """
+        f.seek(section.start)
+        data = f.read(section.end - section.start)
+        if trim and section.hunks:
+            old_start, old_len, new_start, new_len, offset = \
+                section.hunks[-1]
+            offset -= section.start
+            lines = iter(io.BytesIO(data[offset:]))
+            size = len(next(lines, b"")) + _skip_hunk(lines, old_len, new_len)
+            for line in lines:
+                if line.startswith(b"\\"):
+                    size += len(line)
+                break
+            data = data[:offset + size]
+        return data
+
+
+_GIT_PREFIXES = tuple(prefix for prefix, flag in _GIT_FLAGS)
+
+
+def _skip_hunk(lines, old_len, new_len):
+    """ Skips the lines of a hunk body and returns their size in bytes """
+    size = 0
+    if old_len <= 0 and new_len <= 0:
+        return size
+    for line in lines:
+        size += len(line)
+        tag = line[:1]
+        if tag == b"-":
+            old_len -= 1
+        elif tag == b"+":
+            new_len -= 1
+        elif tag != b"\\":
+            old_len -= 1
+            new_len -= 1
+        if old_len <= 0 and new_len <= 0:
+            break
+    return size
@@ -9,7 +9,6 @@
 import os.path
 
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.patch import Patch
 from quilt.utils import Directory, File
 
@@ -17,12 +16,8 @@ from quilt.utils import Directory, File
 class Import(Command):
     """ Command class to import patches into the patch queue """
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Import, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Import, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
     def _import_patches(self, patches, reverse=False, strip=None):
         top = self.db.top_patch()
@@ -30,7 +25,7 @@ class Import(Command):
         for patch in patches:
             patchlist.append(Patch(patch, reverse=reverse, strip=strip))
         self.series.add_patches(patchlist, top)
-        self.series.save()
+        self.session.save()
 
     def import_patch(self, patch_name, new_name=None):
         """ Import patch into the patch queue
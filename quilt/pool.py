@@ -0,0 +1,113 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+""" Bounded pool of threads for operations on sets of files """
+
+import sys
+import threading
+
+import six
+
+
+class FilePool(object):
+
+    """ Runs a function for many files concurrently in at most workers
+    threads
+
+    File operations spend most of their time waiting for the file system,
+    especially on network file systems. They release the GIL meanwhile, so
+    running them in threads hides the latency of the single operations.
+    With one worker the items are processed in the calling thread. This is
+    the default because on local file systems the overhead of the threads
+    outweighs the gain.
+    """
+
+    workers = 1
+
+    def __init__(self, workers=None):
+        if workers is not None:
+            self.workers = workers
+
+    def map(self, func, items, done=None):
+        """ Calls func for each item and returns the list of the results in
+        the order of items.
+
+        If done is given it is called with each item and its result in the
+        calling thread and in the order of items, e.g. to emit signals.
+
+        If func raises an exception no further items are started. After the
+        running calls have finished the exception of the first failing item
+        is raised. Items are started in order, so all items before the
+        failing one have been processed and done has been called for them.
+        """
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1:
+            results = []
+            for item in items:
+                result = func(item)
+                if done is not None:
+                    done(item, result)
+                results.append(result)
+            return results
+
+        results = [None] * len(items)
+        finished = [False] * len(items)
+        errors = {}
+        started = [0]
+        cond = threading.Condition()
+
+        def worker():
+            while True:
+                with cond:
+                    index = started[0]
+                    if index >= len(items) or errors:
+                        return
+                    started[0] += 1
+                try:
+                    result = func(items[index])
+                except Exception:
+                    with cond:
+                        errors[index] = sys.exc_info()
+                        finished[index] = True
+                        cond.notify()
+                    return
+                with cond:
+                    results[index] = result
+                    finished[index] = True
+                    cond.notify()
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(self.workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for index, item in enumerate(items):
+                with cond:
+                    while not finished[index]:
+                        if errors and index >= started[0]:
+                            # the item will never be started
+                            break
+                        cond.wait()
+                    if not finished[index] or index in errors:
+                        break
+                if done is not None:
+                    done(item, results[index])
+        except BaseException:
+            with cond:
+                # don't start further items
+                started[0] = len(items)
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            six.reraise(*errors[min(errors)])
+        return results
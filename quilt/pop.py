@@ -7,24 +7,30 @@
 # See LICENSE comming with the source of python-quilt for details.
 
 from quilt.command import Command
-from quilt.db import Db
 from quilt.error import NoAppliedPatch, QuiltError
 from quilt.patch import RollbackPatch, Patch
 from quilt.signals import Signal
-from quilt.utils import Directory, File
+from quilt.utils import File
 
 
 class Pop(Command):
 
+    """ Command class to unapply patches
+
+    If collapse is True several patches are unapplied at once by restoring
+    each file only from the backup of the lowest patch changing it instead
+    of unapplying the patches one after another.
+    """
+
     unapplying = Signal()
     unapplied = Signal()
     unapplied_patch = Signal()
     empty_patch = Signal()
 
-    def __init__(self, cwd, quilt_pc):
-        super(Pop, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.db = Db(quilt_pc)
+    collapse = False
+
+    def __init__(self, cwd, quilt_pc, session=None):
+        super(Pop, self).__init__(cwd, quilt_pc, session=session)
 
     def _check(self, force=False):
         if not self.db.exists() or not self.db.patches():
@@ -50,7 +56,7 @@ class Pop(Command):
             self.empty_patch(patch)
         else:
             unpatch = RollbackPatch(self.cwd, pc_dir)
-            unpatch.rollback()
+            unpatch.rollback(move=True)
             unpatch.delete_backup()
 
         self.db.remove_patch(patch)
@@ -60,16 +66,57 @@ class Pop(Command):
 
         self.unapplied_patch(patch)
 
-    def unapply_patch(self, patch_name, force=False):
+    def _unapply_patches(self, patches, collapse=None):
+        """ Unapply the applied patches which must be the top patches """
+        if collapse is None:
+            collapse = self.collapse
+        if not collapse or len(patches) < 2:
+            for patch in reversed(patches):
+                self._unapply_patch(patch)
+            return
+
+        # the backup of the lowest patch holds the file before all patches
+        backups = dict()
+        pc_dirs = []
+        for patch in reversed(patches):
+            self.unapplying(patch)
+
+            pc_dir = self.quilt_pc + patch.get_name()
+            timestamp = pc_dir + File(".timestamp")
+            timestamp.delete_if_exists()
+            if pc_dir.is_empty():
+                self.empty_patch(patch)
+            else:
+                for file_name in pc_dir.files():
+                    backups[file_name] = len(pc_dirs)
+            pc_dirs.append(pc_dir)
+
+        files = [[] for pc_dir in pc_dirs]
+        for file_name, index in backups.items():
+            files[index].append(file_name)
+        for pc_dir, file_names in zip(pc_dirs, files):
+            if file_names:
+                unpatch = RollbackPatch(self.cwd, pc_dir)
+                unpatch.rollback(move=True, files=sorted(file_names))
+
+        for patch, pc_dir in zip(reversed(patches), pc_dirs):
+            pc_dir.delete()
+            self.db.remove_patch(patch)
+
+            refresh = File(pc_dir.get_name() + "~refresh")
+            refresh.delete_if_exists()
+
+            self.unapplied_patch(patch)
+
+    def unapply_patch(self, patch_name, force=False, collapse=None):
         """ Unapply patches up to patch_name. patch_name will end up as top
             patch """
         self._check(force)
 
         patches = self.db.patches_after(Patch(patch_name))
-        for patch in reversed(patches):
-            self._unapply_patch(patch)
+        self._unapply_patches(patches, collapse)
 
-        self.db.save()
+        self.session.save()
 
         self.unapplied(self.db.top_patch())
 
@@ -80,17 +127,16 @@ class Pop(Command):
         patch = self.db.top_patch()
         self._unapply_patch(patch)
 
-        self.db.save()
+        self.session.save()
 
         self.unapplied(self.db.top_patch())
 
-    def unapply_all(self, force=False):
+    def unapply_all(self, force=False, collapse=None):
         """ Unapply all patches """
         self._check(force)
 
-        for patch in reversed(self.db.applied_patches()):
-            self._unapply_patch(patch)
+        self._unapply_patches(self.db.applied_patches(), collapse)
 
-        self.db.save()
+        self.session.save()
 
         self.unapplied(self.db.top_patch())
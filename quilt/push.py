@@ -6,59 +6,89 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
+import os
 import os.path
 
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import NoPatchesInSeries, AllPatchesApplied, QuiltError
 from quilt.patch import Patch, RollbackPatch
+from quilt.patchfile import UnsupportedPatch
 from quilt.signals import Signal
-from quilt.utils import SubprocessError, File, Directory
+from quilt.utils import SubprocessError, File
 
 
 class Push(Command):
 
+    """ Command class to apply patches
+
+    If collapse is True several patches are applied at once in memory by
+    the python engine. Each changed file is written only once after all
+    patches have been applied. The backups of the patches are created from
+    the contents in memory and get the modes of the files. The python engine
+    is used regardless of Patch.engine. Only patches it doesn't support are
+    applied by GNU patch.
+    """
+
     applying = Signal()
     applying_patch = Signal()
     applied = Signal()
     applied_patch = Signal()
     applied_empty_patch = Signal()
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Push, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    collapse = False
+
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Push, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
     def _apply_patch(self, patch, force=False, quiet=False):
+        self.applying_patch(patch)
+        forced, exact = self._run_patch(patch, force, quiet)
+        self._finish_patch(patch, forced, exact)
+
+    def _run_patch(self, patch, force=False, quiet=False):
+        """ Applies patch to the working tree. Returns a tuple of forced and
+        exact. forced is True if the patch has been applied forcefully, exact
+        is True if it is known that all hunks applied without offset and
+        fuzz. """
         patch_name = patch.get_name()
         pc_dir = self.quilt_pc + patch_name
         patch_file = self.quilt_patches + File(patch_name)
         refresh = File(pc_dir.get_name() + "~refresh")
 
         forced = False
-        self.applying_patch(patch)
-
+        exact = True
         if patch_file.exists():
             try:
-                patch.run(self.cwd, patch_dir=self.quilt_patches, backup=True,
-                          prefix=pc_dir.get_name(), quiet=quiet)
+                exact = patch.run(self.cwd, patch_dir=self.quilt_patches,
+                                  backup=True, prefix=pc_dir.get_name(),
+                                  quiet=quiet)
             except SubprocessError as e:
                 if not force:
                     patch = RollbackPatch(self.cwd, pc_dir)
-                    patch.rollback()
+                    patch.rollback(move=True)
                     patch.delete_backup()
                     raise QuiltError("Patch %s does not apply" % patch_name)
                 else:
                     refresh.touch()
                     forced = True
+        return forced, exact
+
+    def _finish_patch(self, patch, forced, exact=False):
+        """ Records patch as applied after its changes have been made. The
+        timestamp used by incremental refreshes is only kept if the patch is
+        known to match the working tree exactly. """
+        patch_name = patch.get_name()
+        pc_dir = self.quilt_pc + patch_name
+        patch_file = self.quilt_patches + File(patch_name)
 
         self.db.add_patch(patch)
 
         if pc_dir.exists():
             timestamp = pc_dir + File(".timestamp")
-            timestamp.touch()
+            if exact and not forced:
+                timestamp.touch()
+            else:
+                timestamp.delete_if_exists()
         else:
             pc_dir.create()
 
@@ -72,6 +102,71 @@ class Push(Command):
         else:
             self.applied_patch(patch)
 
+    def _apply_patches(self, patches, force=False, quiet=False,
+                       collapse=None, applying=False):
+        """ Applies patches. If applying is True the applying signal is
+        emitted for each patch. """
+        if collapse is None:
+            collapse = self.collapse
+        if not collapse or len(patches) < 2:
+            for patch in patches:
+                if applying:
+                    self.applying(patch)
+                self._apply_patch(patch, force, quiet)
+            return
+
+        # imported here to keep the startup time of the gnu engine low
+        from quilt.apply import StackApplier
+
+        stack = StackApplier(self.cwd, quiet=quiet)
+        try:
+            for index, patch in enumerate(patches):
+                if applying:
+                    self.applying(patch)
+                if not self._apply_patch_collapsed(stack, patch, force,
+                                                   quiet):
+                    # apply the rest one by one
+                    self._apply_patches(patches[index + 1:], force, quiet,
+                                        False, applying)
+                    return
+        finally:
+            stack.flush()
+
+    def _apply_patch_collapsed(self, stack, patch, force=False, quiet=False):
+        """ Applies patch on top of the contents of stack. Returns False if
+        the patch isn't supported by the stack and has been applied to the
+        working tree instead. """
+        patch_name = patch.get_name()
+        pc_dir = self.quilt_pc + patch_name
+        patch_file = self.quilt_patches + File(patch_name)
+
+        self.applying_patch(patch)
+        if not patch_file.exists():
+            self._finish_patch(patch, False, True)
+            return True
+
+        try:
+            success = stack.apply(patch_file.get_name(),
+                                  pc_dir.get_name() + os.sep,
+                                  strip=patch.strip, reverse=patch.reverse)
+        except UnsupportedPatch:
+            stack.flush()
+            forced, exact = self._run_patch(patch, force, quiet)
+            self._finish_patch(patch, forced, exact)
+            return False
+
+        forced = False
+        if not success:
+            if not force:
+                stack.discard()
+                raise QuiltError("Patch %s does not apply" % patch_name)
+            refresh = File(pc_dir.get_name() + "~refresh")
+            refresh.touch()
+            forced = True
+        stack.commit()
+        self._finish_patch(patch, forced, not stack.mismatch)
+        return True
+
     def _check(self):
         if not self.series.exists() or not self.series.patches():
             raise NoPatchesInSeries(self.series)
@@ -84,7 +179,8 @@ class Push(Command):
                 raise QuiltError("Patch %s needs to be refreshed" % \
                                       top.get_name())
 
-    def apply_patch(self, patch_name, force=False, quiet=False):
+    def apply_patch(self, patch_name, force=False, quiet=False,
+                    collapse=None):
         """ Apply all patches up to patch_name """
         self._check()
         patch = Patch(patch_name)
@@ -101,10 +197,9 @@ class Push(Command):
         self.applying(patch)
 
         try:
-            for cur_patch in patches:
-                self._apply_patch(cur_patch, force, quiet)
+            self._apply_patches(patches, force, quiet, collapse)
         finally:
-            self.db.save()
+            self.session.save()
 
         self.applied(self.db.top_patch())
 
@@ -124,11 +219,11 @@ class Push(Command):
 
         self._apply_patch(patch, force, quiet)
 
-        self.db.save()
+        self.session.save()
 
         self.applied(self.db.top_patch())
 
-    def apply_all(self, force=False, quiet=False):
+    def apply_all(self, force=False, quiet=False, collapse=None):
         """ Apply all patches in series file """
         self._check()
         top = self.db.top_patch()
@@ -141,10 +236,9 @@ class Push(Command):
             raise AllPatchesApplied(self.series, top)
 
         try:
-            for patch in patches:
-                self.applying(patch)
-                self._apply_patch(patch, force, quiet)
+            self._apply_patches(patches, force, quiet, collapse,
+                                applying=True)
         finally:
-            self.db.save()
+            self.session.save()
 
         self.applied(self.db.top_patch())
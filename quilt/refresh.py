@@ -6,37 +6,58 @@
 #
 # See LICENSE comming with the source of python-quilt for details.
 
+import multiprocessing
+import os
 import os.path
 
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import QuiltError
-from quilt.patch import Patch, Diff
+from quilt.patch import Patch, Diff, ENGINE_GNU, ENGINE_PYTHON
+from quilt.pool import FilePool
 from quilt.signals import Signal
-from quilt.utils import Directory, File, TmpFile, _encode_str
+from quilt.utils import ComparingAtomicFile, File, Process, \
+                        SubprocessError, TmpDirectory, TmpFile, _encode_str
 
 INDEX_LINE = \
     b"==================================================================="
 
 
+def _diff_output(job):
+    """ Returns the diff of a file of a Refresh._parallel_diff job """
+    cwd, left, right, left_label, right_label, engine = job
+    return Diff(left, right).output(cwd, left_label=left_label,
+                                    right_label=right_label, engine=engine)
+
+
 class Refresh(Command):
     """ Command class to refresh (add or remove chunks) a patch
+
+    If incremental is True only the files changed since the .timestamp of
+    the patch are compared again. The sections of the other files are copied
+    from the current patch file.
+
+    If diff_workers is greater than one the files are compared concurrently
+    and the output is merged in the same order as in serial mode.
     """
 
     edit_patch = Signal()
     refreshed = Signal()
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Refresh, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    incremental = False
+    # BufferedWriter of the last written patch, e.g. for its counters
+    writer = None
+    # number of processes or threads comparing the files of a patch
+    diff_workers = 1
+
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Refresh, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
-    def refresh(self, patch_name=None, edit=False):
+    def refresh(self, patch_name=None, edit=False, incremental=None):
         """ Refresh patch with patch_name or applied top patch if patch_name is
         None
         """
+        if incremental is None:
+            incremental = self.incremental
         if patch_name:
             patch = Patch(patch_name)
         else:
@@ -49,41 +70,71 @@ class Refresh(Command):
         patch_file = self.quilt_patches + File(patch.get_name())
         files = pc_dir.content()[1]
 
-        with TmpFile(prefix="pquilt-") as tmpfile:
-            f = tmpfile.open()
+        with ComparingAtomicFile(patch_file.get_name()) as tmpfile:
 
             if patch_file.exists():
                 header = patch.get_header(self.quilt_patches)
                 tmpfile.write(header)
 
-            for file_name in files:
-                if file_name == ".timestamp":
+            files = [name for name in files if name != ".timestamp"]
+
+            def get_labels(file_name):
+                return self._get_labels(file_name, pc_dir + File(file_name),
+                                        File(file_name))
+
+            labels = FilePool().map(get_labels, files)
+
+            unchanged = dict()
+            if incremental and patch_file.exists():
+                unchanged = self._unchanged_sections(patch, pc_dir, files,
+                                                     labels)
+            changed = [name for name in files if name not in unchanged]
+
+            sections = None
+            outputs = None
+            if self.diff_workers > 1 and len(changed) > 1:
+                outputs = self._parallel_diff(pc_dir, changed, [
+                    label for file_name, label in zip(files, labels)
+                    if file_name not in unchanged])
+            elif Diff.engine == ENGINE_GNU and len(changed) > 1:
+                sections = self._batch_diff(pc_dir, changed)
+
+            for file_name, (left_label, right_label, index) in zip(files,
+                                                                  labels):
+                if file_name in unchanged:
+                    tmpfile.write(unchanged[file_name])
                     continue
+
                 orig_file = pc_dir + File(file_name)
                 new_file = File(file_name)
-                left_label, right_label, index = self._get_labels(file_name,
-                                                                  orig_file,
-                                                                  new_file)
                 self._write_index(tmpfile, index)
 
+                if outputs is not None:
+                    tmpfile.write(outputs[file_name])
+                    continue
+
+                if sections is not None:
+                    self._write_section(tmpfile, sections.get(file_name),
+                                        left_label, right_label)
+                    continue
+
                 diff = Diff(orig_file, new_file)
-                diff.run(self.cwd, fd=f, left_label=left_label,
-                         right_label=right_label)
+                tmpfile.write(diff.output(self.cwd, left_label=left_label,
+                                          right_label=right_label))
 
             if tmpfile.is_empty():
                 raise QuiltError("Nothing to refresh.")
 
             if edit:
+                tmpfile.flush()
                 self.edit_patch(tmpfile)
+                tmpfile.modified()
                 tpatch = Patch(tmpfile.get_name())
                 tpatch.run(pc_dir.get_name(), dry_run=True, quiet=True)
 
-            if patch_file.exists():
-                diff = Diff(patch_file, tmpfile)
-                if diff.equal(self.cwd):
-                    raise QuiltError("Nothing to refresh.")
-
-            tmpfile.copy(patch_file)
+            if not tmpfile.changed():
+                raise QuiltError("Nothing to refresh.")
+            self.writer = tmpfile.writer
 
         timestamp = pc_dir + File(".timestamp")
         timestamp.touch()
@@ -110,9 +161,154 @@ class Refresh(Command):
 
         return (old_hdr, new_hdr, index)
 
+    def _unchanged_sections(self, patch, pc_dir, files, labels):
+        """ Returns a dict mapping the names of the files which haven't been
+        changed since the .timestamp of the patch to their sections in the
+        current patch file.
+
+        A file is unchanged if the modification and status change times of
+        the file and of its backup are older than the timestamp. The status
+        change time also detects files restored with their old modification
+        time. If the patch file has been changed after the timestamp or the
+        patch has been applied forcefully all files are compared again.
+        """
+        timestamp = pc_dir + File(".timestamp")
+        patch_file = self.quilt_patches + File(patch.get_name())
+        refresh = File(pc_dir.get_name() + "~refresh")
+        if refresh.exists():
+            return dict()
+        try:
+            since = os.stat(timestamp.get_name()).st_mtime
+            if os.stat(patch_file.get_name()).st_mtime > since:
+                return dict()
+        except OSError:
+            return dict()
+
+        def unchanged(file_name):
+            for name in (os.path.join(self.cwd, file_name),
+                         os.path.join(pc_dir.get_name(), file_name)):
+                try:
+                    st = os.stat(name)
+                except OSError:
+                    return False
+                if max(st.st_mtime, st.st_ctime) >= since:
+                    return False
+            return True
+
+        candidates = [file_name for file_name, is_unchanged in
+                      zip(files, FilePool().map(unchanged, files))
+                      if is_unchanged]
+        if not candidates:
+            return dict()
+
+        patch_index = patch.get_index(self.quilt_patches)
+        by_index = dict((section.index_name, section)
+                        for section in patch_index.sections
+                        if section.index_name is not None)
+        index_names = dict(zip(files, (label[2] for label in labels)))
+
+        sections = dict()
+        with open(patch_file.get_name(), "rb") as f:
+            for file_name in candidates:
+                section = by_index.get(_encode_str(index_names[file_name]))
+                if section is not None:
+                    sections[file_name] = patch_index.read_section(
+                        f, section, trim=True)
+        return sections
+
     def _write_index(self, f, index):
-        f.write(b"Index: ")
-        f.write(_encode_str(index))
-        f.write(b"\n")
-        f.write(INDEX_LINE)
-        f.write(b"\n")
+        f.write(b"Index: " + _encode_str(index) + b"\n" + INDEX_LINE + b"\n")
+
+    def _parallel_diff(self, pc_dir, files, labels):
+        """ Compares the backups of files with the working tree concurrently
+        and returns a dict mapping the file names to the diff output.
+        In-process diffs are generated in diff_workers processes because they
+        are bound by the CPU. GNU diff processes are started from as many
+        threads.
+        """
+        jobs = [(self.cwd, (pc_dir + File(file_name)).get_name(), file_name,
+                 left_label, right_label, Diff.engine)
+                for file_name, (left_label, right_label, index)
+                in zip(files, labels)]
+        if Diff.engine == ENGINE_PYTHON:
+            pool = multiprocessing.Pool(min(self.diff_workers, len(jobs)))
+            try:
+                outputs = pool.map(_diff_output, jobs)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            outputs = FilePool(self.diff_workers).map(_diff_output, jobs)
+        return dict(zip(files, outputs))
+
+    def _batch_diff(self, pc_dir, files):
+        """ Compares the backups of all files with the working tree by a
+        single recursive diff run on a farm of symbolic links.
+        Returns a dict mapping the file names to a tuple (binary, body) or
+        None if the output can't be split into the sections of the files.
+        """
+        with TmpDirectory(prefix="pquilt-") as tmpdir:
+            for side, dirname in (("a", pc_dir.get_name()), ("b", "")):
+                for file_name in files:
+                    target = os.path.abspath(os.path.join(self.cwd, dirname,
+                                                          file_name))
+                    if not os.path.exists(target):
+                        continue
+                    link = os.path.join(tmpdir.get_name(), side, file_name)
+                    linkdir = os.path.dirname(link)
+                    if not os.path.isdir(linkdir):
+                        os.makedirs(linkdir)
+                    os.symlink(target, link)
+
+            with TmpFile(prefix="pquilt-") as output:
+                try:
+                    Process(["diff", "-Nru", "a", "b"]).run(
+                        cwd=tmpdir.get_name(), stdout=output.open())
+                except SubprocessError as e:
+                    if e.get_returncode() > 1:
+                        raise e
+                with open(output.get_name(), "rb") as f:
+                    return self._split_batch_output(f, files)
+
+    def _split_batch_output(self, lines, files):
+        names = dict((_encode_str(name), name) for name in files)
+        sections = {}
+        body = None
+        previous = None
+        for line in lines:
+            if line.startswith(b"diff "):
+                body = None
+            elif line.startswith(b"Binary files a/"):
+                name = line[15:].split(b" and b/", 1)[0]
+                if line != b"Binary files a/" + name + b" and b/" + name + \
+                        b" differ\n" or name not in names:
+                    return None
+                sections[names[name]] = (True, None)
+                body = None
+            elif line.startswith(b"+++ b/") and previous is not None and \
+                    previous.startswith(b"--- a/") and body is None:
+                name = previous[6:].split(b"\t", 1)[0]
+                if name not in names or \
+                        line[6:].split(b"\t", 1)[0] != name:
+                    return None
+                body = []
+                sections[names[name]] = (False, body)
+            elif body is not None:
+                body.append(line)
+            elif not line.startswith(b"--- a/"):
+                return None
+            previous = line
+        return sections
+
+    def _write_section(self, f, section, left_label, right_label):
+        if section is None:
+            return
+        binary, body = section
+        left_label = _encode_str(left_label)
+        right_label = _encode_str(right_label)
+        if binary:
+            f.write(b"Binary files " + left_label + b" and " + right_label +
+                    b" differ\n")
+        else:
+            f.write(b"--- " + left_label + b"\n+++ " + right_label + b"\n" +
+                    b"".join(body))
@@ -7,14 +7,15 @@
 # See LICENSE comming with the source of python-quilt for details.
 
 import os
+import shutil
 
 from quilt.backup import Backup
 from quilt.command import Command
-from quilt.db import Db, Series
 from quilt.error import QuiltError
-from quilt.patch import Diff, Patch
+from quilt.patch import Patch
+from quilt.patchfile import UnsupportedPatch, parse_patch
 from quilt.signals import Signal
-from quilt.utils import Directory, File, SubprocessError, TmpDirectory
+from quilt.utils import File, SubprocessError, TmpDirectory, split_lines
 
 
 class Revert(Command):
@@ -25,12 +26,8 @@ class Revert(Command):
     file_reverted = Signal()
     file_unchanged = Signal()
 
-    def __init__(self, cwd, quilt_pc, quilt_patches):
-        super(Revert, self).__init__(cwd)
-        self.quilt_pc = Directory(quilt_pc)
-        self.quilt_patches = Directory(quilt_patches)
-        self.db = Db(quilt_pc)
-        self.series = Series(quilt_patches)
+    def __init__(self, cwd, quilt_pc, quilt_patches, session=None):
+        super(Revert, self).__init__(cwd, quilt_pc, quilt_patches, session)
 
     def _file_in_patch(self, filename, patch):
         """ Checks if a backup file of the filename in the current patch
@@ -42,24 +39,9 @@ class Revert(Command):
             raise QuiltError("File %s is not in patch %s" % (filename,
                              patch.get_name()))
 
-    def _file_in_next_patches(self, filename, patch):
-        """ Checks if a backup file of the filename in the applied patches after
-        patch exists """
-
-        if not self.db.is_patch(patch):
-            # no patches applied
-            return
-
-        patches = self.db.patches_after(patch)
-        for patch in patches:
-            file = self.quilt_pc + File(os.path.join(patch.get_name(),
-                                                     filename))
-            if file.exists():
-                raise QuiltError("File %s is modified by patch %s" %
-                                 (filename, patch.get_name()))
-
     def _apply_patch_temporary(self, tmpdir, file, patch):
-        backup = Backup()
+        # the patch replaces the backup, so it may be a link to file
+        backup = Backup(link=True)
         backup_file = backup.backup_file(file, tmpdir)
         patch_file = self.quilt_patches + File(patch.get_name())
 
@@ -74,22 +56,55 @@ class Revert(Command):
                 pass  # Expected to fail if there are other files in patch
         return backup_file
 
-    def revert_file(self, filename, patch_name=None):
-        """ Revert not added changes of filename.
-        If patch_name is None or empty the topmost patch will be used.
+    def _read_lines(self, file):
+        if not file.exists():
+            return []
+        with open(file.get_name(), "rb") as f:
+            return split_lines(f.read())
+
+    def _patched_lines(self, filename, pc_file, patch, patch_data):
+        """ Returns the lines of the backup pc_file with the changes of
+        filename in patch applied. Only the sections of filename are read
+        from the patch file. Returns None if the sections can't be applied
+        in-process.
         """
+        lines = self._read_lines(pc_file)
+        if patch_data is None:
+            return lines
+
+        # imported here to keep the startup time of the other commands low
+        from quilt.apply import apply_hunks
+
+        index, f = patch_data
+        filename = os.path.normpath(filename)
+        for section in index.sections:
+            # sections without a name e.g. binary files of a plain diff are
+            # skipped like GNU patch does
+            target = section.target(patch.strip)
+            if target is None or target != filename:
+                continue
+            if section.is_binary():
+                return None
+            data = index.read_section(f, section, trim=True)
+            try:
+                file_patches = parse_patch(split_lines(data))
+            except UnsupportedPatch:
+                return None
+            for file_patch in file_patches:
+                if patch.reverse:
+                    file_patch = file_patch.reversed()
+                # like patch --force failing hunks are left out
+                lines = apply_hunks(lines, file_patch.hunks).lines
+        return lines
+
+    def _revert_file(self, filename, patch, patch_data, index):
         file = File(filename)
 
-        if patch_name:
-            patch = Patch(patch_name)
-        else:
-            patch = self.db.top_patch()
-
-            if not patch:
-                raise QuiltError("No patch available. Nothing to revert.")
-
         self._file_in_patch(filename, patch)
-        self._file_in_next_patches(filename, patch)
+        next_patch = self.db.file_in_next_patches(filename, patch, index)
+        if next_patch:
+            raise QuiltError("File %s is modified by patch %s" %
+                             (filename, next_patch.get_name()))
         pc_dir = self.quilt_pc + patch.get_name()
         pc_file = pc_dir + file
 
@@ -99,27 +114,59 @@ class Revert(Command):
             self.file_reverted(file, patch)
             return
 
-        with TmpDirectory(prefix="pquilt-") as tmpdir:
-            # apply current patch in temporary directory to revert changes of
-            # file that aren't committed in the patch
-            tmp_file = self._apply_patch_temporary(tmpdir, pc_file, patch)
-            if tmp_file and tmp_file.exists() and not tmp_file.is_empty():
-
-                diff = Diff(file, tmp_file)
-                if diff.equal(self.cwd):
-                    self.file_unchanged(file, patch)
-                    return
-
-                dir = file.get_directory()
-                if not dir:
-                    dir = Directory(os.getcwd())
-                else:
-                    dir.create()
-                tmp_file.copy(dir)
-                self.file_reverted(file, patch)
-            else:
-                self.file_unchanged(file, patch)
+        lines = self._patched_lines(filename, pc_file, patch, patch_data)
+        if lines is None:
+            with TmpDirectory(prefix="pquilt-") as tmpdir:
+                # apply current patch in temporary directory to revert
+                # changes of file that aren't committed in the patch
+                tmp_file = self._apply_patch_temporary(tmpdir, pc_file,
+                                                       patch)
+                lines = self._read_lines(tmp_file)
+
+        if not lines or self._read_lines(file) == lines:
+            self.file_unchanged(file, patch)
+            return
+
+        from quilt.apply import write_file
+
+        exists = file.exists()
+        write_file(filename, lines)
+        if not exists:
+            shutil.copymode(pc_file.get_name(), filename)
+        self.file_reverted(file, patch)
+
+    def revert_file(self, filename, patch_name=None):
+        """ Revert not added changes of filename.
+        If patch_name is None or empty the topmost patch will be used.
+        """
+        self.revert_files([filename], patch_name)
 
     def revert_files(self, filenames, patch_name=None):
-        for filename in filenames:
-            self.revert_file(filename, patch_name)
+        """ Revert not added changes of all filenames.
+        If patch_name is None or empty the topmost patch will be used.
+
+        The patch file is parsed once for all files and only the changes of
+        the reverted files are applied to their backups. For many files the
+        backups of the applied patches after the patch are looked up once for
+        all files.
+        """
+        if patch_name:
+            patch = Patch(patch_name)
+        else:
+            patch = self.db.top_patch()
+
+            if not patch:
+                raise QuiltError("No patch available. Nothing to revert.")
+
+        filenames = list(filenames)
+        next_index = self.db.next_patches_index(patch, len(filenames))
+        patch_file = self.quilt_patches + File(patch.get_name())
+        if not patch_file.exists() or patch_file.is_empty():
+            for filename in filenames:
+                self._revert_file(filename, patch, None, next_index)
+            return
+
+        index = patch.get_index(self.quilt_patches)
+        with open(patch_file.get_name(), "rb") as f:
+            for filename in filenames:
+                self._revert_file(filename, patch, (index, f), next_index)
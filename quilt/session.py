@@ -0,0 +1,56 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+from quilt.db import Db, Series
+from quilt.error import QuiltError
+from quilt.utils import DirectoryParam
+
+
+class Session(object):
+
+    """ Holds the quilt meta data of a working tree
+
+    The applied patches of quilt_pc and the series file of quilt_patches are
+    loaded once on first access. Commands created with the same session share
+    them, so several commands can be run one after another without reading
+    the meta data again.
+    """
+
+    @DirectoryParam(["quilt_pc", "quilt_patches"])
+    def __init__(self, quilt_pc, quilt_patches=None):
+        self.quilt_pc = quilt_pc
+        self.quilt_patches = quilt_patches
+        self._db = None
+        self._series = None
+
+    @property
+    def db(self):
+        """ The Db of the applied patches """
+        if self._db is None:
+            self._db = Db(self.quilt_pc.get_name())
+        return self._db
+
+    @property
+    def series(self):
+        """ The Series of all patches """
+        if self._series is None:
+            if self.quilt_patches is None:
+                raise QuiltError("No patches directory set")
+            self._series = Series(self.quilt_patches.get_name())
+        return self._series
+
+    def save(self):
+        """ Saves the series file and the applied patches if they have been
+        changed and flushes them to disk according to their fsync policy
+        """
+        loaded = [series for series in (self._series, self._db) if series]
+        for series in loaded:
+            if series.is_dirty():
+                series.save()
+        for series in loaded:
+            series.sync()
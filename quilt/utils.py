@@ -10,15 +10,23 @@
 
 import functools
 import inspect
+import io
 import os
 import os.path
 import shutil
 import six
+import stat
 import subprocess
+import sys
 import tempfile
 
 from quilt.error import QuiltError
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 try:  # Python 3: getargspec() is deprecated
     _getargspec = inspect.getfullargspec
 except AttributeError:  # Python < 3
@@ -27,6 +35,9 @@ except AttributeError:  # Python < 3
 if str is bytes:  # Python < 3
     def _encode_str(s):
         return s
+
+    def _decode_str(b):
+        return b
 else:  # Python 3
     from locale import getpreferredencoding
     _encoding = getpreferredencoding(do_setlocale=False)
@@ -34,6 +45,166 @@ else:  # Python 3
     def _encode_str(s):
         return s.encode(_encoding)
 
+    def _decode_str(b):
+        return b.decode(_encoding)
+
+# Policies when to call fsync for written metadata files
+FSYNC_NEVER = "never"
+FSYNC_COMMAND = "command"  # once at the end of a command
+FSYNC_ALWAYS = "always"  # after every write
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_COMMAND, FSYNC_ALWAYS)
+
+if hasattr(os, "replace"):
+    _replace = os.replace
+else:  # Python < 3.3
+    _replace = os.rename
+
+
+def fsync_directory(dirname):
+    """ Flushes the directory entries of dirname to disk. This is required to
+    persist a renamed file. Platforms not supporting to open a directory are
+    ignored.
+    """
+    try:
+        fd = os.open(dirname or os.curdir, os.O_RDONLY)
+    except (OSError, IOError):
+        return
+    try:
+        os.fsync(fd)
+    except (OSError, IOError):
+        pass
+    finally:
+        os.close(fd)
+
+
+COMPARE_CHUNK_SIZE = 1 << 16
+
+
+def files_equal(filename1, filename2, chunk_size=COMPARE_CHUNK_SIZE):
+    """ Returns True if the contents of both files are equal
+
+    Files with different sizes and the same file (e.g. a hard link) are
+    detected by their stat results. Otherwise the contents are compared in
+    chunks. Files which aren't regular e.g. /dev/null are always read.
+    """
+    st1 = os.stat(filename1)
+    st2 = os.stat(filename2)
+    if st1.st_dev == st2.st_dev and st1.st_ino == st2.st_ino:
+        return True
+    if stat.S_ISREG(st1.st_mode) and stat.S_ISREG(st2.st_mode) and \
+            st1.st_size != st2.st_size:
+        return False
+
+    with open(filename1, "rb") as f1:
+        with open(filename2, "rb") as f2:
+            while True:
+                data1 = f1.read(chunk_size)
+                data2 = f2.read(chunk_size)
+                if data1 != data2:
+                    return False
+                if not data1:
+                    return True
+
+
+def split_lines(data):
+    """ Splits bytes into lines keeping the line endings """
+    return io.BytesIO(data).readlines()
+
+
+# FICLONE ioctl of Linux, _IOW(0x94, 9, int)
+FICLONE = 0x40049409 if sys.platform.startswith("linux") else None
+
+COPY_REFLINK = "reflink"  # the copy shares the data blocks (btrfs, XFS)
+COPY_FILE_RANGE = "copy_file_range"
+COPY_SENDFILE = "sendfile"
+COPY_USERSPACE = "userspace"
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def _copy_loop(copy, size):
+    """ Calls copy with the offset and the number of bytes to copy until it
+    returns 0 and returns the number of bytes copied. The file may have
+    grown since its size has been taken, so size is only a hint. """
+    offset = 0
+    while True:
+        copied = copy(offset, max(size - offset, COPY_CHUNK_SIZE))
+        if not copied:
+            return offset
+        offset += copied
+
+
+def _copy_fd(src_fd, dest_fd, size):
+    """ Copies the content of src_fd to the empty file dest_fd and returns
+    the strategy used for copying. size is the expected size of the
+    content. """
+    if fcntl is not None and FICLONE is not None:
+        try:
+            fcntl.ioctl(dest_fd, FICLONE, src_fd)
+            return COPY_REFLINK
+        except (IOError, OSError):
+            pass
+
+    # some file systems e.g. procfs report no content to copy_file_range
+    # and sendfile, so they are only used if they copy anything
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        try:
+            if _copy_loop(lambda offset, count: copy_file_range(
+                    src_fd, dest_fd, count, offset, offset), size):
+                return COPY_FILE_RANGE
+        except OSError:
+            os.ftruncate(dest_fd, 0)
+
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is not None:
+        try:
+            if _copy_loop(lambda offset, count: sendfile(
+                    dest_fd, src_fd, offset, count), size):
+                return COPY_SENDFILE
+        except OSError:
+            os.ftruncate(dest_fd, 0)
+            os.lseek(dest_fd, 0, os.SEEK_SET)
+
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    while True:
+        data = os.read(src_fd, COPY_CHUNK_SIZE)
+        if not data:
+            return COPY_USERSPACE
+        while data:
+            data = data[os.write(dest_fd, data):]
+
+
+def copy_file(src, dest):
+    """ Copies the file src to dest like shutil.copy2 and returns the
+    strategy used for copying
+
+    The copy is tried as reflink first, which shares the data blocks on
+    file systems supporting copy-on-write. Otherwise the data is copied by
+    the kernel with copy_file_range or sendfile if available and read and
+    written in userspace as last resort.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        raise shutil.Error("%s and %s are the same file" % (src, dest))
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(src_fd)
+        if not stat.S_ISREG(st.st_mode):
+            shutil.copy2(src, dest)
+            return COPY_USERSPACE
+        dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                          stat.S_IMODE(st.st_mode))
+        try:
+            strategy = _copy_fd(src_fd, dest_fd, st.st_size)
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dest)
+    return strategy
+
 
 class _EqBase(object):
     """ Helpers for defining __eq__ in Python < 3
@@ -43,6 +214,7 @@ class _EqBase(object):
     equivalent objects. This avoids a DeprecationWarning and imitates how
     Python 3 disables hashing whenever __eq__ is overridden.
     """
+    __slots__ = ()
     __hash__ = None
 
     def __ne__(self, other):
@@ -102,6 +274,23 @@ class Process(object):
         if ret != 0:
             raise SubprocessError(self.cmd, ret)
 
+    def output(self, **kw):
+        """ Runs the command like run and returns its standard output as
+        bytes. If the command exits with a return code other than 0 the
+        output is passed to the raised SubprocessError.
+        """
+        kw["stdout"] = subprocess.PIPE
+        try:
+            process = subprocess.Popen(self.cmd, **kw)
+        except OSError as e:
+            msg = "Failed starting command {!r}: {}".format(self.cmd, e)
+            raise QuiltError(msg)
+
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise SubprocessError(self.cmd, process.returncode, output)
+        return output
+
 
 class Directory(object):
     """Handle directories on filesystems """
@@ -120,7 +309,12 @@ class Directory(object):
         exist yet
         """
         if self.dirname and not os.path.exists(self.dirname):
-            os.makedirs(self.dirname)
+            try:
+                os.makedirs(self.dirname)
+            except OSError:
+                # the directory may have been created concurrently
+                if not os.path.isdir(self.dirname):
+                    raise
 
     def _content(self, startdir, dirname=None):
         files = []
@@ -247,8 +441,24 @@ class File(object):
             link = link.filename
         os.link(self.filename, link)
 
+    def move(self, dest):
+        """ Renames the file to dest. An existing file dest is replaced. """
+        if isinstance(dest, File):
+            dest = dest.filename
+        _replace(self.filename, dest)
+
+    def sync(self):
+        """ Flushes the content and the directory entry of the file to disk """
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        fsync_directory(os.path.dirname(self.filename))
+
     def copy(self, dest):
-        """ Copy file to destination """
+        """ Copy file to destination. Returns the strategy used for copying
+        see copy_file """
         if isinstance(dest, File):
             dest_dir = dest.get_directory()
             dest_dir.create()
@@ -256,7 +466,37 @@ class File(object):
         elif isinstance(dest, Directory):
             dest = dest.dirname
 
-        shutil.copy2(self.filename, dest)
+        return copy_file(self.filename, dest)
+
+    def link_or_copy(self, dest):
+        """ Creates dest as a hard link to this file. The file is copied if
+        it already has other hard links or if dest can't be linked e.g.
+        because it is on another file system.
+        Returns True if a link has been created.
+
+        Links must only be used if the file is replaced instead of being
+        changed in place afterwards.
+        """
+        if isinstance(dest, File):
+            dest_dir = dest.get_directory()
+            if dest_dir:
+                dest_dir.create()
+            dest = dest.filename
+        elif isinstance(dest, Directory):
+            dest = dest.dirname
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, self.get_basename())
+
+        if os.stat(self.filename).st_nlink == 1:
+            try:
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                os.link(self.filename, dest)
+                return True
+            except OSError:
+                pass
+        copy_file(self.filename, dest)
+        return False
 
     def is_empty(self):
         """ Returns True if the size of the file is 0 """
@@ -307,6 +547,61 @@ class File(object):
         return self.get_name()
 
 
+class BufferedWriter(object):
+    """ Coalesces small writes to the file descriptor fd
+
+    The data is collected until buffer_size bytes are pending. Larger
+    chunks are written directly. fileno flushes the buffer before returning
+    the descriptor, so it can be passed safely to a subprocess which
+    appends to the same file. bytes_written and syscalls count the bytes
+    and the write calls issued to the descriptor.
+    """
+
+    buffer_size = 1 << 16
+
+    def __init__(self, fd, buffer_size=None):
+        self.fd = fd
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.bytes_written = 0
+        self.syscalls = 0
+        self._buffer = []
+        self._pending = 0
+
+    def write(self, data):
+        if not data:
+            return
+        if self._pending + len(data) < self.buffer_size:
+            self._buffer.append(data)
+            self._pending += len(data)
+            return
+        if self._buffer:
+            self._buffer.append(data)
+            data = b"".join(self._buffer)
+            self._buffer = []
+            self._pending = 0
+        self._write(data)
+
+    def _write(self, data):
+        while data:
+            written = os.write(self.fd, data)
+            self.syscalls += 1
+            self.bytes_written += written
+            data = data[written:]
+
+    def flush(self):
+        """ Writes the pending data to the file descriptor """
+        if self._buffer:
+            data = b"".join(self._buffer)
+            self._buffer = []
+            self._pending = 0
+            self._write(data)
+
+    def fileno(self):
+        self.flush()
+        return self.fd
+
+
 class TmpFile(File):
     """ Tempoary file that is intended to be used within a context manager
     If used as a context manager in a with statement the temporary
@@ -333,6 +628,160 @@ class TmpFile(File):
         self.delete_if_exists()
 
 
+def default_file_mode():
+    """ Returns the mode of new files according to the umask """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class AtomicFile(File):
+    """ File that is replaced atomically and is intended to be used within a
+    context manager.
+    The content is written to a temporary file in the same directory which
+    is renamed to filename when the with statement finishes without an error.
+    Therefore readers see either the old or the new content but never a
+    partially written file. If sync is True the new content and the rename
+    are flushed to disk before returning. If mode is None the new file gets
+    the mode of the current file. If filename is a symbolic link the target
+    of the link is replaced.
+    """
+
+    def __init__(self, filename, sync=False, mode=None):
+        super(AtomicFile, self).__init__(filename)
+        self.sync_on_close = sync
+        self.mode = mode
+        self.file = None
+        self.tmpname = None
+        self.target = None
+
+    def _get_mode(self):
+        if self.mode is not None:
+            return self.mode
+        if self.exists():
+            return stat.S_IMODE(os.stat(self.filename).st_mode)
+        return default_file_mode()
+
+    def __enter__(self):
+        self.target = os.path.realpath(self.filename)
+        dirname, basename = os.path.split(self.target)
+        fd, self.tmpname = tempfile.mkstemp(prefix="." + basename + ".",
+                                            dir=dirname)
+        self.file = os.fdopen(fd, "wb")
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.file.flush()
+                if self.sync_on_close:
+                    os.fsync(self.file.fileno())
+            self.file.close()
+            if exc_type is None:
+                os.chmod(self.tmpname, self._get_mode())
+                _replace(self.tmpname, self.target)
+                self.tmpname = None
+                if self.sync_on_close:
+                    fsync_directory(os.path.dirname(self.target))
+        finally:
+            if self.tmpname is not None:
+                os.remove(self.tmpname)
+                self.tmpname = None
+
+
+class ComparingAtomicFile(AtomicFile):
+    """ AtomicFile which compares the new content with the current content
+    of filename while it is written. Used as a context manager it returns
+    itself instead of a file object.
+
+    The temporary file is created next to filename, so replacing filename
+    is a rename on the same file system. The new content is compared chunk
+    by chunk with the old one as it is written, therefore no additional pass
+    over the files is necessary to detect whether the content has changed.
+    filename is only replaced if the content has changed.
+    """
+
+    def __init__(self, filename, sync=False):
+        super(ComparingAtomicFile, self).__init__(filename, sync)
+        self.writer = None
+        self.size = 0
+        self._old = None
+        self._equal = False
+        self._modified = False
+
+    def __enter__(self):
+        directory = os.path.dirname(os.path.realpath(self.filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        super(ComparingAtomicFile, self).__enter__()
+        self.writer = BufferedWriter(self.file.fileno())
+        try:
+            self._old = open(self.filename, "rb")
+            self._equal = True
+        except IOError:
+            self._old = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.writer.flush()
+            if exc_type is None and not self.changed():
+                # keep the unchanged file
+                self.file.close()
+                os.remove(self.tmpname)
+                self.tmpname = None
+                return
+            self._close_old()
+        except BaseException:
+            super(ComparingAtomicFile, self).__exit__(*sys.exc_info())
+            raise
+        super(ComparingAtomicFile, self).__exit__(exc_type, exc_value,
+                                                  traceback)
+
+    def _close_old(self):
+        if self._old is not None:
+            self._old.close()
+            self._old = None
+
+    def write(self, data):
+        self.writer.write(data)
+        self.size += len(data)
+        if self._equal and (self._old is None or
+                            self._old.read(len(data)) != data):
+            self._equal = False
+
+    def flush(self):
+        self.writer.flush()
+
+    def get_name(self):
+        """ Returns the name of the temporary file """
+        return os.path.abspath(self.tmpname)
+
+    def is_empty(self):
+        if self._modified:
+            return os.path.getsize(self.tmpname) == 0
+        return self.size == 0
+
+    def modified(self):
+        """ Must be called after the temporary file has been changed by
+        someone else e.g. an editor """
+        self.writer.flush()
+        self._modified = True
+
+    def changed(self):
+        """ Returns True if the written content differs from the current
+        content of filename """
+        if self._modified:
+            self._close_old()
+            return not self.exists() or not files_equal(self.tmpname,
+                                                        self.filename)
+        if self._equal and self._old is not None and self._old.read(1):
+            self._equal = False
+        self._close_old()
+        return not self._equal
+
+
 class FunctionWrapper(object):
     """ FunctionWrapper class to encapsulate function that are decorated by
     a Param class.
@@ -10,7 +10,7 @@
 
 from contextlib import contextmanager
 import os, os.path
-from quilt.db import Series
+from quilt.db import Patch, Series
 from quilt.utils import TmpDirectory
 from six.moves import cStringIO
 import sys
@@ -40,6 +40,29 @@ def tmp_series():
         yield (dir.get_name(), Series(patches))
 
 
+# patches changing the same files, created by make_stack
+STACK_PATCHES = [
+    ("p1.patch", b"--- a/f\n+++ b/f\n@@ -1 +1 @@\n-a\n+b\n"
+                 b"--- /dev/null\n+++ b/sub/new\n@@ -0,0 +1 @@\n"
+                 b"+new\n"),
+    ("p2.patch", b"--- a/f\n+++ b/f\n@@ -1 +1 @@\n-b\n+c\n"
+                 b"--- a/g\n+++ b/g\n@@ -1 +1 @@\n-g\n+h\n"),
+    ("p3.patch", b"--- a/f\n+++ b/f\n@@ -1 +1 @@\n-c\n+d\n"
+                 b"--- a/sub/new\n+++ /dev/null\n@@ -1 +0,0 @@\n"
+                 b"-new\n"),
+]
+
+
+def make_stack(dir, series, patches=STACK_PATCHES):
+    """ Adds patches to series and creates the files f and g in dir """
+    for patch_name, content in patches:
+        make_file(content, series.dirname, patch_name)
+        series.add_patch(Patch(patch_name))
+    series.save()
+    make_file(b"a\n", dir, "f")
+    make_file(b"g\n", dir, "g")
+
+
 def run_cli(command_cls, args, patches, applied):
     with tmp_mapping(os.environ) as env, \
             tmp_mapping(vars(sys)) as tmp_sys:
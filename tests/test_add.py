@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import os, os.path
+import stat
+
+from helpers import QuiltTest, make_file, tmp_series
+
+from quilt.add import Add
+from quilt.backup import Backup
+from quilt.db import Db, Patch
+from quilt.pop import Pop
+
+
+class AddTest(QuiltTest):
+
+    def test_change_in_place(self):
+        """ The backup isn't changed with the file, even if links are enabled
+        for backups """
+        with tmp_series() as [dir, series]:
+            db = Db(os.path.join(dir, ".pc"))
+            db.add_patch(Patch("patch"))
+            db.save()
+            make_file(b"", series.dirname, "patch")
+            series.add_patch(Patch("patch"))
+            series.save()
+            make_file(b"content\n", dir, "file")
+
+            old_dir = os.getcwd()
+            old_link = Backup.link
+            try:
+                os.chdir(dir)
+                Backup.link = True
+                Add(dir, db.dirname, series.dirname).add_file("file")
+                with open("file", "ab") as f:
+                    f.write(b"more\n")
+                Pop(dir, db.dirname).unapply_top_patch()
+            finally:
+                Backup.link = old_link
+                os.chdir(old_dir)
+
+            with open(os.path.join(dir, "file"), "rb") as f:
+                self.assertEqual(f.read(), b"content\n")
+
+    def test_read_only_file(self):
+        """ A read-only file is made writable but its backup isn't """
+        with tmp_series() as [dir, series]:
+            db = Db(os.path.join(dir, ".pc"))
+            db.add_patch(Patch("patch"))
+            db.save()
+            make_file(b"content\n", dir, "file")
+            filename = os.path.join(dir, "file")
+            os.chmod(filename, 0o444)
+
+            old_dir = os.getcwd()
+            try:
+                os.chdir(dir)
+                Add(dir, db.dirname, series.dirname).add_file("file")
+            finally:
+                os.chdir(old_dir)
+
+            backup = os.path.join(db.dirname, "patch", "file")
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o644)
+            self.assertEqual(stat.S_IMODE(os.stat(backup).st_mode), 0o444)
+
+if __name__ == "__main__":
+    AddTest.run_tests()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import os, os.path
+import random
+
+from helpers import QuiltTest, make_file
+
+from quilt.apply import PatchApplier, apply_hunks
+from quilt.diff import unified_diff
+from quilt.patch import Patch, ENGINE_GNU, ENGINE_PYTHON
+from quilt.patchfile import UnsupportedPatch, parse_patch
+from quilt.utils import SubprocessError, TmpDirectory, split_lines
+
+ORIG = b"".join(("line %d\n" % i).encode("ascii") for i in range(1, 21))
+
+CHANGE = (b"--- a/file\n"
+          b"+++ b/file\n"
+          b"@@ -8,7 +8,7 @@\n"
+          b" line 8\n"
+          b" line 9\n"
+          b" line 10\n"
+          b"-line 11\n"
+          b"+changed 11\n"
+          b" line 12\n"
+          b" line 13\n"
+          b" line 14\n")
+
+
+def read_file(*path):
+    with open(os.path.join(*path), "rb") as f:
+        return f.read()
+
+
+class ApplyTest(QuiltTest):
+
+    def _apply(self, dir, patch, **kw):
+        make_file(patch, dir, "test.patch")
+        kw.setdefault("suppress_output", True)
+        return PatchApplier("test.patch", dir, **kw).apply()
+
+    def test_apply(self):
+        with TmpDirectory() as dir:
+            make_file(ORIG, dir.get_name(), "file")
+            inode = os.stat(os.path.join(dir.get_name(), "file")).st_ino
+            self.assertTrue(self._apply(dir.get_name(), CHANGE,
+                                        backup_prefix=".pc/p/"))
+            self.assertEqual(read_file(dir.get_name(), "file"),
+                             ORIG.replace(b"line 11", b"changed 11"))
+            self.assertEqual(read_file(dir.get_name(), ".pc", "p", "file"),
+                             ORIG)
+            # the backup is the original file
+            self.assertEqual(os.stat(os.path.join(dir.get_name(), ".pc", "p",
+                                                  "file")).st_ino, inode)
+
+            # reverse the patch again
+            self.assertTrue(self._apply(dir.get_name(), CHANGE,
+                                        reverse=True))
+            self.assertEqual(read_file(dir.get_name(), "file"), ORIG)
+
+    def test_offset_and_fuzz(self):
+        lines = split_lines(b"new 1\nnew 2\n" + ORIG)
+        [file_patch] = parse_patch(split_lines(CHANGE))
+        result = apply_hunks(lines, file_patch.hunks)
+        self.assertEqual(result.messages,
+                         ["Hunk #1 succeeded at 10 (offset 2 lines)."])
+        self.assertTrue(result.mismatch)
+        self.assertFalse(result.failed)
+
+        lines = split_lines(ORIG.replace(b"line 8\n", b"other 8\n"))
+        result = apply_hunks(lines, file_patch.hunks)
+        self.assertEqual(result.messages,
+                         ["Hunk #1 succeeded at 8 with fuzz 1."])
+        self.assertEqual(result.lines[10], b"changed 11\n")
+
+        lines = split_lines(ORIG.replace(b"line 11\n", b"other 11\n"))
+        result = apply_hunks(lines, file_patch.hunks)
+        self.assertEqual(result.messages, ["Hunk #1 FAILED at 8."])
+        self.assertEqual(result.lines, lines)
+
+        # the side with more context is fuzzed first
+        [file_patch] = parse_patch(split_lines(
+            b"--- a/file\n+++ b/file\n@@ -1,4 +1,5 @@\n"
+            b" A\n+NEW\n A\n A\n B\n"))
+        result = apply_hunks(split_lines(b"A\nA\nZ\nB\n"), file_patch.hunks)
+        self.assertEqual(result.lines, split_lines(b"A\nNEW\nA\nZ\nB\n"))
+        self.assertEqual(result.messages,
+                         ["Hunk #1 succeeded at 1 with fuzz 2."])
+
+    def test_new_and_deleted_file(self):
+        with TmpDirectory() as dir:
+            patch = (b"--- /dev/null\n"
+                     b"+++ b/sub/new\n"
+                     b"@@ -0,0 +1 @@\n"
+                     b"+new\n")
+            self.assertTrue(self._apply(dir.get_name(), patch,
+                                        backup_prefix="backup/"))
+            self.assertEqual(read_file(dir.get_name(), "sub", "new"),
+                             b"new\n")
+            self.assertEqual(read_file(dir.get_name(), "backup", "sub",
+                                       "new"), b"")
+
+            self.assertTrue(self._apply(dir.get_name(), patch, reverse=True))
+            self.assertFalse(os.path.exists(os.path.join(dir.get_name(),
+                                                         "sub")))
+
+    def test_reject(self):
+        with TmpDirectory() as dir:
+            make_file(b"other\n", dir.get_name(), "file")
+            self.assertFalse(self._apply(dir.get_name(), CHANGE))
+            self.assertEqual(read_file(dir.get_name(), "file"), b"other\n")
+            rej = read_file(dir.get_name(), "file.rej")
+            self.assertEqual(rej, b"--- file\n+++ file\n" +
+                             CHANGE.split(b"\n", 2)[2])
+
+    def test_unsupported(self):
+        with TmpDirectory() as dir:
+            make_file(ORIG, dir.get_name(), "file")
+            patch = (b"diff --git a/file b/file\n"
+                     b"old mode 100644\n"
+                     b"new mode 100755\n")
+            self.assertRaises(UnsupportedPatch, self._apply, dir.get_name(),
+                              patch)
+            self.assertRaises(UnsupportedPatch, self._apply, dir.get_name(),
+                              CHANGE, strip=3)
+            self.assertEqual(read_file(dir.get_name(), "file"), ORIG)
+
+    def _run_engines(self, orig, patch, **kw):
+        """ Returns the results of applying patch to orig with GNU patch and
+        the python engine """
+        results = []
+        for engine in (ENGINE_GNU, ENGINE_PYTHON):
+            with TmpDirectory() as dir:
+                make_file(orig, dir.get_name(), "file")
+                make_file(patch, dir.get_name(), "test.patch")
+                try:
+                    Patch("test.patch").run(dir.get_name(), engine=engine,
+                                            suppress_output=True, **kw)
+                    success = True
+                except SubprocessError:
+                    success = False
+                files = sorted(os.listdir(dir.get_name()))
+                results.append((success, files,
+                                read_file(dir.get_name(), "file")))
+        return results
+
+    def test_engines_random(self):
+        """ Compare random patches applied with offsets and fuzz """
+        rnd = random.Random(4711)
+        alphabet = [b"a\n", b"b\n", b"c\n", b"\n", b"}\n", b"    return\n"]
+
+        def edit(lines, count, choices):
+            lines = list(lines)
+            for j in range(rnd.randint(0, count)):
+                pos = rnd.randint(0, len(lines))
+                if rnd.random() < 0.5:
+                    lines[pos:pos] = [rnd.choice(choices)
+                                      for k in range(rnd.randint(1, 3))]
+                else:
+                    del lines[pos:pos + rnd.randint(1, 3)]
+            return lines
+
+        for i in range(300):
+            a = [rnd.choice(alphabet) for j in range(rnd.randint(0, 40))]
+            b = edit(a, 4, alphabet + [b"new\n"])
+            patch = unified_diff(b"".join(a), b"".join(b), b"a/file",
+                                 b"b/file", context=rnd.randint(1, 3))
+            if not patch:
+                continue
+            orig = b"".join(edit(a, 3, alphabet + [b"other\n"]))
+            results = self._run_engines(orig, patch, force=True)
+            self.assertEqual(results[0], results[1])
+
+    def test_engines(self):
+        """ Compare the results of the python engine with GNU patch """
+        cases = [
+            (ORIG, CHANGE),
+            (b"new 1\n" + ORIG, CHANGE),
+            (ORIG.replace(b"line 13\n", b"other 13\n"), CHANGE),
+            (b"other\n", CHANGE),
+            (b"a\nb\n", b"--- a/file\n+++ b/file\n@@ -1,2 +1,2 @@\n"
+                        b" a\n-b\n+c\n\\ No newline at end of file\n"),
+        ]
+        for orig, patch in cases:
+            results = self._run_engines(orig, patch, backup=True,
+                                        prefix="pc")
+            self.assertEqual(results[0], results[1])
+
+if __name__ == "__main__":
+    ApplyTest.run_tests()
@@ -16,8 +16,10 @@ from helpers import QuiltTest, make_file, tmp_mapping, tmp_series
 test_dir = os.path.dirname(__file__)
 sys.path.append(os.path.join(test_dir, os.pardir))
 
+from quilt.cache import SeriesCache
 from quilt.db import Db, DBError, DB_VERSION, PatchSeries
 from quilt.db import Patch
+from quilt.error import QuiltError, UnknownPatch
 from quilt.utils import TmpDirectory
 
 
@@ -104,6 +106,8 @@ class DbTest(QuiltTest):
             with tmp_mapping(vars(sys)) as tmp_sys:
                 tmp_sys.set("stderr", cStringIO())
                 series.read()
+                # patch options are parsed on first access
+                self.assertEqual(series.top_patch().strip, 1)
                 self.assertIn("-X", sys.stderr.getvalue())
 
     def test_add_remove(self):
@@ -196,6 +200,99 @@ class DbTest(QuiltTest):
         patchline = db.patch2line[patch5]
         self.assertEqual(patchline.get_comment(), " my comment")
     
+    def test_index_after_mutations(self):
+        db = PatchSeries(os.path.join(test_dir, "data", "db"), "series_test1")
+        firstpatch = Patch("firstpatch")
+        secondpatch = Patch("secondpatch")
+        thirdpatch = Patch("thirdpatch")
+        lastpatch = Patch("lastpatch")
+        newpatch = Patch("newpatch")
+
+        self.assertEqual(lastpatch, db.top_patch())
+        db.remove_patch(secondpatch)
+        self.assertEqual(thirdpatch, db.patch_after(firstpatch))
+        self.assertEqual(firstpatch, db.patch_before(thirdpatch))
+
+        db.add_patches([newpatch], firstpatch)
+        self.assertEqual(newpatch, db.patch_after(firstpatch))
+        self.assertEqual(patch_list(["firstpatch", "newpatch"]),
+                         db.patches_until(newpatch))
+
+        db.replace(newpatch, secondpatch)
+        self.assertFalse(db.is_patch(newpatch))
+        self.assertEqual(secondpatch, db.patch_before(thirdpatch))
+
+        db.add_patch(newpatch)
+        self.assertEqual(newpatch, db.top_patch())
+        self.assertEqual(newpatch, db.patch_after(lastpatch))
+        db.remove_patch(newpatch)
+        self.assertEqual(lastpatch, db.top_patch())
+        self.assertEqual([], db.patches_after(lastpatch))
+
+        # the comment lines are kept in place
+        self.assertEqual("# this is a comment", str(db.patchlines[0]))
+        index = db.patchlines.index(db.patch2line[thirdpatch])
+        self.assertEqual("     # comment with whitespace",
+                         str(db.patchlines[index - 1]))
+
+    def test_edit(self):
+        db = PatchSeries(os.path.join(test_dir, "data", "db"), "series_test1")
+        with db.edit() as edit:
+            edit.remove([Patch("firstpatch"), Patch("patchwith.diff")])
+            edit.insert([Patch("new1"), Patch("new2")],
+                        after=Patch("thirdpatch"))
+            edit.insert([Patch("front")])
+            edit.move(Patch("patchwith"), Patch("lastpatch"),
+                      after=Patch("secondpatch"))
+            edit.replace(Patch("secondpatch"), Patch("second.patch"))
+
+        self.assertEqual(patch_list(["front", "second.patch", "patchwith",
+                                     "lastpatch", "thirdpatch", "new1",
+                                     "new2", "patchwith.patch"]),
+                         db.patches())
+        self.assertFalse(db.is_patch(Patch("firstpatch")))
+        self.assertEqual(Patch("patchwith.patch"), db.top_patch())
+        self.assertEqual(Patch("thirdpatch"),
+                         db.patch_after(Patch("lastpatch")))
+        self.assertTrue(db.patches_until(Patch("patchwith"))[-1].reverse)
+
+        lines = [str(line) for line in db.patchlines]
+        self.assertEqual(["front", "# this is a comment",
+                          "second.patch # with comment", "patchwith -R -p1",
+                          "lastpatch", "",
+                          "     # comment with whitespace",
+                          "     thirdpatch   ", "new1", "new2",
+                          "patchwith.patch"], lines)
+
+    def test_edit_move_errors(self):
+        db = PatchSeries(os.path.join(test_dir, "data", "db"), "series_test1")
+        edit = db.edit()
+        self.assertRaises(QuiltError, edit.move, Patch("thirdpatch"),
+                          Patch("firstpatch"))
+        self.assertRaises(QuiltError, edit.move, Patch("firstpatch"),
+                          Patch("thirdpatch"), Patch("secondpatch"))
+        self.assertRaises(UnknownPatch, edit.remove, [Patch("notapatch")])
+
+    def test_read_top_patch(self):
+        with TmpDirectory() as dir:
+            self.assertEqual(None, Db.read_top_patch(dir.get_name()))
+
+            lines = [("patch%d -p0" % i).encode("ascii") for i in range(2000)]
+            make_file(b"\n".join(lines) + b"\n# comment\n\n",
+                      dir.get_name(), "applied-patches")
+            top = Db.read_top_patch(dir.get_name())
+            self.assertEqual(Patch("patch1999"), top)
+            self.assertEqual(top.strip, "0")
+            self.assertEqual(Db(dir.get_name()).top_patch(), top)
+
+            make_file(b"single", dir.get_name(), "applied-patches")
+            self.assertEqual(Patch("single"),
+                             Db.read_top_patch(dir.get_name()))
+
+            make_file(b"# only a comment\n", dir.get_name(),
+                      "applied-patches")
+            self.assertEqual(None, Db.read_top_patch(dir.get_name()))
+
     def test_save(self):
         with tmp_series() as [dir, series]:
             series.add_patch(Patch("test.patch"))
@@ -204,5 +301,129 @@ class DbTest(QuiltTest):
                 self.assertEqual(file.read(), b"test.patch\n")
 
 
+    def test_db_save_incremental(self):
+        with TmpDirectory() as dir:
+            make_file(b"2\n", dir.get_name(), ".version")
+            db = Db(dir.get_name())
+            db.add_patch(Patch("p1.patch"))
+            db.add_patch(Patch("p2.patch"))
+            db.save()
+
+            applied = os.path.join(dir.get_name(), "applied-patches")
+            with open(applied, "rb") as f:
+                self.assertEqual(f.read(), b"p1.patch\np2.patch\n")
+
+            db = Db(dir.get_name())
+            db.add_patch(Patch("p3.patch"))
+            db.save()
+            with open(applied, "rb") as f:
+                self.assertEqual(f.read(),
+                                 b"p1.patch\np2.patch\np3.patch\n")
+
+            db.remove_patch(Patch("p3.patch"))
+            db.remove_patch(Patch("p2.patch"))
+            db.save()
+            with open(applied, "rb") as f:
+                self.assertEqual(f.read(), b"p1.patch\n")
+
+            # an existing .version file is not rewritten
+            with open(os.path.join(dir.get_name(), ".version"), "rb") as f:
+                self.assertEqual(f.read(), b"2\n")
+
+    def test_db_save_unterminated(self):
+        with TmpDirectory() as dir:
+            make_file(b"p1.patch", dir.get_name(), "applied-patches")
+            db = Db(dir.get_name())
+            db.add_patch(Patch("p2.patch"))
+            db.save()
+            applied = os.path.join(dir.get_name(), "applied-patches")
+            with open(applied, "rb") as f:
+                self.assertEqual(f.read(), b"p1.patch\np2.patch\n")
+
+    def test_file_patches(self):
+        with TmpDirectory() as dir:
+            db = Db(dir.get_name())
+            for name in ("p1", "p2", "p3"):
+                db.add_patch(Patch(name))
+            os.makedirs(os.path.join(dir.get_name(), "p1", "sub"))
+            os.makedirs(os.path.join(dir.get_name(), "p3", "sub"))
+            make_file(b"", dir.get_name(), "p1", "sub", "a")
+            make_file(b"", dir.get_name(), "p1", "b")
+            make_file(b"", dir.get_name(), "p3", "sub", "a")
+            index = db.file_patches(db.patches())
+            self.assertEqual(index, {
+                os.path.join("sub", "a"): [Patch("p1"), Patch("p3")],
+                "b": [Patch("p1")],
+            })
+            self.assertEqual(db.file_patches(db.patches_after(Patch("p1"))),
+                             {os.path.join("sub", "a"): [Patch("p3")]})
+
+    def test_file_in_next_patches(self):
+        with TmpDirectory() as dir:
+            db = Db(dir.get_name())
+            for name in ("p1", "p2", "p3", "p4"):
+                db.add_patch(Patch(name))
+            for name in ("p2", "p3", "p4"):
+                os.makedirs(os.path.join(dir.get_name(), name, "sub"))
+            make_file(b"", dir.get_name(), "p3", "sub", "a")
+            make_file(b"", dir.get_name(), "p4", "sub", "a")
+            make_file(b"", dir.get_name(), "p2", "b")
+
+            # a few files are checked directly
+            self.assertEqual(db.next_patches_index(Patch("p1")), None)
+            self.assertEqual(db.next_patches_index(Patch("p1"), 100), None)
+            index = db.next_patches_index(Patch("p1"), db.index_min_checks)
+            self.assertEqual(index, {
+                os.path.join("sub", "a"): [Patch("p3"), Patch("p4")],
+                "b": [Patch("p2")],
+            })
+            self.assertEqual(db.next_patches_index(Patch("p5"), 1000), None)
+
+            for index in (None, index):
+                self.assertEqual(db.file_in_next_patches(
+                    os.path.join("sub", "a"), Patch("p1"), index), Patch("p3"))
+                self.assertEqual(db.file_in_next_patches(
+                    os.path.join(".", "sub", "a"), Patch("p1"), index),
+                    Patch("p3"))
+                self.assertEqual(db.file_in_next_patches(
+                    "b", Patch("p1"), index), Patch("p2"))
+                self.assertEqual(db.file_in_next_patches(
+                    "c", Patch("p1"), index), None)
+            self.assertEqual(db.file_in_next_patches("b", Patch("p2")), None)
+            self.assertEqual(db.file_in_next_patches("b", Patch("p5")), None)
+
+
+    def test_cache(self):
+        with tmp_series() as [dir, series]:
+            make_file(b"# comment\n"
+                      b"patch1 -p0 -R # with comment\n"
+                      b"patch2\n", series.series_file)
+            os.utime(series.series_file, (0, 0))
+            cache = SeriesCache(dir)
+            PatchSeries.cache = cache
+            try:
+                series.read()
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+                series.read()
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                [patch1, patch2] = series.patches()
+                self.assertEqual(patch1, Patch("patch1"))
+                self.assertEqual(patch1.strip, "0")
+                self.assertIs(patch1.reverse, True)
+                self.assertEqual(patch2.strip, 1)
+                self.assertEqual(series.patch2line[patch1].get_comment(),
+                                 " with comment")
+                self.assertEqual(str(series.patchlines[0]), "# comment")
+
+                series.add_patch(Patch("patch3"))
+                series.save()
+                series.read()
+                self.assertEqual((cache.hits, cache.misses), (1, 2))
+                self.assertEqual(Patch("patch3"), series.top_patch())
+            finally:
+                PatchSeries.cache = None
+
+
 if __name__ == "__main__":
     DbTest.run_tests()
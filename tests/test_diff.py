@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import os, os.path
+import random
+
+from helpers import QuiltTest, make_file
+
+from quilt.diff import unified_diff
+from quilt.patch import Diff, ENGINE_GNU, ENGINE_PYTHON
+from quilt.utils import TmpDirectory, TmpFile
+
+
+def gnu_diff(dir, a, b):
+    """ Returns the output of GNU diff -u for the contents a and b """
+    make_file(a, dir, "a")
+    make_file(b, dir, "b")
+    with TmpFile(dir=dir) as out:
+        Diff(os.path.join(dir, "a"), os.path.join(dir, "b")).run(
+            dir, left_label="old/file", right_label="new/file",
+            fd=out.open(), engine=ENGINE_GNU)
+        with open(out.get_name(), "rb") as f:
+            return f.read()
+
+
+def lines(*lines):
+    return b"".join(line.encode("ascii") + b"\n" for line in lines)
+
+
+class DiffTest(QuiltTest):
+
+    cases = [
+        (b"", b""),
+        (b"", lines("a")),
+        (lines("a"), b""),
+        (lines("a", "b", "c"), lines("a", "b", "c")),
+        (lines("a", "b", "c"), lines("a", "B", "c")),
+        (b"a\nb", b"a\nb\n"),
+        (b"a\nb\n", b"a\nc"),
+        (lines(*"abcdefghijklmnop"), lines(*"abXdefghijklmYop")),
+        (lines(*"abcdefghijklmnop"), lines(*"abXdefghiZjklmYop")),
+        (lines("{", "a", "}", "{", "b", "}"),
+         lines("{", "a", "}", "{", "c", "}", "{", "b", "}")),
+        (lines("x", "", "", "y", "", "z"), lines("x", "", "y", "", "", "z")),
+    ]
+
+    def assert_compatible(self, dir, a, b):
+        self.assertEqual(unified_diff(a, b, b"old/file", b"new/file"),
+                         gnu_diff(dir, a, b))
+
+    def test_compatibility(self):
+        with TmpDirectory() as dir:
+            for a, b in self.cases:
+                self.assert_compatible(dir.get_name(), a, b)
+
+    def test_compatibility_random(self):
+        """ Compare random edits of files with repeated lines """
+        rnd = random.Random(4711)
+        alphabet = lines("a", "b", "c", "", "}", "    return")
+        alphabet = alphabet.splitlines(True)
+        with TmpDirectory() as dir:
+            for i in range(150):
+                a = [rnd.choice(alphabet) for j in range(rnd.randint(0, 80))]
+                b = list(a)
+                for j in range(rnd.randint(0, 6)):
+                    pos = rnd.randint(0, len(b))
+                    if rnd.random() < 0.5:
+                        b[pos:pos] = rnd.sample(alphabet, rnd.randint(1, 3))
+                    else:
+                        del b[pos:pos + rnd.randint(1, 4)]
+                a = b"".join(a)
+                b = b"".join(b)
+                if rnd.random() < 0.2:
+                    b = b.rstrip(b"\n")
+                self.assert_compatible(dir.get_name(), a, b)
+
+    def test_run(self):
+        with TmpDirectory() as dir:
+            make_file(lines("a", "b"), dir.get_name(), "a")
+            make_file(lines("a", "c"), dir.get_name(), "b")
+            with TmpFile(dir=dir.get_name()) as out:
+                out.write(b"Index: b\n")
+                diff = Diff(os.path.join(dir.get_name(), "a"),
+                            os.path.join(dir.get_name(), "missing"))
+                diff.run(dir.get_name(), fd=out.open(), left_label="a",
+                         right_label="b", engine=ENGINE_PYTHON)
+                with open(out.get_name(), "rb") as f:
+                    self.assertEqual(f.read(), b"Index: b\n--- a\n+++ b\n"
+                                     b"@@ -1,2 +0,0 @@\n-a\n-b\n")
+
+    def test_equal(self):
+        with TmpDirectory() as dir:
+            make_file(b"a\n", dir.get_name(), "a")
+            make_file(b"a\n", dir.get_name(), "b")
+            make_file(b"", dir.get_name(), "empty")
+            a = os.path.join(dir.get_name(), "a")
+            self.assertTrue(Diff(a, os.path.join(dir.get_name(),
+                                                 "b")).equal(dir.get_name()))
+            self.assertFalse(Diff(a, os.path.join(dir.get_name(),
+                                                  "c")).equal(dir.get_name()))
+            # missing files are compared like /dev/null
+            self.assertTrue(Diff(os.path.join(dir.get_name(), "empty"),
+                                 os.path.join(dir.get_name(), "missing")
+                                 ).equal(dir.get_name()))
+
+    def test_binary(self):
+        """ Binary files are compared by GNU diff """
+        with TmpDirectory() as dir:
+            make_file(b"\0\1\2", dir.get_name(), "a")
+            make_file(b"\0\1\3", dir.get_name(), "b")
+            with TmpFile(dir=dir.get_name()) as out:
+                diff = Diff(os.path.join(dir.get_name(), "a"),
+                            os.path.join(dir.get_name(), "b"))
+                diff.run(dir.get_name(), fd=out.open(), left_label="a",
+                         right_label="b", engine=ENGINE_PYTHON)
+                with open(out.get_name(), "rb") as f:
+                    self.assertEqual(f.read(),
+                                     b"Binary files a and b differ\n")
+
+
+if __name__ == "__main__":
+    DiffTest.run_tests()
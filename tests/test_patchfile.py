@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import io
+import os, os.path
+import time
+
+from helpers import QuiltTest, make_file
+
+from quilt.cache import SeriesCache
+from quilt.patch import Patch
+from quilt.patchfile import PatchIndex
+from quilt.refresh import INDEX_LINE
+from quilt.utils import TmpDirectory
+
+HEADER = b"Description of the patch\n\n"
+
+SECTION1 = (b"Index: dir/f1\n" +
+            INDEX_LINE + b"\n"
+            b"--- dir.orig/f1\n"
+            b"+++ dir/f1\n"
+            b"@@ -1,2 +1,2 @@\n"
+            b" a\n"
+            b"--- b\n"
+            b"+++ b\n"
+            b"@@ -10 +10,0 @@\n"
+            b"-c\n")
+
+SECTION2 = (b"Index: dir/new\n" +
+            INDEX_LINE + b"\n"
+            b"--- /dev/null\n"
+            b"+++ dir/new\n"
+            b"@@ -0,0 +1 @@\n"
+            b"+new\n"
+            b"\\ No newline at end of file\n")
+
+SECTION3 = (b"diff --git a/old b/renamed\n"
+            b"similarity index 100%\n"
+            b"rename from old\n"
+            b"rename to renamed\n")
+
+SECTION4 = (b"diff --git a/gone b/gone\n"
+            b"deleted file mode 100644\n"
+            b"--- a/gone\n"
+            b"+++ /dev/null\n"
+            b"@@ -1 +0,0 @@\n"
+            b"-gone\n")
+
+PATCH = HEADER + SECTION1 + SECTION2 + SECTION3 + SECTION4
+
+
+class PatchIndexTest(QuiltTest):
+
+    def test_parse(self):
+        index = PatchIndex.parse(io.BytesIO(PATCH))
+        self.assertEqual(index.size, len(PATCH))
+        self.assertEqual(index.header_end, len(HEADER))
+        self.assertEqual(index.files(), ["f1", "new", "renamed", "gone"])
+        self.assertEqual(index.files(0),
+                         ["dir/f1", "dir/new", "b/renamed", "a/gone"])
+
+        [f1, new, renamed, gone] = index.sections
+        offset = len(HEADER)
+        for section, text in zip(index.sections, (SECTION1, SECTION2,
+                                                  SECTION3, SECTION4)):
+            self.assertEqual(section.start, offset)
+            offset += len(text)
+            self.assertEqual(section.end, offset)
+            self.assertEqual(index.read_section(io.BytesIO(PATCH), section),
+                             text)
+
+        # the changed lines "--- b" and "+++ b" are part of the first hunk
+        self.assertEqual([hunk[:4] for hunk in f1.hunks],
+                         [(1, 2, 1, 2), (10, 1, 10, 0)])
+        self.assertEqual(PATCH[f1.hunks[1][4]:].split(b"\n")[0],
+                         b"@@ -10 +10,0 @@")
+
+        # leave out a signature after the last hunk
+        signed = PATCH + b"-- \n2.11.0\n"
+        signed_index = PatchIndex.parse(io.BytesIO(signed))
+        self.assertEqual(signed_index.read_section(
+            io.BytesIO(signed), signed_index.sections[-1], trim=True),
+            SECTION4)
+        self.assertEqual(signed_index.read_section(
+            io.BytesIO(signed), signed_index.sections[1], trim=True),
+            SECTION2)
+        self.assertEqual(f1.index_name, b"dir/f1")
+
+        self.assertTrue(new.is_new())
+        self.assertFalse(new.is_deleted())
+        self.assertTrue(renamed.is_rename())
+        self.assertEqual(renamed.old_name, b"a/old")
+        self.assertEqual(renamed.hunks, [])
+        self.assertTrue(gone.is_deleted())
+        self.assertEqual(gone.target(), "gone")
+
+    def test_unnamed_sections(self):
+        """ Sections without names are skipped """
+        patch = (SECTION1 +
+                 b"diff -ruN a/bin b/bin\n"
+                 b"Binary files a/bin and b/bin differ\n"
+                 b"diff --git a/with space b/with space\n"
+                 b"Binary files a/with space and b/with space differ\n" +
+                 SECTION2)
+        index = PatchIndex.parse(io.BytesIO(patch))
+        self.assertEqual(len(index.sections), 4)
+        self.assertEqual([section.target() for section in index.sections],
+                         ["f1", None, None, "new"])
+        self.assertEqual(index.files(), ["f1", "new"])
+        self.assertEqual(index.find("new"), index.sections[3])
+        self.assertEqual(index.find("bin"), None)
+
+    def test_cache(self):
+        with TmpDirectory() as dir:
+            make_file(PATCH, dir.get_name(), "patch")
+            name = os.path.join(dir.get_name(), "patch")
+            # avoid racy timestamps
+            mtime = time.time() - 10
+            os.utime(name, (mtime, mtime))
+
+            index = Patch("patch").get_index(dir.get_name())
+            self.assertIs(Patch("patch").get_index(dir.get_name()), index)
+            self.assertEqual(Patch("patch").get_files(dir.get_name()),
+                             ["f1", "new", "renamed", "gone"])
+
+            make_file(HEADER + SECTION2, dir.get_name(), "patch")
+            os.utime(name, (mtime, mtime))
+            self.assertEqual(Patch("patch").get_files(dir.get_name()),
+                             ["new"])
+
+            try:
+                PatchIndex.cache = SeriesCache(dir.get_name())
+                PatchIndex._memory.clear()
+                self.assertEqual(PatchIndex.load(name).files(), ["new"])
+                PatchIndex._memory.clear()
+                self.assertEqual(PatchIndex.load(name).files(), ["new"])
+                self.assertEqual(PatchIndex.cache.hits, 1)
+            finally:
+                PatchIndex.cache = None
+
+    def test_memory_size(self):
+        with TmpDirectory() as dir:
+            mtime = time.time() - 10
+            names = []
+            for name in ("p1", "p2", "p3"):
+                make_file(PATCH, dir.get_name(), name)
+                names.append(os.path.join(dir.get_name(), name))
+                os.utime(names[-1], (mtime, mtime))
+
+            old_size = PatchIndex.memory_size
+            PatchIndex.memory_size = 2
+            PatchIndex._memory.clear()
+            try:
+                first = PatchIndex.load(names[0])
+                PatchIndex.load(names[1])
+                # p1 is used again, so p2 is dropped for p3
+                self.assertIs(PatchIndex.load(names[0]), first)
+                PatchIndex.load(names[2])
+                self.assertEqual(list(PatchIndex._memory),
+                                 [names[0], names[2]])
+            finally:
+                PatchIndex.memory_size = old_size
+                PatchIndex._memory.clear()
+
+
+if __name__ == "__main__":
+    PatchIndexTest.run_tests()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import threading
+import time
+
+from helpers import QuiltTest
+
+from quilt.pool import FilePool
+
+
+class FilePoolTest(QuiltTest):
+
+    def test_map(self):
+        def func(item):
+            # finish the items out of order
+            time.sleep((10 - item) * 0.001)
+            return item * 2
+
+        for workers in (1, 4):
+            done = []
+            results = FilePool(workers).map(
+                func, range(10), lambda item, result: done.append(
+                    (item, result, threading.current_thread())))
+            self.assertEqual(results, [i * 2 for i in range(10)])
+            self.assertEqual(done, [(i, i * 2, threading.current_thread())
+                                    for i in range(10)])
+
+    def test_error(self):
+        def func(item):
+            if item in (3, 5):
+                time.sleep((5 - item) * 0.01)
+                raise ValueError(item)
+            return item
+
+        for workers in (1, 3, 8):
+            done = []
+            try:
+                FilePool(workers).map(func, range(100),
+                                      lambda item, result: done.append(item))
+            except ValueError as e:
+                self.assertEqual(e.args, (3,))
+            else:
+                self.fail("ValueError not raised")
+            self.assertEqual(done, [0, 1, 2])
+
+
+if __name__ == "__main__":
+    FilePoolTest.run_tests()
@@ -9,13 +9,15 @@
 
 import os.path
 import six
+import stat
 
-from helpers import QuiltTest, make_file
+from helpers import QuiltTest, make_file, make_stack, tmp_series
 
 from quilt.db import Db
 from quilt.error import QuiltError
-from quilt.patch import Patch
+from quilt.patch import Patch, RollbackPatch
 from quilt.pop import Pop
+from quilt.push import Push
 from quilt.utils import Directory, TmpDirectory, File
 
 test_dir = os.path.dirname(__file__)
@@ -94,6 +96,73 @@ class PopTest(QuiltTest):
                     r"needs to be refreshed"):
                 cmd.unapply_top_patch()
 
+    def test_unapply_all_collapsed(self):
+        with tmp_series() as [dir, series]:
+            def name(*path):
+                return os.path.join(dir, *path)
+
+            make_stack(dir, series)
+            os.chmod(name("f"), 0o755)
+
+            pc_dir = name(".pc")
+            cwd = os.getcwd()
+            os.chdir(dir)
+            try:
+                Push(dir, pc_dir, series.dirname).apply_all(
+                    quiet=True)
+                with open(name("f"), "rb") as f:
+                    self.assertEqual(f.read(), b"d\n")
+
+                pop = Pop(dir, pc_dir)
+                unapplied = []
+
+                def unapplied_patch(patch):
+                    unapplied.append(patch)
+                pop.unapplied_patch.connect(unapplied_patch)
+                try:
+                    pop.unapply_all(collapse=True)
+                finally:
+                    pop.unapplied_patch.disconnect(unapplied_patch)
+            finally:
+                os.chdir(cwd)
+
+            self.assertEqual(unapplied, [Patch("p3.patch"), Patch("p2.patch"),
+                                         Patch("p1.patch")])
+            self.assertEqual(None, pop.db.top_patch())
+            self.assertEqual(os.path.getsize(name(".pc", "applied-patches")),
+                             0)
+            with open(name("f"), "rb") as f:
+                self.assertEqual(f.read(), b"a\n")
+            self.assertEqual(stat.S_IMODE(os.stat(name("f")).st_mode), 0o755)
+            with open(name("g"), "rb") as f:
+                self.assertEqual(f.read(), b"g\n")
+            self.assertFalse(os.path.exists(name("sub", "new")))
+            self.assertEqual(sorted(os.listdir(pc_dir)),
+                             [".version", "applied-patches"])
+
+    def test_rollback_move(self):
+        with TmpDirectory() as dir:
+            def name(*path):
+                return os.path.join(dir.get_name(), *path)
+
+            os.makedirs(name("pc", "sub"))
+            make_file(b"orig\n", name("pc", "sub", "file"))
+            make_file(b"", name("pc", "new"))
+            os.mkdir(name("sub"))
+            make_file(b"patched\n", name("sub", "file"))
+            make_file(b"new\n", name("new"))
+            inode = os.stat(name("pc", "sub", "file")).st_ino
+
+            rollback = RollbackPatch(dir.get_name(), name("pc"))
+            rollback.rollback(move=True)
+            with open(name("sub", "file"), "rb") as f:
+                self.assertEqual(f.read(), b"orig\n")
+            self.assertEqual(os.stat(name("sub", "file")).st_ino, inode)
+            self.assertFalse(os.path.exists(name("new")))
+            self.assertFalse(os.path.exists(name("pc", "sub", "file")))
+            rollback.delete_backup()
+            self.assertFalse(os.path.exists(name("pc")))
+
 
 if __name__ == "__main__":
     PopTest.run_tests()
@@ -10,8 +10,10 @@
 from contextlib import contextmanager
 import os, os.path
 import six
+import stat
 
-from helpers import QuiltTest, make_file, tmp_series
+from helpers import QuiltTest, STACK_PATCHES, make_file, make_stack, \
+                    tmp_series
 
 from quilt.db import Db
 from quilt.error import QuiltError, AllPatchesApplied
@@ -123,7 +125,54 @@ class PushTest(QuiltTest):
                     r"needs to be refreshed"):
                 cmd.apply_next_patch()
     
+    def test_apply_all_collapsed(self):
+        patches = STACK_PATCHES + [
+            # not supported by the stack, applied by GNU patch
+            ("p4.patch", b"diff --git a/g b/g\nold mode 100644\n"
+                         b"new mode 100755\n"),
+            ("p5.patch", b"--- a/g\n+++ b/g\n@@ -1 +1 @@\n-h\n+i\n"),
+        ]
+        trees = []
+        for collapse in (False, True):
+            with tmp_series() as [dir, series]:
+                make_stack(dir, series, patches)
+                os.chmod(os.path.join(dir, "f"), 0o755)
+
+                cwd = os.getcwd()
+                os.chdir(dir)
+                try:
+                    cmd = Push(dir, os.path.join(dir, ".pc"), series.dirname)
+                    cmd.apply_all(quiet=True, collapse=collapse)
+                finally:
+                    os.chdir(cwd)
+
+                tree = dict()
+                for dirpath, dirnames, filenames in os.walk(dir):
+                    for filename in filenames:
+                        if filename == ".timestamp":
+                            # only kept if the engine reports exact hunks
+                            continue
+                        path = os.path.join(dirpath, filename)
+                        mode = stat.S_IMODE(os.stat(path).st_mode)
+                        with open(path, "rb") as f:
+                            tree[os.path.relpath(path, dir)] = (f.read(),
+                                                                mode)
+                trees.append(tree)
+
+        self.assertEqual(trees[0], trees[1])
+        self.assertEqual(trees[1]["f"], (b"d\n", 0o755))
+        self.assertEqual(trees[1]["g"][0], b"i\n")
+        self.assertEqual(trees[1][os.path.join(".pc", "p2.patch", "f")],
+                         (b"b\n", 0o755))
+        self.assertEqual(trees[1][os.path.join(".pc", "p3.patch", "sub",
+                                               "new")][0], b"new\n")
+        self.assertFalse(os.path.join("sub", "new") in trees[1])
+
     def test_fail_after_success(self):
+        for collapse in (False, True):
+            self._test_fail_after_success(collapse)
+
+    def _test_fail_after_success(self, collapse):
         """ Test where the first patch applies but a later patch fails """
         with tmp_series() as [dir, series]:
             make_file(
@@ -139,7 +188,7 @@ class PushTest(QuiltTest):
             with six.assertRaisesRegex(self, QuiltError,
                         r"conflict\.patch does not apply"), \
                     self._suppress_output():
-                cmd.apply_all()
+                cmd.apply_all(collapse=collapse)
             [applied] = Db(dir).patches()
             self.assertEqual(applied.get_name(), "good.patch")
             with open(os.path.join(dir, "new-file"), "rb") as file:
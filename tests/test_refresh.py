@@ -5,13 +5,20 @@
 # See LICENSE comming with the source of python-quilt for details.
 
 import os
+import six
+import sys
+import time
 
-from helpers import make_file
+from helpers import make_file, tmp_mapping, tmp_series
+from six.moves import cStringIO
 from unittest import TestCase
 
 import quilt.refresh
 
 from quilt.db import Db, Patch
+from quilt.error import QuiltError
+from quilt.patch import Diff, ENGINE_GNU, ENGINE_PYTHON
+from quilt.push import Push
 from quilt.utils import TmpDirectory
 
 
@@ -35,5 +42,156 @@ class Test(TestCase):
                 cmd.refresh()
                 with open("patch", "r") as patch:
                     self.assertTrue(patch.read(30))
+
+                inode = os.stat("patch").st_ino
+                with self.assertRaises(QuiltError):
+                    cmd.refresh()
+                self.assertEqual(os.stat("patch").st_ino, inode)
+                self.assertEqual(sorted(os.listdir(".")),
+                                 [".pc", "file", "patch"])
             finally:
                 os.chdir(old_dir)
+
+    def test_batch_diff(self):
+        """ The single recursive diff and the parallel diffs must create the
+        same patch as the diffs of the single files """
+        patches = []
+        for engine, workers in ((ENGINE_GNU, 1), (ENGINE_PYTHON, 1),
+                                (ENGINE_GNU, 3), (ENGINE_PYTHON, 3)):
+            with TmpDirectory() as dir:
+                old_dir = os.getcwd()
+                try:
+                    os.chdir(dir.get_name())
+                    self._make_files()
+                    orig_engine = Diff.engine
+                    Diff.engine = engine
+                    cmd = quilt.refresh.Refresh(".", ".pc", ".")
+                    cmd.diff_workers = workers
+                    try:
+                        cmd.refresh()
+                    finally:
+                        Diff.engine = orig_engine
+                    with open("patch", "rb") as patch:
+                        patches.append(patch.read())
+                finally:
+                    os.chdir(old_dir)
+        for patch in patches[1:]:
+            self.assertEqual(patches[0], patch)
+        self.assertIn(b"--- /dev/null\n+++ ./new\n", patches[0])
+        self.assertIn(b"--- ./deleted\n+++ /dev/null\n", patches[0])
+
+    def test_incremental(self):
+        with TmpDirectory() as dir:
+            old_dir = os.getcwd()
+            try:
+                os.chdir(dir.get_name())
+                self._make_files()
+                cmd = quilt.refresh.Refresh(".", ".pc", ".")
+                cmd.refresh()
+                with open("patch", "rb") as patch:
+                    full = patch.read()
+
+                # change a section of the patch without touching the files
+                modified = full.replace(b"-2\n+3\n", b"-2\n+X\n")
+                self.assertNotEqual(modified, full)
+                make_file(modified, "patch")
+                now = time.time()
+                os.utime("patch", (now - 10, now - 10))
+                os.utime(os.path.join(".pc", "patch", ".timestamp"),
+                         (now + 5, now + 5))
+                make_file(b"a\nC\nc", "changed")
+                os.utime("changed", (now + 10, now + 10))
+
+                cmd.refresh(incremental=True)
+                with open("patch", "rb") as patch:
+                    incremental = patch.read()
+                self.assertEqual(incremental, modified.replace(b"+B", b"+C"))
+
+                cmd.refresh()
+                with open("patch", "rb") as patch:
+                    self.assertEqual(patch.read(),
+                                     full.replace(b"+B", b"+C"))
+            finally:
+                os.chdir(old_dir)
+
+    def test_incremental_after_offset(self):
+        """ Sections of a patch pushed with an offset must be recreated """
+        patch = b"--- a/f\n+++ b/f\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+        for engine in (ENGINE_GNU, ENGINE_PYTHON):
+            incremental = self._push_and_refresh(patch, b"x\na\nb\nc\n",
+                                                 engine)
+            self.assertIn(b"@@ -1,4 +1,4 @@", incremental)
+
+    def test_incremental_after_forced_push(self):
+        """ Sections of a forcefully pushed patch must be recreated """
+        patch = b"--- a/f\n+++ b/f\n@@ -1 +1 @@\n-a\n+A\n@@ -3 +3 @@\n-z\n+Z\n"
+        for engine in (ENGINE_GNU, ENGINE_PYTHON):
+            incremental = self._push_and_refresh(patch, b"a\nb\nc\n",
+                                                 engine, force=True)
+            self.assertIn(b"@@ -1,3 +1,3 @@\n-a\n+A\n b\n c\n", incremental)
+
+    def _push_and_refresh(self, patch, contents, engine, force=False):
+        """ Pushes patch onto the file f with contents and returns the patch
+        after an incremental refresh """
+        old_engine = Patch.engine
+        old_dir = os.getcwd()
+        with tmp_series() as [dir, series], \
+                tmp_mapping(vars(sys)) as tmp_sys:
+            tmp_sys.set("stdout", cStringIO())
+            tmp_sys.set("stderr", cStringIO())
+            try:
+                Patch.engine = engine
+                os.chdir(dir)
+                index = os.path.basename(dir).encode() + b"/f"
+                make_file(b"Index: " + index + b"\n" + b"=" * 67 + b"\n" +
+                          patch, series.dirname, "patch")
+                series.add_patch(Patch("patch"))
+                series.save()
+                make_file(contents, "f")
+
+                push = Push(dir, ".pc", series.dirname)
+                timestamp = os.path.join(".pc", "patch", ".timestamp")
+                if force:
+                    with self.assertRaises(QuiltError):
+                        push.apply_all(quiet=True, force=True)
+                    # a timestamp left from before must not be used
+                    make_file(b"", timestamp)
+                else:
+                    push.apply_all(quiet=True)
+                if os.path.exists(timestamp):
+                    # make the timestamp newer than all files
+                    now = time.time()
+                    os.utime(timestamp, (now + 10, now + 10))
+
+                cmd = quilt.refresh.Refresh(dir, ".pc", series.dirname)
+                cmd.refresh(incremental=True)
+                with open(os.path.join(series.dirname, "patch"), "rb") as f:
+                    incremental = f.read()
+                # a full refresh has to produce the same patch
+                with six.assertRaisesRegex(self, QuiltError,
+                                           "Nothing to refresh"):
+                    cmd.refresh()
+            finally:
+                Patch.engine = old_engine
+                os.chdir(old_dir)
+        return incremental
+
+    def _make_files(self):
+        db = Db(".pc")
+        db.create()
+        backup = os.path.join(".pc", "patch")
+        os.makedirs(os.path.join(backup, "sub"))
+        db.add_patch(Patch("patch"))
+        db.save()
+        make_file(b"header\n", "patch")
+
+        make_file(b"a\nb\nc\n", backup, "changed")
+        make_file(b"a\nB\nc", "changed")
+        make_file(b"", backup, "new")
+        make_file(b"new\n", "new")
+        make_file(b"deleted\n", backup, "deleted")
+        make_file(b"same\n", backup, "same")
+        make_file(b"same\n", "same")
+        make_file(b"1\n2\n", backup, "sub", "file")
+        os.mkdir("sub")
+        make_file(b"1\n3\n", "sub", "file")
@@ -37,3 +37,81 @@ class Test(TestCase):
                     self.assertEqual(file.read(), b"unreverted change\n")
             finally:
                 os.chdir(old_dir)
+
+    def test_revert_files(self):
+        """ Revert several files in sub directories at once """
+        with tmp_series() as [dir, series]:
+            old_dir = os.getcwd()
+            try:
+                os.chdir(dir)
+                db = Db(dir)
+                db.add_patch(Patch("patch"))
+                db.save()
+                originals = os.path.join(db.dirname, "patch")
+                os.makedirs(os.path.join(originals, "sub"))
+                make_file(b"a original\n", originals, "sub", "a")
+                make_file(b"", originals, "sub", "new")
+                os.mkdir(os.path.join(dir, "sub"))
+                make_file(b"a patched\n", dir, "sub", "a")
+                make_file(b"new patched\n", dir, "sub", "new")
+                Refresh(dir, db.dirname, series.dirname).refresh()
+                make_file(b"a change\n", dir, "sub", "a")
+                make_file(b"new change\n", dir, "sub", "new")
+                cmd = quilt.revert.Revert(dir, db.dirname, series.dirname)
+                cmd.revert_files(["sub/a", "sub/new"])
+                with open(os.path.join(dir, "sub", "a"), "rb") as file:
+                    self.assertEqual(file.read(), b"a patched\n")
+                with open(os.path.join(dir, "sub", "new"), "rb") as file:
+                    self.assertEqual(file.read(), b"new patched\n")
+
+                unchanged = []
+                def file_unchanged(file, patch):
+                    unchanged.append(file.get_name())
+                cmd.file_unchanged.connect(file_unchanged)
+                try:
+                    cmd.revert_file("sub/a")
+                finally:
+                    cmd.file_unchanged.disconnect(file_unchanged)
+                self.assertEqual(unchanged, ["sub/a"])
+
+                # the file name is normalized to find its changes
+                make_file(b"a change\n", dir, "sub", "a")
+                cmd.revert_file("./sub//a")
+                with open(os.path.join(dir, "sub", "a"), "rb") as file:
+                    self.assertEqual(file.read(), b"a patched\n")
+            finally:
+                os.chdir(old_dir)
+
+    def test_binary_section(self):
+        """ Revert a file of a patch with binary sections """
+        with tmp_series() as [dir, series]:
+            old_dir = os.getcwd()
+            try:
+                os.chdir(dir)
+                db = Db(dir)
+                db.add_patch(Patch("patch"))
+                db.save()
+                series.add_patch(Patch("patch"))
+                series.save()
+                make_file(b"--- a/f\n+++ b/f\n@@ -1 +1 @@\n-old\n+new\n"
+                          b"diff -ruN a/bin b/bin\n"
+                          b"Binary files a/bin and b/bin differ\n"
+                          b"diff --git a/g b/g\n"
+                          b"Binary files a/g and b/g differ\n",
+                          series.dirname, "patch")
+                originals = os.path.join(db.dirname, "patch")
+                os.mkdir(originals)
+                make_file(b"old\n", originals, "f")
+                make_file(b"\0g\n", originals, "g")
+                make_file(b"change\n", dir, "f")
+                make_file(b"\0change\n", dir, "g")
+
+                cmd = quilt.revert.Revert(dir, db.dirname, series.dirname)
+                cmd.revert_files(["f", "g"])
+                with open(os.path.join(dir, "f"), "rb") as file:
+                    self.assertEqual(file.read(), b"new\n")
+                # GNU patch can't apply the binary section
+                with open(os.path.join(dir, "g"), "rb") as file:
+                    self.assertEqual(file.read(), b"\0g\n")
+            finally:
+                os.chdir(old_dir)
@@ -0,0 +1,53 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import os.path
+
+from helpers import QuiltTest, tmp_series
+
+from quilt.db import Db, Series
+from quilt.new import New
+from quilt.patch import Patch
+from quilt.pop import Pop
+from quilt.session import Session
+
+
+class SessionTest(QuiltTest):
+
+    def test_shared_meta_data(self):
+        with tmp_series() as [dir, series]:
+            pc_dir = os.path.join(dir, ".pc")
+            session = Session(pc_dir, series.dirname)
+
+            new = New(dir, None, None, session=session)
+            pop = Pop(dir, None, session=session)
+            self.assertIs(new.db, pop.db)
+            self.assertIs(new.series, session.series)
+
+            new.create("p1.patch")
+            new.create("p2.patch")
+            self.assertEqual(Patch("p2.patch"), pop.db.top_patch())
+
+            pop.unapply_top_patch()
+            self.assertEqual(Patch("p1.patch"), new.db.top_patch())
+            self.assertFalse(session.db.is_dirty())
+            self.assertFalse(session.series.is_dirty())
+
+            self.assertEqual([Patch("p1.patch")], Db(pc_dir).patches())
+            self.assertEqual([Patch("p1.patch"), Patch("p2.patch")],
+                             Series(series.dirname).patches())
+
+    def test_save_only_loaded(self):
+        with tmp_series() as [dir, series]:
+            session = Session(os.path.join(dir, ".pc"), series.dirname)
+            session.save()
+            self.assertFalse(os.path.exists(session.quilt_pc.get_name()))
+
+
+if __name__ == "__main__":
+    SessionTest.run_tests()
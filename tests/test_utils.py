@@ -0,0 +1,255 @@
+# vim: fileencoding=utf-8 et sw=4 ts=4 tw=80:
+
+# python-quilt - A Python implementation of the quilt patch system
+#
+# Copyright (C) 2017 Björn Ricks <bjoern.ricks@gmail.com>
+#
+# See LICENSE comming with the source of python-quilt for details.
+
+import os
+import os.path
+
+from helpers import QuiltTest, make_file
+
+from quilt.utils import AtomicFile, BufferedWriter, ComparingAtomicFile, \
+    File, Process, TmpFile, TmpDirectory, files_equal, \
+    copy_file, COPY_REFLINK, COPY_FILE_RANGE, COPY_SENDFILE, COPY_USERSPACE, \
+    _copy_fd
+
+
+class AtomicFileTest(QuiltTest):
+
+    def test_replace(self):
+        with TmpDirectory() as dir:
+            make_file(b"old\n", dir.get_name(), "file")
+            filename = os.path.join(dir.get_name(), "file")
+            os.chmod(filename, 0o640)
+
+            with AtomicFile(filename, sync=True) as f:
+                f.write(b"new\n")
+
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"new\n")
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+            self.assertEqual(os.listdir(dir.get_name()), ["file"])
+
+    def test_symlink(self):
+        """ The target of a symbolic link is replaced """
+        with TmpDirectory() as dir:
+            os.mkdir(os.path.join(dir.get_name(), "sub"))
+            make_file(b"old\n", dir.get_name(), "sub", "file")
+            link = os.path.join(dir.get_name(), "link")
+            os.symlink(os.path.join("sub", "file"), link)
+
+            with AtomicFile(link) as f:
+                f.write(b"new\n")
+            with ComparingAtomicFile(link) as f:
+                f.write(b"newer\n")
+
+            self.assertTrue(os.path.islink(link))
+            with open(os.path.join(dir.get_name(), "sub", "file"), "rb") as f:
+                self.assertEqual(f.read(), b"newer\n")
+            self.assertEqual(os.listdir(os.path.join(dir.get_name(), "sub")),
+                             ["file"])
+
+    def test_error_keeps_old_content(self):
+        with TmpDirectory() as dir:
+            make_file(b"old\n", dir.get_name(), "file")
+            filename = os.path.join(dir.get_name(), "file")
+
+            try:
+                with AtomicFile(filename) as f:
+                    f.write(b"partial")
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"old\n")
+            self.assertEqual(os.listdir(dir.get_name()), ["file"])
+
+
+class BufferedWriterTest(QuiltTest):
+
+    def test_write(self):
+        with TmpFile() as tmp:
+            writer = BufferedWriter(tmp.fd, buffer_size=10)
+            writer.write(b"abc")
+            writer.write(b"def")
+            self.assertEqual(writer.syscalls, 0)
+            writer.write(b"ghij")
+            self.assertEqual((writer.syscalls, writer.bytes_written), (1, 10))
+            writer.write(b"k")
+            writer.write(b"0123456789")
+            self.assertEqual((writer.syscalls, writer.bytes_written), (2, 21))
+            writer.write(b"l")
+            self.assertEqual(writer.fileno(), tmp.fd)
+            self.assertEqual(writer.syscalls, 3)
+            writer.flush()
+            self.assertEqual(writer.syscalls, 3)
+            with open(tmp.get_name(), "rb") as f:
+                self.assertEqual(f.read(), b"abcdefghijk0123456789l")
+
+    def test_subprocess(self):
+        """ Pending data is written before a subprocess appends """
+        with TmpFile() as tmp:
+            writer = BufferedWriter(tmp.fd)
+            writer.write(b"before\n")
+            Process(["echo", "process"]).run(stdout=writer.fileno())
+            writer.write(b"after\n")
+            writer.flush()
+            with open(tmp.get_name(), "rb") as f:
+                self.assertEqual(f.read(), b"before\nprocess\nafter\n")
+
+
+class TmpFileTest(QuiltTest):
+
+    def test_write_copy(self):
+        """ Written data is visible to operations using the file name """
+        with TmpDirectory() as dir:
+            with TmpFile(dir=dir.get_name()) as tmp:
+                tmp.write(b"content\n")
+                copy = File(os.path.join(dir.get_name(), "copy"))
+                tmp.copy(copy)
+            with open(copy.get_name(), "rb") as f:
+                self.assertEqual(f.read(), b"content\n")
+
+
+class ComparingAtomicFileTest(QuiltTest):
+
+    def _write(self, filename, *chunks):
+        with ComparingAtomicFile(filename) as f:
+            for chunk in chunks:
+                f.write(chunk)
+            return f.changed()
+
+    def test_compare(self):
+        with TmpDirectory() as dir:
+            filename = os.path.join(dir.get_name(), "sub", "file")
+            self.assertTrue(self._write(filename, b"abc", b"def"))
+            inode = os.stat(filename).st_ino
+
+            self.assertFalse(self._write(filename, b"ab", b"cdef"))
+            self.assertEqual(os.stat(filename).st_ino, inode)
+            self.assertTrue(self._write(filename, b"abc", b"de"))
+            self.assertTrue(self._write(filename, b"abc", b"defg"))
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"abcdefg")
+
+            # the temporary file is changed by someone else
+            with ComparingAtomicFile(filename) as f:
+                f.write(b"x")
+                f.flush()
+                with open(f.get_name(), "wb") as edited:
+                    edited.write(b"abcdefg")
+                f.modified()
+                self.assertFalse(f.changed())
+            self.assertEqual(os.listdir(os.path.dirname(filename)), ["file"])
+
+
+class FilesEqualTest(QuiltTest):
+
+    def test_files_equal(self):
+        with TmpDirectory() as dir:
+            def name(basename):
+                return os.path.join(dir.get_name(), basename)
+
+            make_file(b"a" * 100 + b"b", dir.get_name(), "f1")
+            make_file(b"a" * 100 + b"b", dir.get_name(), "f2")
+            make_file(b"a" * 100 + b"c", dir.get_name(), "f3")
+            make_file(b"a" * 100, dir.get_name(), "f4")
+            make_file(b"", dir.get_name(), "empty")
+            os.link(name("f1"), name("link"))
+
+            self.assertTrue(files_equal(name("f1"), name("f2"), 7))
+            self.assertTrue(files_equal(name("f1"), name("link")))
+            self.assertFalse(files_equal(name("f1"), name("f3"), 7))
+            self.assertFalse(files_equal(name("f1"), name("f4")))
+            self.assertTrue(files_equal(name("empty"), os.devnull))
+            self.assertFalse(files_equal(os.devnull, name("f1")))
+
+
+class LinkOrCopyTest(QuiltTest):
+
+    def test_link_or_copy(self):
+        with TmpDirectory() as dir:
+            def name(*basename):
+                return os.path.join(dir.get_name(), *basename)
+
+            make_file(b"content\n", dir.get_name(), "file")
+            self.assertTrue(File(name("file")).link_or_copy(
+                File(name("backup", "file"))))
+            self.assertEqual(os.stat(name("file")).st_ino,
+                             os.stat(name("backup", "file")).st_ino)
+
+            # files with other links are copied
+            self.assertFalse(File(name("file")).link_or_copy(
+                File(name("copy"))))
+            self.assertNotEqual(os.stat(name("file")).st_ino,
+                                os.stat(name("copy")).st_ino)
+            with open(name("copy"), "rb") as f:
+                self.assertEqual(f.read(), b"content\n")
+
+
+class CopyFileTest(QuiltTest):
+
+    def test_copy_file(self):
+        with TmpDirectory() as dir:
+            content = b"".join(b"line %d\n" % i for i in range(100000))
+            make_file(content, dir.get_name(), "file")
+            src = os.path.join(dir.get_name(), "file")
+            os.chmod(src, 0o751)
+            mtime = os.stat(src).st_mtime - 100
+            os.utime(src, (mtime, mtime))
+
+            strategy = copy_file(src, os.path.join(dir.get_name(), "copy"))
+            self.assertTrue(strategy in (COPY_REFLINK, COPY_FILE_RANGE,
+                                         COPY_SENDFILE, COPY_USERSPACE))
+            st = os.stat(os.path.join(dir.get_name(), "copy"))
+            self.assertEqual(st.st_mode & 0o777, 0o751)
+            self.assertAlmostEqual(st.st_mtime, mtime, places=3)
+            with open(os.path.join(dir.get_name(), "copy"), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+            # copy into a directory and overwrite an existing file
+            os.mkdir(os.path.join(dir.get_name(), "sub"))
+            make_file(b"old content which is longer\n", dir.get_name(),
+                      "sub", "file")
+            File(src).copy(File(os.path.join(dir.get_name(), "sub", "x")))
+            copy_file(src, os.path.join(dir.get_name(), "sub"))
+            with open(os.path.join(dir.get_name(), "sub", "file"), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def test_copy_special_file(self):
+        with TmpDirectory() as dir:
+            dest = os.path.join(dir.get_name(), "null")
+            self.assertEqual(copy_file(os.devnull, dest), COPY_USERSPACE)
+            self.assertEqual(os.path.getsize(dest), 0)
+
+            # files of procfs have a size of 0
+            if os.path.exists("/proc/self/status"):
+                copy_file("/proc/self/status", dest)
+                self.assertTrue(os.path.getsize(dest) > 0)
+
+    def test_copy_grown_file(self):
+        """ The file is copied until its end even if it has grown """
+        with TmpDirectory() as dir:
+            content = b"x" * 100000
+            make_file(content, dir.get_name(), "file")
+            src_fd = os.open(os.path.join(dir.get_name(), "file"),
+                             os.O_RDONLY)
+            try:
+                dest_fd = os.open(os.path.join(dir.get_name(), "copy"),
+                                  os.O_WRONLY | os.O_CREAT)
+                try:
+                    _copy_fd(src_fd, dest_fd, 10)
+                finally:
+                    os.close(dest_fd)
+            finally:
+                os.close(src_fd)
+            with open(os.path.join(dir.get_name(), "copy"), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+
+if __name__ == "__main__":
+    AtomicFileTest.run_tests()